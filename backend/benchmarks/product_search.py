@@ -0,0 +1,70 @@
+"""
+Product search benchmark
+
+Builds the in-memory search index over a synthetic trilingual catalog and
+times type-ahead queries against it. No database is needed.
+
+    cd backend
+    python -m benchmarks.product_search --products 100000
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from services.product_search import SearchIndex, rank
+
+WORDS_EN = ["rice", "samba", "nadu", "keeri", "dhal", "mysore", "red", "sugar", "brown", "white",
+            "milk", "powder", "full", "cream", "tea", "leaves", "coconut", "oil", "soap", "biscuit",
+            "chocolate", "cracker", "noodles", "chilli", "curry", "salt", "flour", "bread", "butter", "jam"]
+WORDS_SI = ["සහල්", "සම්බා", "නාඩු", "පරිප්පු", "සීනි", "කිරි", "පිටි", "තේ", "පොල්", "තෙල්",
+            "සබන්", "බිස්කට්", "ලුණු", "මිරිස්", "පාන්", "බටර්", "ජෑම්", "ක්‍රීම්"]
+WORDS_TA = ["அரிசி", "சம்பா", "பருப்பு", "சீனி", "பால்", "மா", "தேநீர்", "தேங்காய்", "எண்ணெய்",
+            "சவர்க்காரம்", "பிஸ்கட்", "உப்பு", "மிளகாய்", "பாண்", "வெண்ணெய்"]
+QUERIES = ["r", "ri", "ric", "rice", "rice sam", "sam", "SKU0001", "SKU0123", "4790012", "ream",
+           "milk powder", "සහ", "සහල්", "ක්රීම්", "அரி", "பால்", "coconut oil", "xyz"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time product search against a synthetic catalog")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    return parser.parse_args()
+
+
+def catalog(count):
+    random.seed(7)
+    for i in range(count):
+        yield {
+            "id": f"p{i}",
+            "sku": f"SKU{i:06d}",
+            "barcodes": [f"479{random.randint(0, 10**10):010d}"],
+            "name_en": " ".join(random.sample(WORDS_EN, 3)) + f" {random.choice([100, 250, 400, 500])}g",
+            "name_si": " ".join(random.sample(WORDS_SI, 2)),
+            "name_ta": " ".join(random.sample(WORDS_TA, 2)),
+        }
+
+
+def main():
+    args = parse_args()
+    index = SearchIndex()
+    started = time.perf_counter()
+    for product in catalog(args.products):
+        index.add(product)
+    print(f"Indexed {len(index)} products ({len(index.postings)} tokens) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'query':<16} {'matches':>8} {'median':>10} {'max':>10}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            scores = index.search(query)
+            rank(scores, 20)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{query:<16} {len(scores):>8} {statistics.median(timings):>8.2f}ms {max(timings):>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
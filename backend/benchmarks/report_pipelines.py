@@ -0,0 +1,218 @@
+"""
+Report pipeline benchmark
+
+Seeds a throwaway database with synthetic sales and times the old
+load-everything Python report loops against the aggregation pipelines in
+services.report_service, including peak Python memory for each.
+
+    cd backend
+    python -m benchmarks.report_pipelines --sales 1000000 --database pos_benchmark
+
+The target database is dropped and reseeded unless --skip-seed is given.
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import uuid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare Python report loops with aggregation pipelines")
+    parser.add_argument("--sales", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--customers", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--database", default="pos_benchmark")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse an already seeded database")
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the pipelines")
+    return parser.parse_args()
+
+
+args = parse_args()
+if args.database == os.environ.get('DATABASE_NAME', 'pos_system'):
+    sys.exit("Refusing to benchmark against the application database")
+# Must be set before utils.database is imported
+os.environ['DATABASE_NAME'] = args.database
+
+from utils.database import registry  # noqa: E402
+from services import report_service as reports  # noqa: E402
+
+db = registry.database("bulk")
+CATEGORIES = ["Rice", "Dairy", "Beverages", "Snacks", "Spices", "Household", "Bakery", "Frozen"]
+RULES = ["Bulk 5%", "Weekend Deal", "Loyalty 10%", "Manual Discount"]
+
+
+def seed():
+    random.seed(42)
+    registry.client("bulk").drop_database(args.database)
+    # Recreate the report indexes on the fresh database
+    db['sales'].create_index([('status', 1), ('created_at', 1)])
+    db['products'].create_index([('id', 1)])
+
+    products = [{
+        "id": str(uuid.uuid4()),
+        "sku": f"SKU{i:06d}",
+        "name_en": f"Product {i}",
+        "category": random.choice(CATEGORIES),
+        "price_retail": round(random.uniform(50, 2000), 2),
+    } for i in range(args.products)]
+    db['products'].insert_many(products, ordered=False)
+    customers = [(str(uuid.uuid4()), f"Customer {i}") for i in range(args.customers)]
+
+    now = datetime.utcnow()
+    batch = []
+    started = time.perf_counter()
+    for n in range(args.sales):
+        items = []
+        for product in random.sample(products, random.randint(1, 8)):
+            quantity = random.randint(1, 5)
+            subtotal = product["price_retail"] * quantity
+            discount = round(subtotal * 0.05, 2) if random.random() < 0.2 else 0
+            item = {
+                "product_id": product["id"],
+                "sku": product["sku"],
+                "name": product["name_en"],
+                "quantity": quantity,
+                "unit_price": product["price_retail"],
+                "subtotal": subtotal,
+                "discount_amount": discount,
+                "total": subtotal - discount,
+            }
+            if discount:
+                item["applied_rule"] = random.choice(RULES)
+            items.append(item)
+
+        customer_id, customer_name = random.choice(customers) if random.random() < 0.6 else ("", "Walk-in")
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "invoice_number": f"BENCH-{n:08d}",
+            "items": items,
+            "subtotal": sum(item["subtotal"] for item in items),
+            "total_discount": sum(item["discount_amount"] for item in items),
+            "total": sum(item["total"] for item in items),
+            "customer_id": customer_id,
+            "customer_name": customer_name,
+            "status": "completed" if random.random() < 0.97 else "cancelled",
+            "created_at": (now - timedelta(seconds=random.randint(0, args.days * 86400))).isoformat(),
+        })
+        if len(batch) >= args.batch_size:
+            db['sales'].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db['sales'].insert_many(batch, ordered=False)
+    print(f"Seeded {args.sales} sales in {time.perf_counter() - started:.1f}s")
+
+
+# ---- Legacy implementations (as they were in server.py) ----
+
+def _legacy_sales(start_date="", end_date=""):
+    query = {"status": "completed"}
+    if start_date:
+        query["created_at"] = {"$gte": start_date}
+    if end_date:
+        query.setdefault("created_at", {})["$lte"] = end_date
+    return list(db['sales'].find(query, {"_id": 0}))
+
+
+def legacy_top_products(start_date="", end_date="", limit=10):
+    product_stats = {}
+    for sale in _legacy_sales(start_date, end_date):
+        for item in sale.get("items", []):
+            product_id = item.get("product_id")
+            if product_id not in product_stats:
+                product_stats[product_id] = {"product_id": product_id, "sku": item.get("sku", ""),
+                                             "name": item.get("name", ""), "quantity_sold": 0, "revenue": 0}
+            product_stats[product_id]["quantity_sold"] += item.get("quantity", 0)
+            product_stats[product_id]["revenue"] += item.get("total", 0)
+    return sorted(product_stats.values(), key=lambda x: x["revenue"], reverse=True)[:limit]
+
+
+def legacy_top_categories(start_date="", end_date=""):
+    sales = _legacy_sales(start_date, end_date)
+    products = {p["id"]: p for p in db['products'].find({}, {"_id": 0})}
+    category_stats = {}
+    for sale in sales:
+        for item in sale.get("items", []):
+            product_id = item.get("product_id")
+            if product_id in products:
+                category = products[product_id].get("category", "Uncategorized")
+                stats = category_stats.setdefault(category, {"category": category, "quantity_sold": 0,
+                                                             "revenue": 0, "items_count": 0})
+                stats["quantity_sold"] += item.get("quantity", 0)
+                stats["revenue"] += item.get("total", 0)
+                stats["items_count"] += 1
+    return sorted(category_stats.values(), key=lambda x: x["revenue"], reverse=True)
+
+
+def legacy_discount_usage(start_date="", end_date=""):
+    sales = _legacy_sales(start_date, end_date)
+    total_discount = sum(sale.get("total_discount", 0) for sale in sales)
+    invoices_with_discount = sum(1 for sale in sales if sale.get("total_discount", 0) > 0)
+    rule_stats = {}
+    for sale in sales:
+        for item in sale.get("items", []):
+            if item.get("discount_amount", 0) > 0:
+                rule_name = item.get("applied_rule", "Manual Discount")
+                stats = rule_stats.setdefault(rule_name, {"rule_name": rule_name, "times_applied": 0,
+                                                          "total_discount": 0})
+                stats["times_applied"] += 1
+                stats["total_discount"] += item.get("discount_amount", 0)
+    return {"total_discount": total_discount, "invoices_with_discount": invoices_with_discount,
+            "total_invoices": len(sales), "rule_usage": list(rule_stats.values())}
+
+
+def legacy_customer_stats(start_date="", end_date=""):
+    customer_stats = {}
+    for sale in _legacy_sales(start_date, end_date):
+        customer_id = sale.get("customer_id") or "walk-in"
+        stats = customer_stats.setdefault(customer_id, {"customer_id": customer_id,
+                                                        "customer_name": sale.get("customer_name", "Walk-in"),
+                                                        "total_purchases": 0, "total_spent": 0})
+        stats["total_purchases"] += 1
+        stats["total_spent"] += sale.get("total", 0)
+    return sorted(customer_stats.values(), key=lambda x: x["total_spent"], reverse=True)
+
+
+def measure(label, func, *func_args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(*func_args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rows = len(result) if isinstance(result, list) else len(result.get("rule_usage", []))
+    print(f"  {label:<10} {elapsed:>9.2f}s {peak / 1024 / 1024:>10.1f} MB {rows:>8} rows")
+    return result
+
+
+def main():
+    if not args.skip_seed:
+        seed()
+
+    windows = {
+        "30 days": ((datetime.utcnow() - timedelta(days=30)).isoformat(), ""),
+        "all time": ("", ""),
+    }
+    cases = [
+        ("top_products", legacy_top_products, reports.top_products),
+        ("top_categories", legacy_top_categories, reports.top_categories),
+        ("discount_usage", legacy_discount_usage, reports.discount_usage),
+        ("customer_stats", legacy_customer_stats, reports.customer_stats),
+    ]
+    print(f"{'report':<10} {'time':>10} {'peak mem':>13} {'rows':>13}")
+    for window, (start_date, end_date) in windows.items():
+        for name, legacy, pipeline in cases:
+            print(f"{name} ({window})")
+            if not args.skip_legacy:
+                measure("python", legacy, start_date, end_date)
+            measure("pipeline", pipeline, start_date, end_date)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
+import codecs
 import csv
 import io
-from typing import List, Dict, Any
+import zlib
+from typing import List, Dict, Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional
 from datetime import datetime
 
-def validate_product_csv(data: List[Dict[str, Any]]) -> tuple[bool, List[str], List[Dict]]:
-    """Validate product CSV data"""
+def validate_product_csv(data: List[Dict[str, Any]], start: int = 1) -> tuple[bool, List[str], List[Dict]]:
+    """Validate product CSV data (start is the row number of data[0], for chunked files)"""
     errors = []
     valid_rows = []
     required_fields = ['sku', 'name_en', 'price_retail']
     
-    for i, row in enumerate(data, start=1):
+    for i, row in enumerate(data, start=start):
         row_errors = []
         
         # Check required fields
@@ -124,99 +126,161 @@ def validate_discount_rule_csv(data: List[Dict[str, Any]]) -> tuple[bool, List[s
     
     return len(errors) == 0, errors, valid_rows
 
+# ==================== EXPORT ====================
+
+# Rows are buffered until roughly this many characters, then flushed as one chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+# Documents fetched per cursor round trip while exporting
+EXPORT_BATCH_SIZE = 1000
+
+PRODUCT_FIELDS = ['sku', 'barcodes', 'name_en', 'name_si', 'name_ta', 'unit', 'category',
+                  'tax_code', 'supplier_id', 'price_retail', 'price_wholesale', 'price_credit',
+                  'price_other', 'stock', 'reorder_level', 'weight_based', 'active']
+CUSTOMER_FIELDS = ['name', 'phone', 'email', 'category', 'default_tier', 'address', 'tax_id', 'notes', 'active']
+SUPPLIER_FIELDS = ['name', 'phone', 'email', 'address', 'tax_id', 'notes', 'active']
+DISCOUNT_RULE_FIELDS = ['name', 'rule_type', 'target_id', 'discount_type', 'discount_value',
+                        'max_discount', 'min_quantity', 'max_quantity', 'auto_apply', 'active']
+SALE_FIELDS = ['invoice_number', 'customer_name', 'price_tier', 'subtotal',
+               'total_discount', 'tax_amount', 'total', 'status', 'created_at']
+
+
+class CsvChunkEncoder:
+    """Renders CSV rows into UTF-8 chunks, optionally gzip-compressed on the fly"""
+
+    def __init__(self, compress: bool = False, chunk_size: int = STREAM_CHUNK_SIZE):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.chunk_size = chunk_size
+        # wbits=31 writes a gzip container rather than a raw zlib stream
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def _drain(self) -> bytes:
+        data = self.buffer.getvalue().encode('utf-8')
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return self.compressor.compress(data) if self.compressor else data
+
+    def add(self, row: Iterable[Any]) -> bytes:
+        """Write a row; returns a chunk once enough output is buffered, else b''"""
+        self.writer.writerow(row)
+        if self.buffer.tell() >= self.chunk_size:
+            return self._drain()
+        return b''
+
+    def close(self) -> bytes:
+        chunk = self._drain()
+        if self.compressor:
+            chunk += self.compressor.flush()
+        return chunk
+
+
+def stream_csv(rows: Iterable[Iterable[Any]], compress: bool = False) -> Iterator[bytes]:
+    """Stream CSV rows (header included) from any iterable, such as a cursor"""
+    encoder = CsvChunkEncoder(compress)
+    for row in rows:
+        chunk = encoder.add(row)
+        if chunk:
+            yield chunk
+    chunk = encoder.close()
+    if chunk:
+        yield chunk
+
+
+async def astream_csv(rows: AsyncIterable[Iterable[Any]], compress: bool = False) -> AsyncIterator[bytes]:
+    """stream_csv for async sources such as Motor cursors"""
+    encoder = CsvChunkEncoder(compress)
+    async for row in rows:
+        chunk = encoder.add(row)
+        if chunk:
+            yield chunk
+    chunk = encoder.close()
+    if chunk:
+        yield chunk
+
+
+def document_rows(documents: Iterable[Dict], fieldnames: List[str],
+                  prepare: Optional[Callable[[Dict], Dict]] = None) -> Iterator[List[Any]]:
+    """Header plus one row per document; nothing at all when there are no documents"""
+    header_written = False
+    for doc in documents:
+        if not header_written:
+            yield fieldnames
+            header_written = True
+        row = {k: doc.get(k, '') for k in fieldnames}
+        if prepare:
+            row = prepare(row)
+        yield [row[k] for k in fieldnames]
+
+
+def _product_row(row: Dict) -> Dict:
+    # Convert list to comma-separated string
+    if isinstance(row.get('barcodes'), list):
+        row['barcodes'] = ','.join(row['barcodes'])
+    return row
+
+
+def stream_products_csv(products: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    return stream_csv(document_rows(products, PRODUCT_FIELDS, _product_row), compress)
+
+
+def stream_customers_csv(customers: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    return stream_csv(document_rows(customers, CUSTOMER_FIELDS), compress)
+
+
+def stream_suppliers_csv(suppliers: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    return stream_csv(document_rows(suppliers, SUPPLIER_FIELDS), compress)
+
+
+def stream_discount_rules_csv(rules: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    return stream_csv(document_rows(rules, DISCOUNT_RULE_FIELDS), compress)
+
+
+def stream_sales_csv(sales: Iterable[Dict], compress: bool = False) -> Iterator[bytes]:
+    return stream_csv(document_rows(sales, SALE_FIELDS), compress)
+
+
+def export_projection(fieldnames: List[str]) -> Dict[str, int]:
+    """Projection fetching only the exported fields"""
+    return {"_id": 0, **{field: 1 for field in fieldnames}}
+
+
+def _join(chunks: Iterator[bytes]) -> str:
+    return b''.join(chunks).decode('utf-8')
+
+
 def products_to_csv(products: List[Dict]) -> str:
     """Convert products to CSV string"""
-    if not products:
-        return ""
-    
-    output = io.StringIO()
-    fieldnames = ['sku', 'barcodes', 'name_en', 'name_si', 'name_ta', 'unit', 'category', 
-                  'tax_code', 'supplier_id', 'price_retail', 'price_wholesale', 'price_credit', 
-                  'price_other', 'stock', 'reorder_level', 'weight_based', 'active']
-    
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for product in products:
-        row = {k: product.get(k, '') for k in fieldnames}
-        # Convert list to comma-separated string
-        if isinstance(row.get('barcodes'), list):
-            row['barcodes'] = ','.join(row['barcodes'])
-        writer.writerow(row)
-    
-    return output.getvalue()
+    return _join(stream_products_csv(products))
 
 def customers_to_csv(customers: List[Dict]) -> str:
     """Convert customers to CSV string"""
-    if not customers:
-        return ""
-    
-    output = io.StringIO()
-    fieldnames = ['name', 'phone', 'email', 'category', 'default_tier', 'address', 'tax_id', 'notes', 'active']
-    
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for customer in customers:
-        row = {k: customer.get(k, '') for k in fieldnames}
-        writer.writerow(row)
-    
-    return output.getvalue()
+    return _join(stream_customers_csv(customers))
 
 def suppliers_to_csv(suppliers: List[Dict]) -> str:
     """Convert suppliers to CSV string"""
-    if not suppliers:
-        return ""
-    
-    output = io.StringIO()
-    fieldnames = ['name', 'phone', 'email', 'address', 'tax_id', 'notes', 'active']
-    
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for supplier in suppliers:
-        row = {k: supplier.get(k, '') for k in fieldnames}
-        writer.writerow(row)
-    
-    return output.getvalue()
+    return _join(stream_suppliers_csv(suppliers))
 
 def discount_rules_to_csv(rules: List[Dict]) -> str:
     """Convert discount rules to CSV string"""
-    if not rules:
-        return ""
-    
-    output = io.StringIO()
-    fieldnames = ['name', 'rule_type', 'target_id', 'discount_type', 'discount_value', 
-                  'max_discount', 'min_quantity', 'max_quantity', 'auto_apply', 'active']
-    
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for rule in rules:
-        row = {k: rule.get(k, '') for k in fieldnames}
-        writer.writerow(row)
-    
-    return output.getvalue()
+    return _join(stream_discount_rules_csv(rules))
 
 def sales_to_csv(sales: List[Dict]) -> str:
     """Convert sales to CSV string"""
-    if not sales:
-        return ""
-    
-    output = io.StringIO()
-    fieldnames = ['invoice_number', 'customer_name', 'price_tier', 'subtotal', 
-                  'total_discount', 'tax_amount', 'total', 'status', 'created_at']
-    
-    writer = csv.DictWriter(output, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for sale in sales:
-        row = {k: sale.get(k, '') for k in fieldnames}
-        writer.writerow(row)
-    
-    return output.getvalue()
+    return _join(stream_sales_csv(sales))
 
 def parse_csv_content(content: str) -> List[Dict[str, Any]]:
     """Parse CSV content string to list of dicts"""
     reader = csv.DictReader(io.StringIO(content))
     return list(reader)
+
+def iter_csv_chunks(binary_file, chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+    """Parse a binary CSV file incrementally, yielding lists of at most chunk_size rows"""
+    reader = csv.DictReader(codecs.iterdecode(binary_file, 'utf-8'))
+    chunk = []
+    for row in reader:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,19 +1,22 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import Dict
 from utils.auth import get_current_user
 from services.backup_service import backup_service
+from services.backup_scheduler import backup_scheduler, FREQUENCY_HOURS
 
 router = APIRouter(prefix="/api/backups", tags=["backups"])
 
 
 @router.post("/create")
-def create_backup(backup_name: str = None, current_user: Dict = Depends(get_current_user)):
-    """Create a new backup (Manager only)"""
+def create_backup(backup_name: str = None, incremental: bool = False,
+                  current_user: Dict = Depends(get_current_user)):
+    """Create a new backup (Manager only); incremental=true captures only changes since the last one"""
     if current_user.get('role') != 'manager':
         raise HTTPException(status_code=403, detail="Only managers can create backups")
     
     try:
-        result = backup_service.create_backup(backup_name, current_user['id'])
+        result = backup_service.create_backup(backup_name, current_user['id'], incremental=incremental)
         return {"message": "Backup created successfully", "backup": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Backup failed: {str(e)}")
@@ -29,6 +32,23 @@ def list_backups(current_user: Dict = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=f"Failed to list backups: {str(e)}")
 
 
+@router.get("/{backup_id}/download")
+def download_backup(backup_id: str, current_user: Dict = Depends(get_current_user)):
+    """Download a stored backup as a JSON file that /api/backups/restore accepts (Manager only)"""
+    if current_user.get('role') != 'manager':
+        raise HTTPException(status_code=403, detail="Only managers can download backups")
+    
+    try:
+        chunks = backup_service.export_json(backup_id)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Backup not available: {str(e)}")
+    return StreamingResponse(
+        chunks,
+        media_type="application/json",
+        headers={"Content-Disposition": f"attachment; filename=pos_backup_{backup_id}.json"}
+    )
+
+
 @router.post("/restore/{backup_id}")
 def restore_backup(backup_id: str, current_user: Dict = Depends(get_current_user)):
     """Restore from a backup (Manager only)"""
@@ -46,14 +66,28 @@ def restore_backup(backup_id: str, current_user: Dict = Depends(get_current_user
 
 
 @router.post("/schedule")
-def schedule_backup(frequency: str = "daily", current_user: Dict = Depends(get_current_user)):
-    """Schedule automatic backups (Manager only)"""
+def schedule_backup(frequency: str = "daily", enabled: bool = True, current_user: Dict = Depends(get_current_user)):
+    """Schedule automatic backups (Manager only); frequency is hourly/daily/weekly or a number of hours"""
     if current_user.get('role') != 'manager':
         raise HTTPException(status_code=403, detail="Only managers can schedule backups")
     
-    # Placeholder for scheduling logic
+    if frequency in FREQUENCY_HOURS:
+        frequency_hours = FREQUENCY_HOURS[frequency]
+    elif frequency.isdigit() and int(frequency) > 0:
+        frequency_hours = int(frequency)
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid frequency. Use one of {list(FREQUENCY_HOURS)} or a number of hours")
+    
+    backup_service.schedule_automatic_backup(frequency_hours, enabled)
+    state = "scheduled" if enabled else "disabled"
     return {
-        "message": f"Automatic {frequency} backups scheduled",
+        "message": f"Automatic backups every {frequency_hours}h {state}",
         "frequency": frequency,
-        "note": "Scheduled backups will run automatically"
+        "schedule": backup_scheduler.status()
     }
+
+
+@router.get("/schedule")
+def get_backup_schedule(current_user: Dict = Depends(get_current_user)):
+    """Automatic backup settings, next due time and recent run history"""
+    return backup_scheduler.status()
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from typing import Dict
 from utils.auth import get_current_user
 from utils.database import settings_col
+from services.config_service import config
 
 router = APIRouter(prefix="/api", tags=["devices"])
 
@@ -9,7 +10,7 @@ router = APIRouter(prefix="/api", tags=["devices"])
 @router.get("/settings/devices")
 def get_device_settings(current_user: Dict = Depends(get_current_user)):
     """Get device configuration settings"""
-    settings = settings_col.find_one({"type": "devices"}, {"_id": 0})
+    settings = config.get("device_settings")
     if not settings:
         # Return default device settings
         return {
@@ -52,6 +53,7 @@ def save_device_settings(settings: Dict, current_user: Dict = Depends(get_curren
         {"$set": settings},
         upsert=True
     )
+    config.changed("settings")
     
     return {"message": "Device settings saved successfully"}
 
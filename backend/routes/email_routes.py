@@ -4,24 +4,19 @@ Handles email receipt delivery
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from typing import Optional
-import os
-from pymongo import MongoClient
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-router = APIRouter(prefix="/api/email", tags=["email"])
+from services.config_service import config
+from utils.database import async_db
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(mongo_url)
-db = client[db_name]
+router = APIRouter(prefix="/api/email", tags=["email"])
 
-store_settings_col = db['store_settings']
-sales_col = db['sales']
+sales_col = async_db['sales']
 
 
 class SendReceiptRequest(BaseModel):
@@ -31,14 +26,29 @@ class SendReceiptRequest(BaseModel):
     language: Optional[str] = "en"  # en, si, ta
 
 
-def get_email_settings():
+async def get_email_settings():
     """Get email settings from store settings"""
-    settings = store_settings_col.find_one({}, {"_id": 0})
+    settings = config.get("store_settings")
     if not settings or not settings.get('email_enabled'):
         return None
     return settings
 
 
+def smtp_send(email_settings, message=None, timeout=None):
+    """
+    Open an SMTP session with the store settings and optionally send a message.
+    smtplib is blocking, so callers run this in the thread pool.
+    """
+    smtp_args = (email_settings['smtp_host'], email_settings['smtp_port'])
+    smtp_kwargs = {"timeout": timeout} if timeout else {}
+    with smtplib.SMTP(*smtp_args, **smtp_kwargs) as server:
+        server.starttls()
+        if email_settings.get('smtp_username') and email_settings.get('smtp_password'):
+            server.login(email_settings['smtp_username'], email_settings['smtp_password'])
+        if message is not None:
+            server.send_message(message)
+
+
 def generate_receipt_html(sale, store_info, language='en'):
     """Generate HTML email template for receipt"""
     
@@ -144,12 +154,12 @@ async def send_receipt(request: SendReceiptRequest):
     """Send receipt via email"""
     try:
         # Get email settings
-        email_settings = get_email_settings()
+        email_settings = await get_email_settings()
         if not email_settings:
             raise HTTPException(status_code=400, detail="Email is not configured. Please configure SMTP settings in Store Settings.")
         
         # Get sale
-        sale = sales_col.find_one({"invoice_number": request.invoice_number}, {"_id": 0})
+        sale = await sales_col.find_one({"invoice_number": request.invoice_number}, {"_id": 0})
         if not sale:
             raise HTTPException(status_code=404, detail="Invoice not found")
         
@@ -167,11 +177,7 @@ async def send_receipt(request: SendReceiptRequest):
         
         # Send email
         try:
-            with smtplib.SMTP(email_settings['smtp_host'], email_settings['smtp_port']) as server:
-                server.starttls()
-                if email_settings.get('smtp_username') and email_settings.get('smtp_password'):
-                    server.login(email_settings['smtp_username'], email_settings['smtp_password'])
-                server.send_message(message)
+            await run_in_threadpool(smtp_send, email_settings, message)
             
             return {
                 "success": True,
@@ -192,15 +198,12 @@ async def send_receipt(request: SendReceiptRequest):
 async def test_email_config():
     """Test email configuration"""
     try:
-        email_settings = get_email_settings()
+        email_settings = await get_email_settings()
         if not email_settings:
             raise HTTPException(status_code=400, detail="Email is not configured")
         
         # Try to connect
-        with smtplib.SMTP(email_settings['smtp_host'], email_settings['smtp_port'], timeout=10) as server:
-            server.starttls()
-            if email_settings.get('smtp_username') and email_settings.get('smtp_password'):
-                server.login(email_settings['smtp_username'], email_settings['smtp_password'])
+        await run_in_threadpool(smtp_send, email_settings, timeout=10)
         
         return {
             "success": True,
@@ -4,32 +4,91 @@ Handles sales report exports to PDF and Excel
 """
 
 from fastapi import APIRouter, HTTPException, Query
-from fastapi.responses import StreamingResponse
 from typing import Optional
-from datetime import datetime, timedelta
-import os
-import io
-import csv
-from pymongo import MongoClient, DESCENDING
+from pymongo import DESCENDING
+
+import csv_utils
+from routes.responses import csv_response
+from utils.database import registry
 
 router = APIRouter(prefix="/api/export", tags=["export"])
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(mongo_url)
-db = client[db_name]
+# Exports are read-only and may be served by a secondary
+reporting_db = registry.async_database("reporting")
+sales_col = reporting_db['sales']
+products_col = reporting_db['products']
+
+SALE_EXPORT_PROJECTION = {
+    "_id": 0, "invoice_number": 1, "created_at": 1, "customer_name": 1, "price_tier": 1,
+    "subtotal": 1, "total_discount": 1, "tax_amount": 1, "total": 1,
+    "payments.method": 1, "items.product_id": 1, "cashier_name": 1
+}
+PRODUCT_EXPORT_PROJECTION = {
+    "_id": 0, "sku": 1, "name_en": 1, "name_si": 1, "name_ta": 1, "category": 1, "unit": 1,
+    "price_retail": 1, "price_wholesale": 1, "stock": 1, "reorder_level": 1, "active": 1
+}
 
-sales_col = db['sales']
+
+async def sales_rows(sales):
+    """CSV header and rows for a sales cursor"""
+    # Headers
+    yield [
+        'Invoice Number', 'Date', 'Customer', 'Price Tier',
+        'Subtotal', 'Discount', 'Tax', 'Total',
+        'Payment Method', 'Items Count', 'Cashier'
+    ]
+    
+    # Data rows
+    async for sale in sales:
+        yield [
+            sale.get('invoice_number', ''),
+            sale.get('created_at', ''),
+            sale.get('customer_name', 'Walk-in'),
+            sale.get('price_tier', ''),
+            sale.get('subtotal', 0),
+            sale.get('total_discount', 0),
+            sale.get('tax_amount', 0),
+            sale.get('total', 0),
+            ', '.join([p['method'] for p in sale.get('payments', [])]),
+            len(sale.get('items', [])),
+            sale.get('cashier_name', '')
+        ]
+
+
+async def product_rows(products):
+    """CSV header and rows for a products cursor"""
+    # Headers
+    yield [
+        'SKU', 'Name (EN)', 'Name (SI)', 'Name (TA)', 
+        'Category', 'Unit', 'Retail Price', 'Wholesale Price',
+        'Stock', 'Reorder Level', 'Active'
+    ]
+    
+    # Data rows
+    async for product in products:
+        yield [
+            product.get('sku', ''),
+            product.get('name_en', ''),
+            product.get('name_si', ''),
+            product.get('name_ta', ''),
+            product.get('category', ''),
+            product.get('unit', ''),
+            product.get('price_retail', 0),
+            product.get('price_wholesale', 0),
+            product.get('stock', 0),
+            product.get('reorder_level', 0),
+            product.get('active', True)
+        ]
 
 
 @router.get("/sales/csv")
 async def export_sales_csv(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    limit: int = Query(default=1000, le=10000)
+    limit: int = Query(default=1000, ge=0),
+    gzip: bool = False
 ):
-    """Export sales to CSV"""
+    """Export sales to CSV (limit=0 exports every matching sale)"""
     try:
         # Build query
         query = {"status": "completed"}
@@ -40,51 +99,15 @@ async def export_sales_csv(
                 "$lte": end_date
             }
         
-        # Fetch sales
-        sales = list(sales_col.find(query, {"_id": 0})
-                    .sort("created_at", DESCENDING)
-                    .limit(limit))
-        
-        if not sales:
+        if not await sales_col.find_one(query, {"_id": 1}):
             raise HTTPException(status_code=404, detail="No sales found")
         
-        # Create CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Headers
-        writer.writerow([
-            'Invoice Number', 'Date', 'Customer', 'Price Tier',
-            'Subtotal', 'Discount', 'Tax', 'Total',
-            'Payment Method', 'Items Count', 'Cashier'
-        ])
+        # Streamed from a batched cursor - only line item ids are needed for the count
+        sales = (sales_col.find(query, SALE_EXPORT_PROJECTION, batch_size=csv_utils.EXPORT_BATCH_SIZE)
+                 .sort("created_at", DESCENDING)
+                 .limit(limit))
         
-        # Data rows
-        for sale in sales:
-            writer.writerow([
-                sale.get('invoice_number', ''),
-                sale.get('created_at', ''),
-                sale.get('customer_name', 'Walk-in'),
-                sale.get('price_tier', ''),
-                sale.get('subtotal', 0),
-                sale.get('total_discount', 0),
-                sale.get('tax_amount', 0),
-                sale.get('total', 0),
-                ', '.join([p['method'] for p in sale.get('payments', [])]),
-                len(sale.get('items', [])),
-                sale.get('cashier_name', '')
-            ])
-        
-        # Create response
-        output.seek(0)
-        
-        filename = f"sales_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return csv_response(csv_utils.astream_csv(sales_rows(sales), compress=gzip), "sales_report", gzip)
         
     except HTTPException:
         raise
@@ -121,7 +144,7 @@ async def get_sales_summary(
             }}
         ]
         
-        result = list(sales_col.aggregate(pipeline))
+        result = await sales_col.aggregate(pipeline).to_list(length=None)
         
         if not result:
             return {
@@ -145,50 +168,15 @@ async def get_sales_summary(
 
 
 @router.get("/products/csv")
-async def export_products_csv():
+async def export_products_csv(gzip: bool = False):
     """Export products to CSV"""
     try:
-        products = list(db['products'].find({}, {"_id": 0}))
-        
-        if not products:
+        if not await products_col.find_one({}, {"_id": 1}):
             raise HTTPException(status_code=404, detail="No products found")
         
-        # Create CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Headers
-        writer.writerow([
-            'SKU', 'Name (EN)', 'Name (SI)', 'Name (TA)', 
-            'Category', 'Unit', 'Retail Price', 'Wholesale Price',
-            'Stock', 'Reorder Level', 'Active'
-        ])
-        
-        # Data rows
-        for product in products:
-            writer.writerow([
-                product.get('sku', ''),
-                product.get('name_en', ''),
-                product.get('name_si', ''),
-                product.get('name_ta', ''),
-                product.get('category', ''),
-                product.get('unit', ''),
-                product.get('price_retail', 0),
-                product.get('price_wholesale', 0),
-                product.get('stock', 0),
-                product.get('reorder_level', 0),
-                product.get('active', True)
-            ])
-        
-        output.seek(0)
-        
-        filename = f"products_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        products = products_col.find({}, PRODUCT_EXPORT_PROJECTION, batch_size=csv_utils.EXPORT_BATCH_SIZE)
         
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
+        return csv_response(csv_utils.astream_csv(product_rows(products), compress=gzip), "products", gzip)
         
     except HTTPException:
         raise
@@ -4,10 +4,10 @@ Handles customer loyalty points, rewards, and redemption
 """
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from typing import List
 from datetime import datetime, timedelta
-import os
-from pymongo import MongoClient, DESCENDING
+from pymongo import DESCENDING
 
 from models.loyalty import (
     LoyaltySettings, 
@@ -16,33 +16,32 @@ from models.loyalty import (
     RedeemPointsResponse
 )
 
-router = APIRouter(prefix="/api/loyalty", tags=["loyalty"])
+from services.change_log import change_log
+from services.config_service import config
+from utils.database import async_db
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(mongo_url)
-db = client[db_name]
+router = APIRouter(prefix="/api/loyalty", tags=["loyalty"])
 
-loyalty_settings_col = db['loyalty_settings']
-loyalty_transactions_col = db['loyalty_transactions']
-customers_col = db['customers']
+loyalty_settings_col = async_db['loyalty_settings']
+loyalty_transactions_col = async_db['loyalty_transactions']
+customers_col = async_db['customers']
 
 
-def get_loyalty_settings():
+async def get_loyalty_settings():
     """Get current loyalty settings or create default"""
-    settings = loyalty_settings_col.find_one({}, {"_id": 0})
+    settings = config.get("loyalty_settings")
     if not settings:
         # Create default settings
         default_settings = LoyaltySettings().dict()
-        loyalty_settings_col.insert_one(default_settings)
+        await loyalty_settings_col.insert_one(default_settings.copy())
+        await run_in_threadpool(config.changed, "loyalty_settings")
         return default_settings
     return settings
 
 
-def calculate_customer_tier(lifetime_points: float):
+async def calculate_customer_tier(lifetime_points: float):
     """Calculate customer tier based on lifetime points"""
-    settings = get_loyalty_settings()
+    settings = await get_loyalty_settings()
     
     if lifetime_points >= settings['tier_platinum_threshold']:
         return 'platinum'
@@ -54,9 +53,9 @@ def calculate_customer_tier(lifetime_points: float):
         return 'bronze'
 
 
-def calculate_points_earned(sale_total: float, customer_id: str = None):
+async def calculate_points_earned(sale_total: float, customer_id: str = None):
     """Calculate points earned for a purchase"""
-    settings = get_loyalty_settings()
+    settings = await get_loyalty_settings()
     
     if not settings['enabled']:
         return 0
@@ -69,7 +68,7 @@ def calculate_points_earned(sale_total: float, customer_id: str = None):
     
     # Apply tier multiplier if customer exists
     if customer_id:
-        customer = customers_col.find_one({"id": customer_id}, {"_id": 0})
+        customer = await customers_col.find_one({"id": customer_id}, {"_id": 0})
         if customer:
             tier = customer.get('loyalty_tier', 'bronze')
             multiplier = settings['tier_multipliers'].get(tier, 1.0)
@@ -82,7 +81,7 @@ def calculate_points_earned(sale_total: float, customer_id: str = None):
 async def get_settings():
     """Get loyalty program settings"""
     try:
-        settings = get_loyalty_settings()
+        settings = await get_loyalty_settings()
         return settings
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -95,8 +94,9 @@ async def update_settings(settings: LoyaltySettings):
         settings_dict = settings.dict()
         settings_dict['updated_at'] = datetime.utcnow().isoformat()
         
-        loyalty_settings_col.delete_many({})
-        loyalty_settings_col.insert_one(settings_dict)
+        await loyalty_settings_col.delete_many({})
+        await loyalty_settings_col.insert_one(settings_dict.copy())
+        await run_in_threadpool(config.changed, "loyalty_settings")
         
         return {"message": "Loyalty settings updated", "settings": settings_dict}
     except Exception as e:
@@ -107,7 +107,7 @@ async def update_settings(settings: LoyaltySettings):
 async def get_customer_points(customer_id: str):
     """Get customer's current points balance and tier"""
     try:
-        customer = customers_col.find_one({"id": customer_id}, {"_id": 0})
+        customer = await customers_col.find_one({"id": customer_id}, {"_id": 0})
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
         
@@ -121,7 +121,7 @@ async def get_customer_points(customer_id: str):
             "points_balance": points_balance,
             "lifetime_points": lifetime_points,
             "tier": tier,
-            "tier_benefits": get_loyalty_settings()['tier_multipliers'].get(tier, 1.0)
+            "tier_benefits": (await get_loyalty_settings())['tier_multipliers'].get(tier, 1.0)
         }
     except HTTPException:
         raise
@@ -133,10 +133,10 @@ async def get_customer_points(customer_id: str):
 async def get_customer_transactions(customer_id: str, limit: int = 50):
     """Get customer's loyalty transaction history"""
     try:
-        transactions = list(loyalty_transactions_col.find(
+        transactions = await loyalty_transactions_col.find(
             {"customer_id": customer_id},
             {"_id": 0}
-        ).sort("created_at", DESCENDING).limit(limit))
+        ).sort("created_at", DESCENDING).to_list(length=limit)
         
         return {
             "customer_id": customer_id,
@@ -151,12 +151,12 @@ async def get_customer_transactions(customer_id: str, limit: int = 50):
 async def award_points(customer_id: str, sale_total: float, invoice_number: str):
     """Award loyalty points for a purchase"""
     try:
-        customer = customers_col.find_one({"id": customer_id}, {"_id": 0})
+        customer = await customers_col.find_one({"id": customer_id}, {"_id": 0})
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
         
         # Calculate points
-        points_earned = calculate_points_earned(sale_total, customer_id)
+        points_earned = await calculate_points_earned(sale_total, customer_id)
         
         if points_earned <= 0:
             return {
@@ -172,9 +172,9 @@ async def award_points(customer_id: str, sale_total: float, invoice_number: str)
         new_lifetime = lifetime_points + points_earned
         
         # Calculate new tier
-        new_tier = calculate_customer_tier(new_lifetime)
+        new_tier = await calculate_customer_tier(new_lifetime)
         
-        customers_col.update_one(
+        await customers_col.update_one(
             {"id": customer_id},
             {"$set": {
                 "loyalty_points": new_balance,
@@ -182,9 +182,10 @@ async def award_points(customer_id: str, sale_total: float, invoice_number: str)
                 "loyalty_tier": new_tier
             }}
         )
+        await run_in_threadpool(change_log.record, "customer", [customer_id])
         
         # Record transaction
-        settings = get_loyalty_settings()
+        settings = await get_loyalty_settings()
         expires_at = None
         if settings.get('points_expiry_days'):
             expires_at = (datetime.utcnow() + timedelta(days=settings['points_expiry_days'])).isoformat()
@@ -200,7 +201,7 @@ async def award_points(customer_id: str, sale_total: float, invoice_number: str)
             expires_at=expires_at
         )
         
-        loyalty_transactions_col.insert_one(transaction.dict())
+        await loyalty_transactions_col.insert_one(transaction.dict())
         
         return {
             "success": True,
@@ -220,13 +221,13 @@ async def award_points(customer_id: str, sale_total: float, invoice_number: str)
 async def redeem_points(request: RedeemPointsRequest):
     """Redeem loyalty points for discount"""
     try:
-        settings = get_loyalty_settings()
+        settings = await get_loyalty_settings()
         
         if not settings['enabled']:
             raise HTTPException(status_code=400, detail="Loyalty program is disabled")
         
         # Get customer
-        customer = customers_col.find_one({"id": request.customer_id}, {"_id": 0})
+        customer = await customers_col.find_one({"id": request.customer_id}, {"_id": 0})
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
         
@@ -255,10 +256,11 @@ async def redeem_points(request: RedeemPointsRequest):
         
         # Update customer balance
         new_balance = current_balance - actual_points
-        customers_col.update_one(
+        await customers_col.update_one(
             {"id": request.customer_id},
             {"$set": {"loyalty_points": new_balance}}
         )
+        await run_in_threadpool(change_log.record, "customer", [request.customer_id])
         
         # Record transaction
         transaction = LoyaltyTransaction(
@@ -270,7 +272,7 @@ async def redeem_points(request: RedeemPointsRequest):
             description=f"Redeemed {actual_points} points for LKR {discount_amount:.2f} discount"
         )
         
-        loyalty_transactions_col.insert_one(transaction.dict())
+        await loyalty_transactions_col.insert_one(transaction.dict())
         
         return RedeemPointsResponse(
             success=True,
@@ -291,13 +293,13 @@ async def get_loyalty_stats():
     """Get overall loyalty program statistics"""
     try:
         # Count customers by tier
-        total_customers = customers_col.count_documents({"loyalty_points": {"$exists": True}})
+        total_customers = await customers_col.count_documents({"loyalty_points": {"$exists": True}})
         
         tier_counts = {
-            "bronze": customers_col.count_documents({"loyalty_tier": "bronze"}),
-            "silver": customers_col.count_documents({"loyalty_tier": "silver"}),
-            "gold": customers_col.count_documents({"loyalty_tier": "gold"}),
-            "platinum": customers_col.count_documents({"loyalty_tier": "platinum"})
+            "bronze": await customers_col.count_documents({"loyalty_tier": "bronze"}),
+            "silver": await customers_col.count_documents({"loyalty_tier": "silver"}),
+            "gold": await customers_col.count_documents({"loyalty_tier": "gold"}),
+            "platinum": await customers_col.count_documents({"loyalty_tier": "platinum"})
         }
         
         # Total points in circulation
@@ -309,15 +311,15 @@ async def get_loyalty_stats():
             }}
         ]
         
-        result = list(customers_col.aggregate(pipeline))
+        result = await customers_col.aggregate(pipeline).to_list(length=None)
         total_points = result[0]['total_points'] if result else 0
         total_lifetime = result[0]['total_lifetime_points'] if result else 0
         
         # Recent transactions
-        recent_transactions = loyalty_transactions_col.count_documents({})
+        recent_transactions = await loyalty_transactions_col.count_documents({})
         
         return {
-            "enabled": get_loyalty_settings()['enabled'],
+            "enabled": (await get_loyalty_settings())['enabled'],
             "total_customers": total_customers,
             "tier_distribution": tier_counts,
             "total_points_in_circulation": total_points,
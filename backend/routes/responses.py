@@ -0,0 +1,21 @@
+"""
+Shared response helpers for route handlers
+"""
+
+from datetime import datetime
+from typing import AsyncIterator, Iterator, Union
+
+from fastapi.responses import StreamingResponse
+
+
+def csv_response(chunks: Union[Iterator[bytes], AsyncIterator[bytes]], name: str,
+                 compress: bool = False) -> StreamingResponse:
+    """Download response for streamed CSV chunks (a .csv.gz file when compressed)"""
+    filename = f"{name}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"
+    if compress:
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if compress else "text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
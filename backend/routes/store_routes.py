@@ -4,32 +4,28 @@ Handles store configuration, receipt customization, and email settings
 """
 
 from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
-import os
 import base64
-from pymongo import MongoClient
 from datetime import datetime
 
 from models.store_settings import StoreSettings
+from services.config_service import config
+from utils.database import async_db
 
 router = APIRouter(prefix="/api/store", tags=["store"])
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(mongo_url)
-db = client[db_name]
+store_settings_col = async_db['store_settings']
 
-store_settings_col = db['store_settings']
 
-
-def get_store_settings():
+async def get_store_settings():
     """Get current store settings or create default"""
-    settings = store_settings_col.find_one({}, {"_id": 0})
+    settings = config.get("store_settings")
     if not settings:
         # Create default settings
         default_settings = StoreSettings().dict()
-        store_settings_col.insert_one(default_settings)
+        await store_settings_col.insert_one(default_settings.copy())
+        await run_in_threadpool(config.changed, "store_settings")
         return default_settings
     return settings
 
@@ -38,7 +34,7 @@ def get_store_settings():
 async def get_settings():
     """Get store settings"""
     try:
-        settings = get_store_settings()
+        settings = await get_store_settings()
         # Don't send SMTP password to frontend
         if 'smtp_password' in settings:
             settings['smtp_password'] = '***' if settings.get('smtp_password') else ''
@@ -56,11 +52,12 @@ async def update_settings(settings: StoreSettings):
         
         # If password is masked, keep the old one
         if settings_dict.get('smtp_password') == '***':
-            old_settings = get_store_settings()
+            old_settings = await get_store_settings()
             settings_dict['smtp_password'] = old_settings.get('smtp_password', '')
         
-        store_settings_col.delete_many({})
-        store_settings_col.insert_one(settings_dict)
+        await store_settings_col.delete_many({})
+        await store_settings_col.insert_one(settings_dict.copy())
+        await run_in_threadpool(config.changed, "store_settings")
         
         return {"message": "Store settings updated", "settings": settings_dict}
     except Exception as e:
@@ -80,12 +77,13 @@ async def upload_logo(file: UploadFile = File(...)):
         logo_data = f"data:{mime_type};base64,{base64_logo}"
         
         # Update settings
-        settings = get_store_settings()
+        settings = await get_store_settings()
         settings['logo_base64'] = logo_data
         settings['show_logo'] = True
         settings['updated_at'] = datetime.utcnow().isoformat()
         
-        store_settings_col.update_one({}, {"$set": settings}, upsert=True)
+        await store_settings_col.update_one({}, {"$set": settings}, upsert=True)
+        await run_in_threadpool(config.changed, "store_settings")
         
         return {
             "message": "Logo uploaded successfully",
@@ -99,7 +97,7 @@ async def upload_logo(file: UploadFile = File(...)):
 async def delete_logo():
     """Delete store logo"""
     try:
-        store_settings_col.update_one(
+        await store_settings_col.update_one(
             {},
             {"$set": {
                 "logo_base64": None,
@@ -108,6 +106,7 @@ async def delete_logo():
                 "updated_at": datetime.utcnow().isoformat()
             }}
         )
+        await run_in_threadpool(config.changed, "store_settings")
         return {"message": "Logo deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -4,31 +4,27 @@ Manages system-wide feature toggles and configurations
 """
 
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict
-import os
-from pymongo import MongoClient
 from datetime import datetime
 
 from models.system_settings import SystemSettings
+from services.config_service import config
+from utils.database import async_db
 
 router = APIRouter(prefix="/api/system", tags=["system"])
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(mongo_url)
-db = client[db_name]
+system_settings_col = async_db['system_settings']
 
-system_settings_col = db['system_settings']
 
-
-def get_system_settings():
+async def get_system_settings():
     """Get current system settings or create default"""
-    settings = system_settings_col.find_one({}, {"_id": 0})
+    settings = config.get("system_settings")
     if not settings:
         # Create default settings
         default_settings = SystemSettings().dict()
-        system_settings_col.insert_one(default_settings)
+        await system_settings_col.insert_one(default_settings.copy())
+        await run_in_threadpool(config.changed, "system_settings")
         return default_settings
     return settings
 
@@ -37,7 +33,7 @@ def get_system_settings():
 async def get_settings():
     """Get system settings"""
     try:
-        settings = get_system_settings()
+        settings = await get_system_settings()
         return settings
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -51,8 +47,9 @@ async def update_settings(settings: SystemSettings):
         settings_dict['updated_at'] = datetime.utcnow().isoformat()
         
         # Delete all existing settings and insert new one
-        system_settings_col.delete_many({})
-        system_settings_col.insert_one(settings_dict)
+        await system_settings_col.delete_many({})
+        await system_settings_col.insert_one(settings_dict.copy())
+        await run_in_threadpool(config.changed, "system_settings")
         
         return {"message": "System settings updated", "settings": settings_dict}
     except Exception as e:
@@ -66,13 +63,14 @@ async def update_settings_partial(settings: Dict):
         settings['updated_at'] = datetime.utcnow().isoformat()
         
         # Update only provided fields
-        result = system_settings_col.update_one(
+        result = await system_settings_col.update_one(
             {},
             {"$set": settings},
             upsert=True
         )
+        await run_in_threadpool(config.changed, "system_settings")
         
-        updated_settings = get_system_settings()
+        updated_settings = await get_system_settings()
         
         return {"message": "Settings updated", "settings": updated_settings}
     except Exception as e:
@@ -85,8 +83,9 @@ async def reset_settings():
     try:
         default_settings = SystemSettings().dict()
         
-        system_settings_col.delete_many({})
-        system_settings_col.insert_one(default_settings)
+        await system_settings_col.delete_many({})
+        await system_settings_col.insert_one(default_settings.copy())
+        await run_in_threadpool(config.changed, "system_settings")
         
         return {"message": "Settings reset to defaults", "settings": default_settings}
     except Exception as e:
@@ -1,19 +1,37 @@
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Depends, status
+from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Depends, Header, status, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict
 from datetime import datetime, timedelta, timezone
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 import os
+import re
 from dotenv import load_dotenv
 import uuid
 import json
-import io
+import gzip as gzip_codec
 import csv_utils
+from routes.responses import csv_response
+from utils.pagination import decode_cursor, encode_cursor, keyset_page
+from services.inventory_service import apply_sale_stock
+from services.invoice_service import invoice_service
+from services.discount_engine import discount_engine
+from services.product_cache import product_cache
+from services.change_log import change_log
+from services.catalog_snapshot import catalog_snapshot
+from services.push_service import push_hub
+from services.config_service import config
+from services import sales_rollup_service as sales_rollups
+from services import report_service as reports
+from services.backup_service import backup_service
+from services.password_service import password_pool, pwd_context
+from utils.auth import authenticate, sessions
+from utils import metrics, profiler, query_log
 
 load_dotenv()
 
@@ -54,24 +72,8 @@ try:
 except Exception as e:
     print(f"⚠️  Failed to load refactored routes: {str(e)}")
 
-# MongoDB connection with connection pooling
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-db_name = os.environ.get('DATABASE_NAME', 'pos_system')
-
-# Configure connection pooling for production
-client = MongoClient(
-    mongo_url,
-    maxPoolSize=50,  # Maximum connections in the pool
-    minPoolSize=10,  # Minimum connections maintained
-    maxIdleTimeMS=30000,  # Close idle connections after 30 seconds
-    serverSelectionTimeoutMS=5000,  # Timeout for server selection
-    connectTimeoutMS=10000,  # Connection timeout
-    socketTimeoutMS=30000,  # Socket timeout
-    retryWrites=True,  # Automatic retry for write operations
-    w='majority'  # Write concern for durability
-)
-
-db = client[db_name]
+# MongoDB connection - shared process-wide pool from the connection registry
+from utils.database import registry, client, db, DATABASE_NAME as db_name
 
 # Verify connection on startup
 try:
@@ -98,6 +100,14 @@ stock_movements_col = db['stock_movements']
 grn_records_col = db['grn_records']
 adjustment_requests_col = db['adjustment_requests']
 
+# Non-blocking handles for the `async def` CSV import handlers
+from utils.database import async_db
+async_products_col = async_db['products']
+# Bulk imports write with the bulk workload's w=1 concern
+async_import_products_col = registry.async_database("bulk")['products']
+async_customers_col = async_db['customers']
+async_suppliers_col = async_db['suppliers']
+
 # Create indexes
 products_col.create_index([('sku', ASCENDING)], unique=True)
 products_col.create_index([('barcodes', ASCENDING)])
@@ -113,7 +123,6 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production-
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 480  # 8 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 def verify_password(plain_password, hashed_password):
@@ -125,7 +134,7 @@ def get_password_hash(password):
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -133,15 +142,16 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     token = credentials.credentials
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        user = users_col.find_one({"username": username}, {"_id": 0, "password": 0})
-        if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+    user = authenticate(token, payload)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Session expired or user not found")
+    if not user.get("active", True):
+        raise HTTPException(status_code=403, detail="User account is inactive")
+    return user
 
 def require_role(required_roles: List[str]):
     def role_checker(current_user: dict = Depends(get_current_user)):
@@ -150,6 +160,18 @@ def require_role(required_roles: List[str]):
         return current_user
     return role_checker
 
+def profile_allowed(token: str) -> bool:
+    """Only managers may ask for a request to be profiled"""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user = authenticate(token, payload)
+    return bool(user) and user.get("active", True) and user.get("role") == "manager"
+
+# Instrumentation middleware (the last one added runs first)
+app.add_middleware(profiler.ProfilerMiddleware, authorize=profile_allowed)
+app.add_middleware(query_log.QueryLogMiddleware)
+# Outermost, so latency includes the other middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Initialize default admin user if not exists
 def init_default_users():
     admin_exists = users_col.find_one({"username": "admin"})
@@ -169,6 +191,29 @@ def init_default_users():
 # Initialize users on startup
 init_default_users()
 
+from services.backup_scheduler import backup_scheduler
+
+@app.on_event("startup")
+def start_background_jobs():
+    # Every router is included by now
+    profiler.instrument(app)
+    # First, so the pool forks before our own background threads are running
+    password_pool.start()
+    config.start()
+    product_cache.start()
+    catalog_snapshot.start()
+    push_hub.start()
+    backup_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    config.stop()
+    product_cache.stop()
+    catalog_snapshot.stop()
+    push_hub.stop()
+    backup_scheduler.stop()
+    password_pool.stop()
+
 # ==================== HELPER FUNCTIONS ====================
 
 def serialize_doc(doc):
@@ -206,14 +251,61 @@ def health_check():
     except Exception as e:
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
+@app.get("/api/health/auth-pool")
+def auth_pool_stats():
+    """Login verification pool: queue depth, wait times, rehashes and throttled usernames"""
+    return password_pool.stats()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (async so the thread pool gauges can be read on the event loop)"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/health/slow-requests")
+def slow_requests():
+    """Recent requests over the DB call/time thresholds and slow commands, with their query shapes"""
+    return query_log.report()
+
+@app.get("/api/profiles")
+def list_profiles(current_user: dict = Depends(require_role(["manager"]))):
+    """Recent request profiles; profile a request by adding ?profile=1 or an X-Profile: 1 header"""
+    return {"profiles": profiler.profiles(), "pyinstrument": profiler.PYINSTRUMENT_AVAILABLE}
+
+@app.get("/api/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "html", current_user: dict = Depends(require_role(["manager"]))):
+    """One profile as pyinstrument HTML, a text call tree, or folded stacks for flamegraph tools"""
+    session = profiler.get(profile_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "html" and session.html:
+        return Response(content=session.html, media_type="text/html")
+    if format == "folded":
+        if not session.stacks:
+            raise HTTPException(status_code=400, detail="Folded stacks are only recorded without pyinstrument")
+        return Response(content=session.folded(), media_type="text/plain")
+    return Response(content=session.text or session.tree(), media_type="text/plain")
+
+@app.get("/api/health/db-pool")
+def db_pool_stats():
+    """Live connection pool statistics (checked-out connections, wait times, pool clears)"""
+    return registry.pool_stats()
+
 # ==================== AUTHENTICATION ====================
 
 @app.post("/api/auth/login")
-def login(user_login: UserLogin):
+async def login(user_login: UserLogin):
     """Login endpoint - returns JWT token"""
-    user = users_col.find_one({"username": user_login.username}, {"_id": 0})
-    if not user or not verify_password(user_login.password, user["password"]):
+    user = await run_in_threadpool(users_col.find_one, {"username": user_login.username}, {"_id": 0})
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
+    # bcrypt runs in the password pool so a login burst does not tie up request threads
+    valid, new_hash = await password_pool.verify(user_login.username, user_login.password, user["password"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    if new_hash:
+        # Stored with a different BCRYPT_ROUNDS; upgrade while we have the plain password
+        await run_in_threadpool(users_col.update_one, {"id": user["id"], "password": user["password"]},
+                                {"$set": {"password": new_hash}})
     
     if not user.get("active", True):
         raise HTTPException(status_code=403, detail="User account is inactive")
@@ -237,8 +329,11 @@ def get_current_user_info(current_user: dict = Depends(get_current_user)):
     return current_user
 
 @app.post("/api/auth/logout")
-def logout(current_user: dict = Depends(get_current_user)):
-    """Logout endpoint (client should discard token)"""
+def logout(credentials: HTTPAuthorizationCredentials = Depends(security),
+           current_user: dict = Depends(get_current_user)):
+    """Logout endpoint - revokes the token on every worker"""
+    token = credentials.credentials
+    sessions.revoke_token(token, jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]))
     return {"message": "Logged out successfully"}
 
 # ==================== USER MANAGEMENT (Manager Only) ====================
@@ -283,10 +378,15 @@ def update_user(user_id: str, user_update: UserUpdate, current_user: dict = Depe
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
-    result = users_col.update_one({"id": user_id}, {"$set": update_data})
-    if result.matched_count == 0:
+    user = users_col.find_one_and_update({"id": user_id}, {"$set": update_data}, projection={"username": 1})
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    if update_data.get("active") is False:
+        sessions.revoke_user(user["username"])
+    else:
+        sessions.invalidate_user(user["username"])
+    
     return {"message": "User updated successfully"}
 
 @app.delete("/api/users/{user_id}")
@@ -295,40 +395,63 @@ def deactivate_user(user_id: str, current_user: dict = Depends(require_role(["ma
     if user_id == current_user["id"]:
         raise HTTPException(status_code=400, detail="Cannot deactivate your own account")
     
-    result = users_col.update_one({"id": user_id}, {"$set": {"active": False}})
-    if result.matched_count == 0:
+    user = users_col.find_one_and_update({"id": user_id}, {"$set": {"active": False}}, projection={"username": 1})
+    if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    sessions.revoke_user(user["username"])
+    
     return {"message": "User deactivated successfully"}
 
 # ==================== PRODUCTS ====================
 
+def products_changed(product_ids: List[str], op: str = "upsert", stock_only: bool = False):
+    """Bring the product cache and the terminal change log up to date after a product write"""
+    product_cache.refresh_ids(product_ids)
+    change_log.record("product", product_ids, op, stock_only=stock_only)
+
 @app.get("/api/products")
-def get_products(skip: int = 0, limit: int = 100, search: str = "", active_only: bool = True):
+def get_products(skip: int = 0, limit: int = 100, search: str = "", active_only: bool = True,
+                 cursor: str = "", total: str = "cached"):
+    if search and product_cache.ready:
+        # Ranked by relevance from the in-memory index; the cursor is just the offset
+        offset = decode_cursor(cursor, [("rank", ASCENDING)])[0] if cursor else skip
+        products, matches = product_cache.search(search, active_only=active_only, skip=offset, limit=limit)
+        more = offset + len(products) < matches
+        return {
+            "products": products,
+            "total": matches,
+            "next_cursor": encode_cursor([offset + len(products)]) if more else None
+        }
+    
     query = {}
     if active_only:
         query["active"] = True
     if search:
+        pattern = re.escape(search)
         query["$or"] = [
-            {"sku": {"$regex": search, "$options": "i"}},
-            {"name_en": {"$regex": search, "$options": "i"}},
-            {"barcodes": {"$regex": search, "$options": "i"}}
+            {field: {"$regex": pattern, "$options": "i"}}
+            for field in ("sku", "name_en", "name_si", "name_ta", "barcodes")
         ]
     
-    products = list(products_col.find(query, {"_id": 0}).skip(skip).limit(limit))
-    total = products_col.count_documents(query)
-    return {"products": products, "total": total}
+    page = keyset_page(products_col, query, [("sku", ASCENDING)], limit, cursor, skip, total=total)
+    return {"products": page["items"], "total": page["total"], "next_cursor": page["next_cursor"]}
+
+@app.get("/api/products/cache/stats")
+def get_product_cache_stats():
+    return product_cache.stats()
 
 @app.get("/api/products/{product_id}")
 def get_product(product_id: str):
-    product = products_col.find_one({"id": product_id}, {"_id": 0})
+    product = product_cache.by_id(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
 
 @app.get("/api/products/barcode/{barcode}")
 def get_product_by_barcode(barcode: str):
-    product = products_col.find_one({"barcodes": barcode, "active": True}, {"_id": 0})
+    product = product_cache.by_barcode(barcode)
+    metrics.record_scan(product is not None)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     return product
@@ -343,6 +466,8 @@ def create_product(product: Product):
     product_dict = product.dict()
     products_col.insert_one(product_dict)
     product_dict.pop('_id', None)
+    product_cache.put(product_dict)
+    change_log.record("product", [product_dict["id"]])
     return {"message": "Product created", "product": product_dict}
 
 @app.put("/api/products/{product_id}")
@@ -354,27 +479,32 @@ def update_product(product_id: str, product: Product):
     result = products_col.update_one({"id": product_id}, {"$set": product_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    products_changed([product_id])
     return {"message": "Product updated"}
 
 @app.delete("/api/products/{product_id}")
 def delete_product(product_id: str):
     # Soft delete - find product regardless of active status
-    result = products_col.update_one({"id": product_id}, {"$set": {"active": False}})
+    result = products_col.update_one(
+        {"id": product_id},
+        {"$set": {"active": False, "updated_at": datetime.utcnow().isoformat()}}
+    )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    products_changed([product_id], op="delete")
     return {"message": "Product deleted"}
 
 # ==================== SALES ====================
 
 @app.get("/api/sales")
-def get_sales(skip: int = 0, limit: int = 50, status: str = ""):
+def get_sales(skip: int = 0, limit: int = 50, status: str = "", cursor: str = "", total: str = "cached"):
     query = {}
     if status:
         query["status"] = status
     
-    sales = list(sales_col.find(query, {"_id": 0}).sort("created_at", DESCENDING).skip(skip).limit(limit))
-    total = sales_col.count_documents(query)
-    return {"sales": sales, "total": total}
+    page = keyset_page(sales_col, query, [("created_at", DESCENDING), ("id", DESCENDING)],
+                       limit, cursor, skip, total=total)
+    return {"sales": page["items"], "total": page["total"], "next_cursor": page["next_cursor"]}
 
 @app.get("/api/sales/{sale_id}")
 def get_sale(sale_id: str):
@@ -385,76 +515,32 @@ def get_sale(sale_id: str):
 
 @app.post("/api/sales")
 def create_sale(sale: Sale, allow_negative: bool = False, current_user: Dict = Depends(get_current_user)):
-    # Generate invoice number if not provided
+    # Generate invoice number if not provided (from this terminal's leased block)
     if not sale.invoice_number:
-        today = datetime.utcnow().strftime("%Y%m%d")
-        count = sales_col.count_documents({"invoice_number": {"$regex": f"^INV-{today}"}})
-        sale.invoice_number = f"INV-{today}-{count + 1:04d}"
+        sale.invoice_number = invoice_service.next_invoice_number(sale.terminal_name)
     
     sale_dict = sale.dict()
+    # created_at comes from the terminal, which may upload an offline sale
+    # long after it was rung up; incremental backups select on this instead
+    sale_dict["updated_at"] = datetime.utcnow().isoformat()
     negative_stock_items = []
     
-    # Get system settings for negative stock allowance
-    system_settings = db['system_settings'].find_one({}, {"_id": 0})
-    allow_negative_from_settings = system_settings.get('allow_negative_stock', False) if system_settings else False
+    # System setting for negative stock allowance (served from memory)
+    allow_negative_from_settings = config.value("system_settings", "allow_negative_stock", False)
     
     # Allow negative stock if either: system setting is enabled OR allow_negative param is True
     allow_negative_stock = allow_negative or allow_negative_from_settings
     
-    # Update inventory for completed sales
+    # Update inventory for completed sales - one bulk write for the whole basket.
+    # Managers may always sell into negative stock.
     if sale.status == "completed":
-        for item in sale.items:
-            product = products_col.find_one({"id": item.product_id}, {"_id": 0})
-            if product:
-                previous_stock = product.get("stock", 0)
-                new_stock = previous_stock - item.quantity
-                
-                # Check for negative stock
-                if new_stock < 0 and not allow_negative_stock:
-                    if current_user.get('role') != 'manager':
-                        negative_stock_items.append({
-                            "product_id": item.product_id,
-                            "name": product.get('name_en', ''),
-                            "current_stock": previous_stock,
-                            "required": item.quantity,
-                            "shortage": abs(new_stock)
-                        })
-                        continue
-                
-                # Update product stock
-                products_col.update_one(
-                    {"id": item.product_id},
-                    {"$set": {
-                        "stock": new_stock,
-                        "updated_at": datetime.now(timezone.utc).isoformat()
-                    }}
-                )
-                
-                # Log stock movement using new system
-                log_stock_movement(
-                    product_id=item.product_id,
-                    movement_type="SALE",
-                    quantity=-item.quantity,
-                    reason=f"Sale {sale.invoice_number}",
-                    cost_price=product.get('weighted_avg_cost', 0),
-                    user_id=current_user['id'],
-                    reference_id=sale.invoice_number,
-                    notes=f"Sold by {sale.cashier_name}"
-                )
-                
-                # Also log in old system for backward compatibility
-                inventory_logs_col.insert_one({
-                    "id": str(uuid.uuid4()),
-                    "product_id": item.product_id,
-                    "log_type": "sale",
-                    "quantity": -item.quantity,
-                    "previous_stock": previous_stock,
-                    "new_stock": new_stock,
-                    "reference": sale.invoice_number,
-                    "notes": f"Sale {sale.invoice_number}",
-                    "created_at": datetime.utcnow().isoformat(),
-                    "created_by": sale.cashier_name
-                })
+        negative_stock_items = apply_sale_stock(
+            sale.items,
+            reference=sale.invoice_number,
+            user_id=current_user['id'],
+            cashier_name=sale.cashier_name,
+            enforce_stock=not allow_negative_stock and current_user.get('role') != 'manager'
+        )
     
     # If there are negative stock items and user is not manager, return error
     if negative_stock_items:
@@ -467,6 +553,9 @@ def create_sale(sale: Sale, allow_negative: bool = False, current_user: Dict = D
         )
     
     sales_col.insert_one(sale_dict)
+    if sale.status == "completed":
+        sales_rollups.record_sale(sale_dict)
+    metrics.record_sale(sale.status)
     # Remove MongoDB _id from response
     sale_dict.pop('_id', None)
     return {"message": "Sale created", "sale": sale_dict}
@@ -474,15 +563,22 @@ def create_sale(sale: Sale, allow_negative: bool = False, current_user: Dict = D
 @app.put("/api/sales/{sale_id}")
 def update_sale(sale_id: str, sale: Sale):
     sale_dict = sale.dict()
-    result = sales_col.update_one({"id": sale_id}, {"$set": sale_dict})
-    if result.matched_count == 0:
+    # Lets incremental backups pick up the change
+    sale_dict["updated_at"] = datetime.utcnow().isoformat()
+    previous = sales_col.find_one_and_update({"id": sale_id}, {"$set": sale_dict}, {"_id": 0})
+    if previous is None:
         raise HTTPException(status_code=404, detail="Sale not found")
+    # Keep the report rollups in step with status and total changes
+    if previous.get("status") == "completed":
+        sales_rollups.record_sale(previous, sign=-1)
+    if sale.status == "completed":
+        sales_rollups.record_sale(sale_dict)
     return {"message": "Sale updated"}
 
 # ==================== CUSTOMERS ====================
 
 @app.get("/api/customers")
-def get_customers(skip: int = 0, limit: int = 100, search: str = ""):
+def get_customers(skip: int = 0, limit: int = 100, search: str = "", cursor: str = "", total: str = "cached"):
     query = {"active": True}
     if search:
         query["$or"] = [
@@ -490,9 +586,9 @@ def get_customers(skip: int = 0, limit: int = 100, search: str = ""):
             {"phone": {"$regex": search, "$options": "i"}}
         ]
     
-    customers = list(customers_col.find(query, {"_id": 0}).skip(skip).limit(limit))
-    total = customers_col.count_documents(query)
-    return {"customers": customers, "total": total}
+    page = keyset_page(customers_col, query, [("name", ASCENDING), ("id", ASCENDING)],
+                       limit, cursor, skip, total=total)
+    return {"customers": page["items"], "total": page["total"], "next_cursor": page["next_cursor"]}
 
 @app.get("/api/customers/{customer_id}")
 def get_customer(customer_id: str):
@@ -506,6 +602,7 @@ def create_customer(customer: Customer):
     customer_dict = customer.dict()
     customers_col.insert_one(customer_dict)
     customer_dict.pop('_id', None)
+    change_log.record("customer", [customer_dict["id"]])
     return {"message": "Customer created", "customer": customer_dict}
 
 @app.put("/api/customers/{customer_id}")
@@ -516,15 +613,16 @@ def update_customer(customer_id: str, customer: Customer):
     result = customers_col.update_one({"id": customer_id}, {"$set": customer_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
+    change_log.record("customer", [customer_id])
     return {"message": "Customer updated"}
 
 # ==================== SUPPLIERS ====================
 
 @app.get("/api/suppliers")
-def get_suppliers(skip: int = 0, limit: int = 100):
-    suppliers = list(suppliers_col.find({"active": True}, {"_id": 0}).skip(skip).limit(limit))
-    total = suppliers_col.count_documents({"active": True})
-    return {"suppliers": suppliers, "total": total}
+def get_suppliers(skip: int = 0, limit: int = 100, cursor: str = "", total: str = "cached"):
+    page = keyset_page(suppliers_col, {"active": True}, [("name", ASCENDING), ("id", ASCENDING)],
+                       limit, cursor, skip, total=total)
+    return {"suppliers": page["items"], "total": page["total"], "next_cursor": page["next_cursor"]}
 
 @app.post("/api/suppliers")
 def create_supplier(supplier: Supplier):
@@ -544,6 +642,8 @@ def get_discount_rules():
 def create_discount_rule(rule: DiscountRule):
     rule_dict = rule.dict()
     discount_rules_col.insert_one(rule_dict)
+    discount_engine.invalidate()
+    change_log.record("discount_rule", [rule_dict["id"]])
     rule_dict.pop('_id', None)
     return {"message": "Discount rule created", "rule": rule_dict}
 
@@ -553,6 +653,8 @@ def update_discount_rule(rule_id: str, rule: DiscountRule):
     result = discount_rules_col.update_one({"id": rule_id}, {"$set": rule_dict})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Discount rule not found")
+    discount_engine.invalidate()
+    change_log.record("discount_rule", [rule_id])
     return {"message": "Discount rule updated"}
 
 @app.delete("/api/discount-rules/{rule_id}")
@@ -560,6 +662,8 @@ def delete_discount_rule(rule_id: str):
     result = discount_rules_col.update_one({"id": rule_id}, {"$set": {"active": False}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Discount rule not found")
+    discount_engine.invalidate()
+    change_log.record("discount_rule", [rule_id], op="delete")
     return {"message": "Discount rule deleted"}
 
 @app.post("/api/discount-rules/apply")
@@ -579,72 +683,16 @@ def apply_discount_rules(cart_items: List[Dict], price_tier: str = "retail"):
         return {"items": cart_items, "message": f"Discounts not applicable for {price_tier} tier"}
     
     # Proceed with discount application for retail tier only
-    rules = list(discount_rules_col.find({"active": True, "auto_apply": True}, {"_id": 0}))
-    
-    for item in cart_items:
-        # Reset discount fields for each item
-        item['discount_amount'] = 0
-        item['discount_percent'] = 0
-        item['total'] = item['subtotal']
-        if 'applied_rule' in item:
-            del item['applied_rule']
-        
-        applicable_rules = []
-        
-        for rule in rules:
-            # Check if rule applies to this item
-            if rule['rule_type'] == 'product':
-                # Check both product_id (UUID) and sku for product-specific rules
-                target = rule.get('target_id', '')
-                if target == item.get('product_id') or target == item.get('sku'):
-                    applicable_rules.append(rule)
-            elif rule['rule_type'] == 'category':
-                # Use category from cart item instead of fetching from DB
-                if item.get('category') and item.get('category') == rule.get('target_id'):
-                    applicable_rules.append(rule)
-            elif rule['rule_type'] == 'line_item':
-                # Applies to all items
-                applicable_rules.append(rule)
-        
-        # Apply best discount
-        if applicable_rules:
-            best_discount = 0
-            best_rule = None
-            
-            for rule in applicable_rules:
-                # Check quantity conditions
-                if rule.get('min_quantity', 0) > 0 and item['quantity'] < rule['min_quantity']:
-                    continue
-                if rule.get('max_quantity', 0) > 0 and item['quantity'] > rule['max_quantity']:
-                    continue
-                
-                # Calculate discount
-                if rule['discount_type'] == 'percent':
-                    discount = (item['subtotal'] * rule['discount_value']) / 100
-                else:  # fixed
-                    discount = rule['discount_value'] * item['quantity']
-                
-                # Apply max discount cap
-                if rule.get('max_discount', 0) > 0:
-                    discount = min(discount, rule['max_discount'])
-                
-                if discount > best_discount:
-                    best_discount = discount
-                    best_rule = rule
-            
-            if best_rule:
-                item['discount_amount'] = best_discount
-                item['discount_percent'] = (best_discount / item['subtotal'] * 100) if item['subtotal'] > 0 else 0
-                item['total'] = item['subtotal'] - best_discount
-                item['applied_rule'] = best_rule['name']
+    discount_engine.apply(cart_items)
     
     return {"items": cart_items}
 
 # ==================== INVENTORY MANAGEMENT ====================
 
-def calculate_weighted_avg_cost(product_id: str, new_qty: float, new_cost: float):
-    """Calculate weighted average cost for a product"""
-    product = products_col.find_one({"id": product_id}, {"_id": 0})
+def calculate_weighted_avg_cost(product_id: str, new_qty: float, new_cost: float, product: Optional[Dict] = None):
+    """Calculate weighted average cost for a product (pass product if already loaded)"""
+    if product is None:
+        product = products_col.find_one({"id": product_id}, {"_id": 0})
     if not product:
         return new_cost
     
@@ -659,11 +707,11 @@ def calculate_weighted_avg_cost(product_id: str, new_qty: float, new_cost: float
     
     return round(total_value / total_qty, 2) if total_qty > 0 else new_cost
 
-def log_stock_movement(product_id: str, movement_type: str, quantity: float, 
-                       reason: str, cost_price: float, user_id: str, 
-                       reference_id: str = "", notes: str = ""):
-    """Log all stock movements for audit trail"""
-    movement = {
+def stock_movement(product_id: str, movement_type: str, quantity: float,
+                   reason: str, cost_price: float, user_id: str,
+                   reference_id: str = "", notes: str = "") -> Dict:
+    """Stock movement audit record"""
+    return {
         "id": str(uuid.uuid4()),
         "product_id": product_id,
         "type": movement_type,  # GRN, SALE, ADJUSTMENT, OPENING
@@ -675,6 +723,12 @@ def log_stock_movement(product_id: str, movement_type: str, quantity: float,
         "notes": notes,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
+
+def log_stock_movement(product_id: str, movement_type: str, quantity: float, 
+                       reason: str, cost_price: float, user_id: str, 
+                       reference_id: str = "", notes: str = ""):
+    """Log all stock movements for audit trail"""
+    movement = stock_movement(product_id, movement_type, quantity, reason, cost_price, user_id, reference_id, notes)
     stock_movements_col.insert_one(movement)
     return movement
 
@@ -695,6 +749,12 @@ def create_grn(grn_data: Dict, current_user: Dict = Depends(get_current_user)):
     
     total_cost = 0
     
+    # One read for every product on the note, one bulk write and one insert at the end
+    product_ids = list({item['product_id'] for item in grn['items']})
+    products = {p["id"]: p for p in products_col.find({"id": {"$in": product_ids}}, {"_id": 0})}
+    updates: Dict[str, Dict] = {}
+    movements = []
+    
     for item in grn['items']:
         product_id = item['product_id']
         quantity = float(item['quantity'])
@@ -702,39 +762,37 @@ def create_grn(grn_data: Dict, current_user: Dict = Depends(get_current_user)):
         batch_number = item.get('batch_number', '')
         expiry_date = item.get('expiry_date', '')
         
-        product = products_col.find_one({"id": product_id}, {"_id": 0})
+        product = products.get(product_id)
         if not product:
             continue
         
         # Calculate new weighted average cost
-        new_weighted_avg = calculate_weighted_avg_cost(product_id, quantity, cost_price)
+        new_weighted_avg = calculate_weighted_avg_cost(product_id, quantity, cost_price, product)
         
-        # Update product stock and costs
-        new_stock = product.get('stock', 0) + quantity
-        
-        update_data = {
-            "stock": new_stock,
+        # Stock is incremented rather than set, so sales landing meanwhile are kept
+        update = updates.setdefault(product_id, {"$inc": {"stock": 0}, "$set": {}})
+        update["$inc"]["stock"] += quantity
+        update["$set"].update({
             "weighted_avg_cost": new_weighted_avg,
             "last_purchase_price": cost_price,
             "updated_at": datetime.now(timezone.utc).isoformat()
-        }
+        })
         
         # Add batch tracking if provided
         if batch_number or expiry_date:
-            batches = product.get('batches', [])
-            batches.append({
+            update.setdefault("$push", {"batches": {"$each": []}})["batches"]["$each"].append({
                 "batch_number": batch_number,
                 "quantity": quantity,
                 "cost_price": cost_price,
                 "expiry_date": expiry_date,
                 "received_date": grn['received_date']
             })
-            update_data['batches'] = batches
         
-        products_col.update_one({"id": product_id}, {"$set": update_data})
+        # A later line for the same product builds on this one
+        product.update({"stock": product.get('stock', 0) + quantity, "weighted_avg_cost": new_weighted_avg})
         
         # Log stock movement
-        log_stock_movement(
+        movements.append(stock_movement(
             product_id=product_id,
             movement_type="GRN",
             quantity=quantity,
@@ -743,10 +801,17 @@ def create_grn(grn_data: Dict, current_user: Dict = Depends(get_current_user)):
             user_id=current_user['id'],
             reference_id=grn['id'],
             notes=f"Batch: {batch_number}, Expiry: {expiry_date}" if batch_number else ""
-        )
+        ))
         
         total_cost += quantity * cost_price
     
+    if updates:
+        products_col.bulk_write([UpdateOne({"id": product_id}, update)
+                                 for product_id, update in updates.items()], ordered=False)
+        products_changed(list(updates))
+    if movements:
+        stock_movements_col.insert_many(movements)
+    
     grn['total_cost'] = round(total_cost, 2)
     grn_records_col.insert_one(grn)
     
@@ -787,6 +852,7 @@ def create_stock_adjustment(adjustment_data: Dict, current_user: Dict = Depends(
                     "updated_at": datetime.now(timezone.utc).isoformat()
                 }}
             )
+            products_changed([adjustment['product_id']], stock_only=True)
             
             # Log stock movement
             log_stock_movement(
@@ -847,6 +913,7 @@ def approve_stock_adjustment(adjustment_id: str, action: str, current_user: Dict
                     "updated_at": datetime.now(timezone.utc).isoformat()
                 }}
             )
+            products_changed([adjustment['product_id']], stock_only=True)
             
             # Log stock movement
             log_stock_movement(
@@ -923,20 +990,13 @@ def get_expiring_products(days: int = 30, current_user: Dict = Depends(get_curre
 @app.get("/api/reports/sales-trends")
 def get_sales_trends(period: str = "daily", days: int = 30):
     """Get sales trends over time (daily, weekly, monthly)"""
-    from datetime import datetime, timedelta, timezone
-    
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
+    start = sales_rollups.window_start(days)
+    rows = sales_rollups.read_rollups("daily", start=sales_rollups.day_bucket(start), group_by=["bucket"])
     
     # Group by period
     trends = {}
-    for sale in sales:
-        sale_date = datetime.fromisoformat(sale["created_at"])
+    for row in rows:
+        sale_date = datetime.strptime(row["bucket"], "%Y-%m-%d")
         
         if period == "daily":
             key = sale_date.strftime("%Y-%m-%d")
@@ -948,92 +1008,43 @@ def get_sales_trends(period: str = "daily", days: int = 30):
         if key not in trends:
             trends[key] = {"date": key, "revenue": 0, "count": 0, "items": 0}
         
-        trends[key]["revenue"] += sale.get("total", 0)
-        trends[key]["count"] += 1
-        trends[key]["items"] += len(sale.get("items", []))
+        trends[key]["revenue"] += row["revenue"]
+        trends[key]["count"] += row["invoices"]
+        trends[key]["items"] += row["line_count"]
     
     return {"trends": sorted(trends.values(), key=lambda x: x["date"])}
 
 @app.get("/api/reports/top-products")
 def get_top_products(limit: int = 10, days: int = 30):
     """Get top selling products"""
-    from datetime import datetime, timedelta, timezone
-    
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
-    
-    product_stats = {}
-    for sale in sales:
-        for item in sale.get("items", []):
-            product_id = item.get("product_id", "")
-            if product_id not in product_stats:
-                product_stats[product_id] = {
-                    "product_id": product_id,
-                    "name": item.get("name", ""),
-                    "quantity_sold": 0,
-                    "revenue": 0,
-                    "times_sold": 0
-                }
-            product_stats[product_id]["quantity_sold"] += item.get("quantity", 0)
-            product_stats[product_id]["revenue"] += item.get("total", 0)
-            product_stats[product_id]["times_sold"] += 1
-    
-    top_products = sorted(product_stats.values(), key=lambda x: x["revenue"], reverse=True)[:limit]
-    
-    return {"products": top_products}
+    start_date = datetime.utcnow() - timedelta(days=days)
+    return {"products": reports.top_products(start_date=start_date.isoformat(), limit=limit)}
 
 @app.get("/api/reports/sales-by-cashier")
 def get_sales_by_cashier(days: int = 30):
     """Get sales performance by cashier"""
-    from datetime import datetime, timedelta, timezone
+    start = sales_rollups.window_start(days)
+    rows = sales_rollups.read_rollups("hourly", start=sales_rollups.hour_bucket(start), group_by=["cashier"])
     
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
-    
-    cashier_stats = {}
-    for sale in sales:
-        cashier = sale.get("cashier_name", "Unknown")
-        if cashier not in cashier_stats:
-            cashier_stats[cashier] = {
-                "cashier": cashier,
-                "sales_count": 0,
-                "revenue": 0,
-                "avg_sale": 0
-            }
-        cashier_stats[cashier]["sales_count"] += 1
-        cashier_stats[cashier]["revenue"] += sale.get("total", 0)
-    
-    # Calculate averages
-    for stats in cashier_stats.values():
-        if stats["sales_count"] > 0:
-            stats["avg_sale"] = stats["revenue"] / stats["sales_count"]
+    cashier_stats = []
+    for row in rows:
+        cashier_stats.append({
+            "cashier": row["cashier"],
+            "sales_count": row["invoices"],
+            "revenue": row["revenue"],
+            "avg_sale": row["revenue"] / row["invoices"] if row["invoices"] > 0 else 0
+        })
     
-    return {"cashiers": list(cashier_stats.values())}
+    return {"cashiers": cashier_stats}
 
 @app.get("/api/reports/profit-analysis")
 def get_profit_analysis(days: int = 30):
     """Analyze profit margins (simplified - assumes cost is 70% of retail price)"""
-    from datetime import datetime, timedelta, timezone
+    start = sales_rollups.window_start(days)
+    rows = sales_rollups.read_rollups("hourly", start=sales_rollups.hour_bucket(start))
+    totals = rows[0] if rows else {"revenue": 0, "invoices": 0}
     
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
-    
-    total_revenue = sum(sale.get("total", 0) for sale in sales)
+    total_revenue = totals["revenue"]
     estimated_cost = total_revenue * 0.70  # Simplified assumption
     estimated_profit = total_revenue - estimated_cost
     profit_margin = (estimated_profit / total_revenue * 100) if total_revenue > 0 else 0
@@ -1043,48 +1054,15 @@ def get_profit_analysis(days: int = 30):
         "estimated_cost": estimated_cost,
         "estimated_profit": estimated_profit,
         "profit_margin": profit_margin,
-        "sales_count": len(sales),
+        "sales_count": totals["invoices"],
         "note": "Cost is estimated at 70% of retail price"
     }
 
 @app.get("/api/reports/customer-insights")
 def get_customer_insights(days: int = 30):
     """Get customer purchase insights"""
-    from datetime import datetime, timedelta, timezone
-    
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
-    
-    customer_stats = {}
-    for sale in sales:
-        customer_id = sale.get("customer_id")
-        customer_name = sale.get("customer_name", "Walk-in")
-        
-        key = customer_id if customer_id else customer_name
-        if key not in customer_stats:
-            customer_stats[key] = {
-                "customer_name": customer_name,
-                "purchase_count": 0,
-                "total_spent": 0,
-                "avg_purchase": 0
-            }
-        
-        customer_stats[key]["purchase_count"] += 1
-        customer_stats[key]["total_spent"] += sale.get("total", 0)
-    
-    # Calculate averages and sort
-    for stats in customer_stats.values():
-        if stats["purchase_count"] > 0:
-            stats["avg_purchase"] = stats["total_spent"] / stats["purchase_count"]
-    
-    top_customers = sorted(customer_stats.values(), key=lambda x: x["total_spent"], reverse=True)[:20]
-    
-    return {"customers": top_customers}
+    start_date = datetime.utcnow() - timedelta(days=days)
+    return {"customers": reports.customer_insights(start_date=start_date.isoformat(), limit=20)}
 
 # ==================== INVENTORY ====================
 
@@ -1097,7 +1075,11 @@ def receive_inventory(product_id: str, quantity: float, notes: str = ""):
     previous_stock = product.get("stock", 0)
     new_stock = previous_stock + quantity
     
-    products_col.update_one({"id": product_id}, {"$set": {"stock": new_stock}})
+    products_col.update_one(
+        {"id": product_id},
+        {"$set": {"stock": new_stock, "updated_at": datetime.utcnow().isoformat()}}
+    )
+    products_changed([product_id], stock_only=True)
     
     inventory_logs_col.insert_one({
         "id": str(uuid.uuid4()),
@@ -1122,7 +1104,11 @@ def adjust_inventory(product_id: str, quantity: float, notes: str = ""):
     previous_stock = product.get("stock", 0)
     new_stock = quantity
     
-    products_col.update_one({"id": product_id}, {"$set": {"stock": new_stock}})
+    products_col.update_one(
+        {"id": product_id},
+        {"$set": {"stock": new_stock, "updated_at": datetime.utcnow().isoformat()}}
+    )
+    products_changed([product_id], stock_only=True)
     
     inventory_logs_col.insert_one({
         "id": str(uuid.uuid4()),
@@ -1152,29 +1138,18 @@ def get_low_stock_products():
 
 @app.get("/api/reports/sales-summary")
 def get_sales_summary(start_date: str = "", end_date: str = ""):
-    query = {"status": "completed"}
+    start, end = sales_rollups.hour_bounds(start_date, end_date)
+    rows = sales_rollups.read_rollups("hourly", start=start, end=end, group_by=["price_tier"])
     
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    sales = list(sales_col.find(query, {"_id": 0}))
-    
-    total_sales = sum(sale.get("total", 0) for sale in sales)
-    total_discount = sum(sale.get("total_discount", 0) for sale in sales)
-    total_invoices = len(sales)
+    total_sales = sum(row["revenue"] for row in rows)
+    total_discount = sum(row["discount"] for row in rows)
+    total_invoices = sum(row["invoices"] for row in rows)
     
     # Sales by tier
-    tier_summary = {}
-    for sale in sales:
-        tier = sale.get("price_tier", "retail")
-        if tier not in tier_summary:
-            tier_summary[tier] = {"count": 0, "total": 0}
-        tier_summary[tier]["count"] += 1
-        tier_summary[tier]["total"] += sale.get("total", 0)
+    tier_summary = {
+        row["price_tier"]: {"count": row["invoices"], "total": row["revenue"]}
+        for row in rows
+    }
     
     return {
         "total_sales": total_sales,
@@ -1187,159 +1162,49 @@ def get_sales_summary(start_date: str = "", end_date: str = ""):
 @app.get("/api/reports/top-products")
 def get_top_products(start_date: str = "", end_date: str = "", limit: int = 10):
     """Get top selling products by quantity and revenue"""
-    query = {"status": "completed"}
-    
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    sales = list(sales_col.find(query, {"_id": 0}))
-    
-    # Aggregate by product
-    product_stats = {}
-    for sale in sales:
-        for item in sale.get("items", []):
-            product_id = item.get("product_id")
-            if product_id not in product_stats:
-                product_stats[product_id] = {
-                    "product_id": product_id,
-                    "sku": item.get("sku", ""),
-                    "name": item.get("name", ""),
-                    "quantity_sold": 0,
-                    "revenue": 0
-                }
-            product_stats[product_id]["quantity_sold"] += item.get("quantity", 0)
-            product_stats[product_id]["revenue"] += item.get("total", 0)
-    
-    # Sort by revenue
-    top_products = sorted(product_stats.values(), key=lambda x: x["revenue"], reverse=True)[:limit]
-    
-    return {"products": top_products}
+    return {"products": reports.top_products(start_date, end_date, limit)}
 
 @app.get("/api/reports/top-categories")
 def get_top_categories(start_date: str = "", end_date: str = ""):
     """Get top selling categories"""
-    query = {"status": "completed"}
-    
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    sales = list(sales_col.find(query, {"_id": 0}))
-    
-    # Get all products for category mapping
-    products = {p["id"]: p for p in products_col.find({}, {"_id": 0})}
-    
-    # Aggregate by category
-    category_stats = {}
-    for sale in sales:
-        for item in sale.get("items", []):
-            product_id = item.get("product_id")
-            if product_id in products:
-                category = products[product_id].get("category", "Uncategorized")
-                if category not in category_stats:
-                    category_stats[category] = {
-                        "category": category,
-                        "quantity_sold": 0,
-                        "revenue": 0,
-                        "items_count": 0
-                    }
-                category_stats[category]["quantity_sold"] += item.get("quantity", 0)
-                category_stats[category]["revenue"] += item.get("total", 0)
-                category_stats[category]["items_count"] += 1
-    
-    # Sort by revenue
-    top_categories = sorted(category_stats.values(), key=lambda x: x["revenue"], reverse=True)
-    
-    return {"categories": top_categories}
+    return {"categories": reports.top_categories(start_date, end_date)}
 
 @app.get("/api/reports/discount-usage")
 def get_discount_usage(start_date: str = "", end_date: str = ""):
     """Get discount usage statistics"""
-    query = {"status": "completed"}
-    
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    sales = list(sales_col.find(query, {"_id": 0}))
-    
-    total_discount = sum(sale.get("total_discount", 0) for sale in sales)
-    invoices_with_discount = sum(1 for sale in sales if sale.get("total_discount", 0) > 0)
-    
-    # Discount by rule (if tracked in items)
-    rule_stats = {}
-    for sale in sales:
-        for item in sale.get("items", []):
-            if item.get("discount_amount", 0) > 0:
-                rule_name = item.get("applied_rule", "Manual Discount")
-                if rule_name not in rule_stats:
-                    rule_stats[rule_name] = {
-                        "rule_name": rule_name,
-                        "times_applied": 0,
-                        "total_discount": 0
-                    }
-                rule_stats[rule_name]["times_applied"] += 1
-                rule_stats[rule_name]["total_discount"] += item.get("discount_amount", 0)
-    
-    return {
-        "total_discount": total_discount,
-        "invoices_with_discount": invoices_with_discount,
-        "total_invoices": len(sales),
-        "discount_percentage": (invoices_with_discount / len(sales) * 100) if len(sales) > 0 else 0,
-        "rule_usage": list(rule_stats.values())
-    }
+    return reports.discount_usage(start_date, end_date)
 
 @app.get("/api/reports/daily-sales")
 def get_daily_sales(days: int = 7):
     """Get daily sales for the last N days"""
-    from datetime import datetime, timedelta, timezone
+    start = sales_rollups.window_start(days)
+    rows = sales_rollups.read_rollups("daily", start=sales_rollups.day_bucket(start), group_by=["bucket"])
     
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=days)
-    
-    sales = list(sales_col.find({
-        "status": "completed",
-        "created_at": {"$gte": start_date.isoformat()}
-    }, {"_id": 0}))
-    
-    # Group by date
-    daily_stats = {}
-    for sale in sales:
-        date = sale.get("created_at", "")[:10]  # Get YYYY-MM-DD
-        if date not in daily_stats:
-            daily_stats[date] = {
-                "date": date,
-                "revenue": 0,
-                "invoices": 0,
-                "items_sold": 0
-            }
-        daily_stats[date]["revenue"] += sale.get("total", 0)
-        daily_stats[date]["invoices"] += 1
-        daily_stats[date]["items_sold"] += sum(item.get("quantity", 0) for item in sale.get("items", []))
+    daily_data = [
+        {
+            "date": row["bucket"],
+            "revenue": row["revenue"],
+            "invoices": row["invoices"],
+            "items_sold": row["quantity"]
+        }
+        for row in rows
+    ]
     
     # Sort by date
-    daily_data = sorted(daily_stats.values(), key=lambda x: x["date"])
+    daily_data.sort(key=lambda x: x["date"])
     
     return {"daily_sales": daily_data}
 
 @app.get("/api/inventory/logs")
-def get_inventory_logs(product_id: str = "", limit: int = 50):
+def get_inventory_logs(product_id: str = "", limit: int = 50, cursor: str = ""):
     """Get inventory transaction logs"""
     query = {}
     if product_id:
         query["product_id"] = product_id
     
-    logs = list(inventory_logs_col.find(query, {"_id": 0}).sort("created_at", DESCENDING).limit(limit))
+    page = keyset_page(inventory_logs_col, query, [("created_at", DESCENDING), ("id", DESCENDING)],
+                       limit, cursor, total="none")
+    logs = page["items"]
     
     # Enrich with product names
     product_ids = set(log.get("product_id") for log in logs)
@@ -1351,7 +1216,7 @@ def get_inventory_logs(product_id: str = "", limit: int = 50):
             log["product_name"] = products[product_id].get("name_en", "")
             log["sku"] = products[product_id].get("sku", "")
     
-    return {"logs": logs, "total": len(logs)}
+    return {"logs": logs, "total": len(logs), "next_cursor": page["next_cursor"]}
 
 @app.get("/api/inventory/alerts")
 def get_inventory_alerts():
@@ -1378,43 +1243,7 @@ def get_inventory_alerts():
 @app.get("/api/reports/customer-stats")
 def get_customer_stats(start_date: str = "", end_date: str = ""):
     """Get customer purchase statistics"""
-    query = {"status": "completed"}
-    
-    if start_date:
-        query["created_at"] = {"$gte": start_date}
-    if end_date:
-        if "created_at" not in query:
-            query["created_at"] = {}
-        query["created_at"]["$lte"] = end_date
-    
-    sales = list(sales_col.find(query, {"_id": 0}))
-    
-    # Aggregate by customer
-    customer_stats = {}
-    for sale in sales:
-        customer_id = sale.get("customer_id") or "walk-in"
-        customer_name = sale.get("customer_name", "Walk-in")
-        
-        if customer_id not in customer_stats:
-            customer_stats[customer_id] = {
-                "customer_id": customer_id,
-                "customer_name": customer_name,
-                "total_purchases": 0,
-                "total_spent": 0,
-                "avg_purchase": 0
-            }
-        
-        customer_stats[customer_id]["total_purchases"] += 1
-        customer_stats[customer_id]["total_spent"] += sale.get("total", 0)
-    
-    # Calculate averages
-    for stats in customer_stats.values():
-        stats["avg_purchase"] = stats["total_spent"] / stats["total_purchases"] if stats["total_purchases"] > 0 else 0
-    
-    # Sort by total spent
-    top_customers = sorted(customer_stats.values(), key=lambda x: x["total_spent"], reverse=True)
-    
-    return {"customers": top_customers}
+    return {"customers": reports.customer_stats(start_date, end_date)}
 
 # ==================== HELD BILLS ====================
 
@@ -1453,84 +1282,30 @@ def delete_held_bill(bill_id: str):
 # ==================== BACKUPS ====================
 
 @app.post("/api/backups/create")
-def create_backup():
-    """Create full system backup as JSON"""
-    backup_data = {
-        "id": str(uuid.uuid4()),
-        "created_at": datetime.utcnow().isoformat(),
-        "type": "manual",
-        "data": {
-            "products": list(products_col.find({}, {"_id": 0})),
-            "customers": list(customers_col.find({}, {"_id": 0})),
-            "suppliers": list(suppliers_col.find({}, {"_id": 0})),
-            "discount_rules": list(discount_rules_col.find({}, {"_id": 0})),
-            "settings": settings_col.find_one({}, {"_id": 0})
-        }
-    }
-    
-    # Store backup metadata (without _id in response)
-    backup_meta = {
-        "id": backup_data["id"],
-        "created_at": backup_data["created_at"],
-        "type": backup_data["type"],
-        "products_count": len(backup_data["data"]["products"]),
-        "customers_count": len(backup_data["data"]["customers"]),
-        "suppliers_count": len(backup_data["data"]["suppliers"])
-    }
-    backups_col.insert_one(backup_meta.copy())
-    
-    # Clean the metadata for response
-    response_meta = backup_meta.copy()
+def create_backup(incremental: bool = False):
+    """Create a system backup (streamed to the backup target; returns metadata only)"""
+    try:
+        metadata = backup_service.create_backup(backup_type="manual", incremental=incremental)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Backup failed: {str(e)}")
     
     return {
         "message": "Backup created successfully",
-        "backup": backup_data,
-        "metadata": response_meta
+        "metadata": metadata
     }
 
 @app.get("/api/backups")
 def get_backups():
     """List all backup metadata"""
-    backups = list(backups_col.find({}, {"_id": 0}).sort("created_at", DESCENDING).limit(30))
+    backups = list(backups_col.find({}, {"_id": 0, "data": 0, "collections": 0}).sort("created_at", DESCENDING).limit(30))
     return {"backups": backups}
 
 @app.post("/api/backups/restore")
 def restore_backup(backup_data: dict):
     """Restore from backup JSON"""
     try:
-        data = backup_data.get("data", {})
-        
-        restored_counts = {}
-        
-        # Restore products
-        if "products" in data and data["products"]:
-            products_col.delete_many({})
-            products_col.insert_many(data["products"])
-            restored_counts["products"] = len(data["products"])
-        
-        # Restore customers
-        if "customers" in data and data["customers"]:
-            customers_col.delete_many({})
-            customers_col.insert_many(data["customers"])
-            restored_counts["customers"] = len(data["customers"])
-        
-        # Restore suppliers
-        if "suppliers" in data and data["suppliers"]:
-            suppliers_col.delete_many({})
-            suppliers_col.insert_many(data["suppliers"])
-            restored_counts["suppliers"] = len(data["suppliers"])
-        
-        # Restore discount rules
-        if "discount_rules" in data and data["discount_rules"]:
-            discount_rules_col.delete_many({})
-            discount_rules_col.insert_many(data["discount_rules"])
-            restored_counts["discount_rules"] = len(data["discount_rules"])
-        
-        # Restore settings
-        if "settings" in data and data["settings"]:
-            settings_col.delete_many({})
-            settings_col.insert_one(data["settings"])
-            restored_counts["settings"] = 1
+        # Staged and swapped in atomically; live data is untouched if any collection fails
+        restored_counts = backup_service.restore_data(backup_data.get("data", {}))
         
         return {
             "message": "Backup restored successfully",
@@ -1543,7 +1318,7 @@ def restore_backup(backup_data: dict):
 
 @app.get("/api/settings")
 def get_settings():
-    settings = settings_col.find_one({}, {"_id": 0})
+    settings = config.get("settings")
     if not settings:
         # Return default settings
         settings = {
@@ -1563,96 +1338,139 @@ def get_settings():
 def update_settings(settings: dict):
     settings_col.delete_many({})
     settings_col.insert_one(settings)
+    config.changed("settings")
     return {"message": "Settings updated", "settings": settings}
 
 # ==================== CSV IMPORT/EXPORT ====================
 
 @app.get("/api/export/products")
-def export_products_csv():
-    products = list(products_col.find({"active": True}, {"_id": 0}))
-    csv_content = csv_utils.products_to_csv(products)
-    
-    return StreamingResponse(
-        io.StringIO(csv_content),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=products_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
-    )
-
-@app.post("/api/import/products/validate")
-async def validate_products_csv(file: UploadFile = File(...)):
-    content = await file.read()
-    csv_data = csv_utils.parse_csv_content(content.decode('utf-8'))
-    
-    is_valid, errors, valid_rows = csv_utils.validate_product_csv(csv_data)
-    
+def export_products_csv(gzip: bool = False):
+    products = products_col.find({"active": True}, csv_utils.export_projection(csv_utils.PRODUCT_FIELDS),
+                                 batch_size=csv_utils.EXPORT_BATCH_SIZE)
+    return csv_response(csv_utils.stream_products_csv(products, compress=gzip), "products", gzip)
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '1000'))
+
+async def iter_upload_chunks(file: UploadFile):
+    """Parse an uploaded CSV in chunks of IMPORT_CHUNK_SIZE rows without reading it all into memory"""
+    await file.seek(0)
+    chunks = csv_utils.iter_csv_chunks(file.file, IMPORT_CHUNK_SIZE)
+    while True:
+        # The upload may have spooled to disk, so parse off the event loop
+        chunk = await run_in_threadpool(next, chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+async def validate_product_upload(file: UploadFile) -> Dict:
+    """Validate every row of a product CSV upload, one chunk at a time"""
+    errors = []
+    preview = []
+    total_count = 0
+    valid_count = 0
+    async for chunk in iter_upload_chunks(file):
+        _, chunk_errors, valid_rows = csv_utils.validate_product_csv(chunk, start=total_count + 1)
+        errors.extend(chunk_errors)
+        preview.extend(valid_rows[:10 - len(preview)])
+        total_count += len(chunk)
+        valid_count += len(valid_rows)
     return {
-        "valid": is_valid,
+        "valid": not errors,
         "errors": errors,
-        "valid_count": len(valid_rows),
-        "total_count": len(csv_data),
-        "preview": valid_rows[:10]  # Show first 10 valid rows
+        "valid_count": valid_count,
+        "total_count": total_count,
+        "preview": preview  # Show first 10 valid rows
+    }
+
+def product_from_csv_row(row: Dict) -> Dict:
+    return {
+        "sku": row['sku'],
+        "barcodes": row.get('barcodes', '').split(',') if row.get('barcodes') else [],
+        "name_en": row['name_en'],
+        "name_si": row.get('name_si', ''),
+        "name_ta": row.get('name_ta', ''),
+        "unit": row.get('unit', 'pcs'),
+        "category": row.get('category', ''),
+        "tax_code": row.get('tax_code', ''),
+        "supplier_id": row.get('supplier_id', ''),
+        # Blank optional cells pass validation and import as 0
+        "price_retail": float(row.get('price_retail') or 0),
+        "price_wholesale": float(row.get('price_wholesale') or 0),
+        "price_credit": float(row.get('price_credit') or 0),
+        "price_other": float(row.get('price_other') or 0),
+        "stock": float(row.get('stock') or 0),
+        "reorder_level": float(row.get('reorder_level') or 0),
+        "weight_based": (row.get('weight_based') or '').lower() in ['true', '1', 'yes'],
+        "active": (row.get('active') or '').lower() not in ['false', '0', 'no'],
+        "updated_at": datetime.utcnow().isoformat()
     }
 
+@app.post("/api/import/products/validate")
+async def validate_products_csv(file: UploadFile = File(...)):
+    return await validate_product_upload(file)
+
+def products_imported(skus: List[str]):
+    refreshed = product_cache.refresh({"sku": {"$in": skus}})
+    change_log.record("product", [product["id"] for product in refreshed])
+
 @app.post("/api/import/products")
 async def import_products_csv(file: UploadFile = File(...)):
-    content = await file.read()
-    csv_data = csv_utils.parse_csv_content(content.decode('utf-8'))
-    
-    is_valid, errors, valid_rows = csv_utils.validate_product_csv(csv_data)
-    
-    if not is_valid:
-        raise HTTPException(status_code=400, detail={"errors": errors})
+    """
+    Upsert products by SKU. The whole file is validated first (nothing is
+    written if any row is invalid), then each chunk is written as one
+    unordered bulk_write.
+    """
+    validation = await validate_product_upload(file)
+    if not validation["valid"]:
+        raise HTTPException(status_code=400, detail={"errors": validation["errors"]})
     
     imported = 0
     updated = 0
-    
-    for row in valid_rows:
-        # Check if product exists by SKU
-        existing = products_col.find_one({"sku": row['sku']})
+    chunks = []
+    
+    async for chunk in iter_upload_chunks(file):
+        now = datetime.utcnow().isoformat()
+        # One upsert per SKU; a SKU repeated within the chunk keeps its last row
+        operations = {}
+        for row in chunk:
+            operations[row['sku']] = UpdateOne(
+                {"sku": row['sku']},
+                {
+                    "$set": product_from_csv_row(row),
+                    "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}
+                },
+                upsert=True
+            )
         
-        product_data = {
-            "sku": row['sku'],
-            "barcodes": row.get('barcodes', '').split(',') if row.get('barcodes') else [],
-            "name_en": row['name_en'],
-            "name_si": row.get('name_si', ''),
-            "name_ta": row.get('name_ta', ''),
-            "unit": row.get('unit', 'pcs'),
-            "category": row.get('category', ''),
-            "tax_code": row.get('tax_code', ''),
-            "supplier_id": row.get('supplier_id', ''),
-            "price_retail": float(row.get('price_retail', 0)),
-            "price_wholesale": float(row.get('price_wholesale', 0)),
-            "price_credit": float(row.get('price_credit', 0)),
-            "price_other": float(row.get('price_other', 0)),
-            "stock": float(row.get('stock', 0)),
-            "reorder_level": float(row.get('reorder_level', 0)),
-            "weight_based": row.get('weight_based', '').lower() in ['true', '1', 'yes'],
-            "active": row.get('active', '').lower() not in ['false', '0', 'no'],
-            "updated_at": datetime.utcnow().isoformat()
-        }
+        try:
+            result = await async_import_products_col.bulk_write(list(operations.values()), ordered=False)
+        except BulkWriteError as e:
+            raise HTTPException(status_code=409, detail={
+                "message": f"Import stopped at chunk {len(chunks) + 1}; earlier chunks were saved",
+                "imported": imported,
+                "updated": updated,
+                "errors": [error.get("errmsg", "") for error in e.details.get("writeErrors", [])][:20]
+            })
         
-        if existing:
-            product_data['id'] = existing['id']
-            products_col.update_one({"sku": row['sku']}, {"$set": product_data})
-            updated += 1
-        else:
-            product_data['id'] = str(uuid.uuid4())
-            product_data['created_at'] = datetime.utcnow().isoformat()
-            products_col.insert_one(product_data)
-            imported += 1
-    
-    return {"message": "Import successful", "imported": imported, "updated": updated}
+        await run_in_threadpool(products_imported, list(operations))
+        imported += result.upserted_count
+        updated += result.matched_count
+        chunks.append({
+            "chunk": len(chunks) + 1,
+            "rows": len(chunk),
+            "imported": result.upserted_count,
+            "updated": result.matched_count
+        })
+        print(f"📦 Product import chunk {len(chunks)}: {len(chunk)} rows "
+              f"({imported} imported, {updated} updated so far)")
+    
+    return {"message": "Import successful", "imported": imported, "updated": updated, "chunks": chunks}
 
 @app.get("/api/export/customers")
-def export_customers_csv():
-    customers = list(customers_col.find({"active": True}, {"_id": 0}))
-    csv_content = csv_utils.customers_to_csv(customers)
-    
-    return StreamingResponse(
-        io.StringIO(csv_content),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=customers_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
-    )
+def export_customers_csv(gzip: bool = False):
+    customers = customers_col.find({"active": True}, csv_utils.export_projection(csv_utils.CUSTOMER_FIELDS),
+                                   batch_size=csv_utils.EXPORT_BATCH_SIZE)
+    return csv_response(csv_utils.stream_customers_csv(customers, compress=gzip), "customers", gzip)
 
 @app.post("/api/import/customers")
 async def import_customers_csv(file: UploadFile = File(...)):
@@ -1665,6 +1483,8 @@ async def import_customers_csv(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail={"errors": errors})
     
     imported = 0
+    imported_ids = []
+    customers = []
     
     for row in valid_rows:
         customer_data = {
@@ -1680,21 +1500,20 @@ async def import_customers_csv(file: UploadFile = File(...)):
             "active": row.get('active', '').lower() not in ['false', '0', 'no'],
             "created_at": datetime.utcnow().isoformat()
         }
-        customers_col.insert_one(customer_data)
+        customers.append(customer_data)
+        imported_ids.append(customer_data["id"])
         imported += 1
     
+    if customers:
+        await async_customers_col.insert_many(customers)
+    await run_in_threadpool(change_log.record, "customer", imported_ids)
     return {"message": "Import successful", "imported": imported}
 
 @app.get("/api/export/suppliers")
-def export_suppliers_csv():
-    suppliers = list(suppliers_col.find({"active": True}, {"_id": 0}))
-    csv_content = csv_utils.suppliers_to_csv(suppliers)
-    
-    return StreamingResponse(
-        io.StringIO(csv_content),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=suppliers_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
-    )
+def export_suppliers_csv(gzip: bool = False):
+    suppliers = suppliers_col.find({"active": True}, csv_utils.export_projection(csv_utils.SUPPLIER_FIELDS),
+                                   batch_size=csv_utils.EXPORT_BATCH_SIZE)
+    return csv_response(csv_utils.stream_suppliers_csv(suppliers, compress=gzip), "suppliers", gzip)
 
 @app.post("/api/import/suppliers")
 async def import_suppliers_csv(file: UploadFile = File(...)):
@@ -1707,6 +1526,7 @@ async def import_suppliers_csv(file: UploadFile = File(...)):
         raise HTTPException(status_code=400, detail={"errors": errors})
     
     imported = 0
+    suppliers = []
     
     for row in valid_rows:
         supplier_data = {
@@ -1720,24 +1540,21 @@ async def import_suppliers_csv(file: UploadFile = File(...)):
             "active": row.get('active', '').lower() not in ['false', '0', 'no'],
             "created_at": datetime.utcnow().isoformat()
         }
-        suppliers_col.insert_one(supplier_data)
+        suppliers.append(supplier_data)
         imported += 1
     
+    if suppliers:
+        await async_suppliers_col.insert_many(suppliers)
     return {"message": "Import successful", "imported": imported}
 
 @app.get("/api/export/discount-rules")
-def export_discount_rules_csv():
-    rules = list(discount_rules_col.find({"active": True}, {"_id": 0}))
-    csv_content = csv_utils.discount_rules_to_csv(rules)
-    
-    return StreamingResponse(
-        io.StringIO(csv_content),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=discount_rules_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
-    )
+def export_discount_rules_csv(gzip: bool = False):
+    rules = discount_rules_col.find({"active": True}, csv_utils.export_projection(csv_utils.DISCOUNT_RULE_FIELDS),
+                                    batch_size=csv_utils.EXPORT_BATCH_SIZE)
+    return csv_response(csv_utils.stream_discount_rules_csv(rules, compress=gzip), "discount_rules", gzip)
 
 @app.get("/api/export/sales")
-def export_sales_csv(start_date: str = "", end_date: str = ""):
+def export_sales_csv(start_date: str = "", end_date: str = "", gzip: bool = False):
     query = {"status": "completed"}
     if start_date:
         query["created_at"] = {"$gte": start_date}
@@ -1746,14 +1563,9 @@ def export_sales_csv(start_date: str = "", end_date: str = ""):
             query["created_at"] = {}
         query["created_at"]["$lte"] = end_date
     
-    sales = list(sales_col.find(query, {"_id": 0}))
-    csv_content = csv_utils.sales_to_csv(sales)
-    
-    return StreamingResponse(
-        io.StringIO(csv_content),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=sales_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.csv"}
-    )
+    sales = sales_col.find(query, csv_utils.export_projection(csv_utils.SALE_FIELDS),
+                           batch_size=csv_utils.EXPORT_BATCH_SIZE)
+    return csv_response(csv_utils.stream_sales_csv(sales, compress=gzip), "sales", gzip)
 
 @app.post("/api/prices/bulk-update")
 def bulk_update_prices(rule: Dict):
@@ -1793,6 +1605,8 @@ def bulk_update_prices(rule: Dict):
         )
         updated_count += 1
     
+    product_cache.reload()
+    change_log.record("product", [product['id'] for product in products])
     return {"message": f"Updated {updated_count} products", "count": updated_count}
 
 # ==================== TERMINALS ====================
@@ -1841,9 +1655,37 @@ def terminal_heartbeat(terminal_id: str):
         raise HTTPException(status_code=404, detail="Terminal not found")
     return {"message": "Heartbeat received"}
 
+@app.post("/api/terminals/{terminal_id}/invoice-block")
+def lease_invoice_block(terminal_id: str, size: int = Query(default=0, ge=0, le=1000)):
+    """Lease a block of invoice numbers so the terminal can number sales offline"""
+    lease = invoice_service.lease_block_for_terminal(terminal_id, size or None)
+    if not lease:
+        raise HTTPException(status_code=404, detail="Terminal not found")
+    return {"message": "Invoice block leased", "block": lease}
+
+@app.get("/api/settings/cache/stats")
+def get_settings_cache_stats():
+    return config.stats()
+
 @app.get("/api/sync/changes")
-def get_sync_changes(since: str = "", terminal_id: str = ""):
-    """Get changes since timestamp for syncing"""
+def get_sync_changes(since: str = "", terminal_id: str = "", since_seq: Optional[int] = None,
+                     limit: int = Query(default=500, ge=1, le=5000)):
+    """
+    Catalog changes for a terminal. With since_seq, returns every product,
+    customer and discount rule change after that sequence number (current
+    document or delete tombstone), settings invalidations, and the next_seq
+    to ask for next time.
+    Without it, falls back to the old updated_at comparison.
+    """
+    if since_seq is not None:
+        changes = change_log.changes(since_seq, limit)
+        if terminal_id:
+            terminals_col.update_one(
+                {"id": terminal_id},
+                {"$set": {"sync_seq": changes["next_seq"], "last_sync": datetime.utcnow().isoformat()}}
+            )
+        return changes
+    
     query = {}
     if since:
         query["updated_at"] = {"$gt": since}
@@ -1857,6 +1699,55 @@ def get_sync_changes(since: str = "", terminal_id: str = ""):
     
     return changes
 
+@app.get("/api/sync/snapshot")
+def get_catalog_snapshot(if_none_match: Optional[str] = Header(default=None),
+                         accept_encoding: str = Header(default="")):
+    """
+    Full active catalog and discount rules as one gzip columnar JSON
+    download. Follow up with /api/sync/changes?since_seq=<X-Catalog-Seq>.
+    """
+    snapshot = catalog_snapshot.current()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache", "X-Catalog-Seq": str(snapshot.seq)}
+    if snapshot.matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    if "gzip" not in accept_encoding:
+        return Response(content=gzip_codec.decompress(snapshot.body), media_type="application/json", headers=headers)
+    return Response(content=snapshot.body, media_type="application/json",
+                    headers={**headers, "Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+
+@app.get("/api/sync/snapshot/status")
+def get_catalog_snapshot_status():
+    return catalog_snapshot.status()
+
+@app.get("/api/sync/stream")
+async def sync_stream(since_seq: Optional[int] = None, last_event_id: Optional[str] = Header(default=None)):
+    """
+    Server-Sent Events feed of the same change batches as /api/sync/changes,
+    pushed as writes happen. EventSource reconnects resume from Last-Event-ID.
+    """
+    if last_event_id and last_event_id.isdigit():
+        since_seq = int(last_event_id)
+    return StreamingResponse(push_hub.sse(since_seq), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/sync/ws")
+async def sync_socket(websocket: WebSocket, since_seq: Optional[int] = None):
+    """WebSocket feed of change batches, one JSON message each"""
+    await websocket.accept()
+    messages = push_hub.messages(since_seq)
+    try:
+        async for message in messages:
+            await websocket.send_text(json.dumps(message, separators=(',', ':'), ensure_ascii=False, default=str))
+    except (WebSocketDisconnect, RuntimeError, OSError):
+        # Client went away
+        pass
+    finally:
+        await messages.aclose()
+
+@app.get("/api/sync/push/status")
+def get_sync_push_status():
+    return push_hub.stats()
+
 @app.get("/api/sync/status")
 def get_sync_status():
     """Get sync status of all terminals"""
@@ -2264,6 +2155,8 @@ def seed_sample_data():
         }
     ]
     products_col.insert_many(products)
+    product_cache.reload()
+    change_log.reset("seed data")
     
     # Sample customers with more variety
     customers = [
@@ -2388,6 +2281,7 @@ def seed_sample_data():
         }
     ]
     discount_rules_col.insert_many(discount_rules)
+    discount_engine.invalidate()
     
     # Initialize store settings
     settings_col.delete_many({})
@@ -2405,6 +2299,7 @@ def seed_sample_data():
         "low_stock_threshold": 10,
         "created_at": datetime.utcnow().isoformat()
     })
+    config.reload("settings")
     
     return {
         "message": "✅ Production-ready sample data seeded successfully",
@@ -0,0 +1,251 @@
+"""
+Backup scheduler
+
+Runs automatic backups in a background thread according to the
+auto_backup_enabled / backup_frequency_hours system settings. Every API
+worker starts a scheduler, but a lease lock in MongoDB lets only one of them
+run a given backup. Runs are recorded in backup_runs, and old scheduled
+backups are pruned by count and age afterwards.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from services.backup_service import backup_service
+from services.config_service import config
+from services.sales_rollup_service import STORE_TIMEZONE
+from utils.database import db, backups_col
+
+backup_runs_col = db['backup_runs']
+scheduler_locks_col = db['scheduler_locks']
+
+backup_runs_col.create_index([('started_at', DESCENDING)])
+
+POLL_SECONDS = int(os.environ.get('BACKUP_SCHEDULER_POLL_SECONDS', '60'))
+LOCK_TTL_SECONDS = int(os.environ.get('BACKUP_LOCK_TTL_SECONDS', '600'))
+RETRY_MINUTES = int(os.environ.get('BACKUP_RETRY_MINUTES', '30'))
+# A full backup at least this often; scheduled runs in between are incremental
+FULL_INTERVAL_HOURS = int(os.environ.get('BACKUP_FULL_INTERVAL_HOURS', '168'))
+RETENTION_COUNT = int(os.environ.get('BACKUP_RETENTION_COUNT', '14'))
+RETENTION_DAYS = int(os.environ.get('BACKUP_RETENTION_DAYS', '30'))
+# Store-local hours scheduled backups may start in, e.g. "1-5" (empty = any time)
+BACKUP_WINDOW = os.environ.get('BACKUP_WINDOW_HOURS', '')
+
+FREQUENCY_HOURS = {"hourly": 1, "daily": 24, "weekly": 168}
+
+
+def in_backup_window(moment: datetime) -> bool:
+    """Whether a UTC moment falls inside the store-local backup window"""
+    if not BACKUP_WINDOW:
+        return True
+    start, end = (int(hour) for hour in BACKUP_WINDOW.split('-'))
+    hour = moment.astimezone(STORE_TIMEZONE).hour
+    # A window like "22-4" wraps past midnight
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+class LeaseLock:
+    """Expiring lock document so only one worker runs a job at a time"""
+
+    def __init__(self, name: str, ttl_seconds: int):
+        self.name = name
+        self.ttl = ttl_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+    def acquire(self) -> bool:
+        now = datetime.now(timezone.utc)
+        try:
+            scheduler_locks_col.find_one_and_update(
+                {"_id": self.name, "$or": [{"expires_at": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "expires_at": now + timedelta(seconds=self.ttl)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Held by another worker: the filter missed and the upsert collided
+            return False
+
+    def renew(self) -> bool:
+        result = scheduler_locks_col.update_one(
+            {"_id": self.name, "owner": self.owner},
+            {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)}}
+        )
+        return result.matched_count == 1
+
+    def release(self):
+        scheduler_locks_col.delete_one({"_id": self.name, "owner": self.owner})
+
+
+class BackupScheduler:
+    def __init__(self):
+        self.enabled = os.environ.get('BACKUP_SCHEDULER_ENABLED', 'true').lower() != 'false'
+        self.lock = LeaseLock("backup", LOCK_TTL_SECONDS)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="backup-scheduler", daemon=True)
+        self._thread.start()
+        print(f"✅ Backup scheduler started (polling every {POLL_SECONDS}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(POLL_SECONDS):
+            try:
+                self.run_if_due()
+            except Exception as e:
+                print(f"❌ Backup scheduler error: {str(e)}")
+
+    @staticmethod
+    def settings() -> Dict:
+        return {
+            "auto_backup_enabled": config.value("system_settings", "auto_backup_enabled", False),
+            "backup_frequency_hours": config.value("system_settings", "backup_frequency_hours", 24)
+        }
+
+    @staticmethod
+    def last_run() -> Optional[Dict]:
+        return backup_runs_col.find_one({}, {"_id": 0}, sort=[("started_at", DESCENDING)])
+
+    def next_due(self) -> Optional[datetime]:
+        """When the next scheduled backup is due (None when automatic backups are off)"""
+        settings = self.settings()
+        if not settings["auto_backup_enabled"]:
+            return None
+        last = self.last_run()
+        if not last:
+            return datetime.now(timezone.utc)
+        interval = timedelta(hours=settings["backup_frequency_hours"])
+        if last["status"] == "failed":
+            # Retry sooner than the regular interval, without retrying every poll
+            interval = min(interval, timedelta(minutes=RETRY_MINUTES))
+        return datetime.fromisoformat(last["started_at"]) + interval
+
+    def run_if_due(self) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        due = self.next_due()
+        if due is None or now < due or not in_backup_window(now):
+            return None
+        if not self.lock.acquire():
+            return None
+        try:
+            # Another worker may have finished a run since the check above
+            due = self.next_due()
+            if due is None or datetime.now(timezone.utc) < due:
+                return None
+            return self.run()
+        finally:
+            self.lock.release()
+
+    def _needs_full(self) -> bool:
+        last_full = backups_col.find_one(
+            {"status": "completed", "high_water_mark": {"$exists": True}, "kind": {"$ne": "incremental"}},
+            {"_id": 0, "created_at": 1},
+            sort=[("created_at", DESCENDING)]
+        )
+        if not last_full:
+            return True
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(last_full["created_at"])
+        return age >= timedelta(hours=FULL_INTERVAL_HOURS)
+
+    def _heartbeat(self, done: threading.Event):
+        # Keep the lease alive while a long backup runs
+        while not done.wait(max(1, LOCK_TTL_SECONDS // 3)):
+            self.lock.renew()
+
+    def run(self) -> Dict:
+        """Run one scheduled backup now, then prune; the caller holds the lock"""
+        started = time.monotonic()
+        run = {
+            "id": str(uuid.uuid4()),
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "status": "running",
+            "worker": self.lock.owner
+        }
+        backup_runs_col.insert_one(run.copy())
+
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(done,), daemon=True).start()
+        try:
+            result = backup_service.create_backup(
+                backup_type="scheduled", incremental=not self._needs_full()
+            )
+            pruned = self.prune()
+            run.update({
+                "status": "completed",
+                "backup_id": result["backup_id"],
+                "kind": result["kind"],
+                "size_mb": result["size_mb"],
+                "pruned": pruned
+            })
+        except Exception as e:
+            run.update({"status": "failed", "error": str(e)})
+            print(f"❌ Scheduled backup failed: {str(e)}")
+        finally:
+            done.set()
+
+        run["finished_at"] = datetime.now(timezone.utc).isoformat()
+        run["duration_seconds"] = round(time.monotonic() - started, 3)
+        backup_runs_col.update_one({"id": run["id"]}, {"$set": run})
+        return run
+
+    def prune(self) -> List[str]:
+        """
+        Delete scheduled backups beyond RETENTION_COUNT or older than
+        RETENTION_DAYS. Backups that a kept incremental chains back to are
+        always kept.
+        """
+        manifests = list(backups_col.find(
+            {"type": "scheduled", "collections": {"$exists": True}},
+            {"_id": 0, "backup_id": 1, "created_at": 1}
+        ).sort("created_at", DESCENDING))
+        cutoff = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+
+        keep = set()
+        for index, manifest in enumerate(manifests):
+            if index < RETENTION_COUNT and datetime.fromisoformat(manifest["created_at"]) >= cutoff:
+                keep.add(manifest["backup_id"])
+
+        # Walk each kept backup's parent chain (which may include manual backups)
+        pending = list(keep)
+        while pending:
+            parent = backups_col.find_one({"backup_id": pending.pop()}, {"_id": 0, "parent_backup_id": 1})
+            parent_id = parent.get("parent_backup_id") if parent else None
+            if parent_id and parent_id not in keep:
+                keep.add(parent_id)
+                pending.append(parent_id)
+
+        pruned = [manifest["backup_id"] for manifest in manifests if manifest["backup_id"] not in keep]
+        if pruned:
+            # Chunks shared with kept backups stay; the rest are garbage collected
+            backup_service.delete_backups(pruned)
+            print(f"🧹 Pruned {len(pruned)} old scheduled backups")
+        return pruned
+
+    def status(self) -> Dict:
+        due = self.next_due()
+        return {
+            **self.settings(),
+            "scheduler_running": bool(self._thread and self._thread.is_alive()),
+            "backup_window_hours": BACKUP_WINDOW or None,
+            "retention": {"count": RETENTION_COUNT, "days": RETENTION_DAYS},
+            "next_due": due.isoformat() if due else None,
+            "recent_runs": list(backup_runs_col.find({}, {"_id": 0}).sort("started_at", DESCENDING).limit(10))
+        }
+
+
+# Singleton instance
+backup_scheduler = BackupScheduler()
@@ -1,7 +1,12 @@
-from datetime import datetime, timezone
-from typing import Dict, Optional
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+import functools
+import itertools
 import json
 import os
+import time
 import uuid
 
 # Google Cloud Storage will be configured here
@@ -12,10 +17,87 @@ except ImportError:
     GCS_AVAILABLE = False
     print("⚠️  google-cloud-storage not installed. Cloud backups disabled.")
 
-from utils.database import (
-    products_col, sales_col, customers_col, suppliers_col,
-    discount_rules_col, users_col, backups_col
+from pymongo import ASCENDING, IndexModel, ReplaceOne
+
+from services.backup_storage import (
+    CHUNK_PREFIX, BackupTarget, GCSBackupTarget, LocalBackupTarget,
+    chunk_path, encode_chunk, iter_chunks, read_segment, write_chunk
 )
+from services.discount_engine import discount_engine
+from services.change_log import change_log
+from services.config_service import COLLECTIONS as CONFIG_COLLECTIONS, config
+from services.product_cache import product_cache
+from services import sales_rollup_service as sales_rollups
+from utils.database import registry, backups_col
+
+# Backups read from a secondary when one is available; restores write in bulk
+source_db = registry.database("reporting")
+restore_db = registry.database("bulk")
+system_settings_col = registry.database()['system_settings']
+# Content hash -> stored chunk (path, size, checksum of the stored bytes)
+backup_chunks_col = registry.database()['backup_chunks']
+
+BACKUP_BATCH_SIZE = int(os.environ.get('BACKUP_BATCH_SIZE', '1000'))
+# Average documents per content-addressed chunk
+BACKUP_CHUNK_DOCS = int(os.environ.get('BACKUP_CHUNK_DOCS', '500'))
+BACKUP_RESTORE_WORKERS = int(os.environ.get('BACKUP_RESTORE_WORKERS', '4'))
+# Chunks each restoring collection downloads ahead of the loader
+BACKUP_CHUNK_FETCH_WORKERS = int(os.environ.get('BACKUP_CHUNK_FETCH_WORKERS', '4'))
+# Unreferenced chunks younger than this may belong to a backup still running
+BACKUP_CHUNK_GC_GRACE_HOURS = int(os.environ.get('BACKUP_CHUNK_GC_GRACE_HOURS', '24'))
+# Deltas reach this far behind the previous high-water mark, so writes that
+# were in flight while it was taken are not missed (replay is idempotent)
+BACKUP_DELTA_OVERLAP_SECONDS = int(os.environ.get('BACKUP_DELTA_OVERLAP_SECONDS', '300'))
+
+# Collection -> extra projection
+BACKUP_COLLECTIONS = {
+    "products": {},
+    "customers": {},
+    "suppliers": {},
+    "discount_rules": {},
+    "settings": {},
+    "sales": {},
+    "stock_movements": {},
+    "inventory_logs": {},
+    "users": {"password": 0},  # Exclude passwords
+}
+# Users are backed up for reference only (no passwords), so never restored.
+# History collections only come back from manifest backups, whose base
+# holds a full copy; see restore_backup.
+RESTORE_COLLECTIONS = ["products", "customers", "suppliers", "discount_rules", "settings",
+                       "sales", "stock_movements", "inventory_logs"]
+
+# What a downloaded JSON backup carries, as the original single-file backups
+# did, and all an inline backup may restore: those backups held at most the
+# last 1000 sales, so restoring history from them would drop the rest
+INLINE_COLLECTIONS = ["products", "customers", "suppliers", "discount_rules", "settings"]
+
+# Restoring any of these invalidates what terminals have synced
+RESTORED_CATALOG = {"products", "customers", "discount_rules"}
+
+# History collections that incremental backups capture as deltas:
+# collection -> (document key, timestamp fields that mark a change).
+# Everything else is small and copied in full by every backup. Sales are
+# stamped with a server-side updated_at when stored, since their created_at
+# is the terminal's clock; created_at still covers sales stored before that.
+INCREMENTAL_COLLECTIONS = {
+    "sales": ("id", ["updated_at", "created_at"]),
+    "stock_movements": ("id", ["timestamp"]),
+    "inventory_logs": ("id", ["created_at"]),
+}
+
+for _name, (_key, _fields) in INCREMENTAL_COLLECTIONS.items():
+    for _field in _fields:
+        registry.database()[_name].create_index([(_field, ASCENDING)])
+
+
+def _batches(documents: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    iterator = iter(documents)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 class BackupService:
@@ -37,66 +119,175 @@ class BackupService:
                 print(f"✅ Google Cloud Storage connected: {self.gcs_bucket_name}")
             except Exception as e:
                 print(f"❌ GCS connection failed: {str(e)}")
+        
+        # Without a bucket, backups go to a local directory laid out the same way
+        self.target: BackupTarget = GCSBackupTarget(self.gcs_bucket) if self.gcs_bucket else LocalBackupTarget()
     
-    def create_backup(self, backup_name: str = None, user_id: str = "system") -> Dict:
-        """Create a full database backup"""
+    def create_backup(self, backup_name: str = None, user_id: str = "system", backup_type: str = "manual",
+                      incremental: bool = False) -> Dict:
+        """
+        Create a database backup. Each collection is streamed by cursor
+        into gzip NDJSON segments on the backup target; only the manifest
+        (segment paths, counts and checksums) is stored in MongoDB.
+        
+        An incremental backup copies only the history documents changed
+        since the previous backup's high-water mark and chains to it; with no
+        previous backup it falls back to a full one.
+        """
+        started = time.monotonic()
+        created_at = datetime.now(timezone.utc)
         if not backup_name:
-            backup_name = f"backup_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}"
+            backup_name = f"backup_{created_at.strftime('%Y%m%d_%H%M%S')}"
+        
+        parent = self._latest_backup() if incremental else None
+        since = None
+        if parent:
+            since = (datetime.fromisoformat(parent["high_water_mark"])
+                     - timedelta(seconds=BACKUP_DELTA_OVERLAP_SECONDS)).isoformat()
         
-        # Collect all data
-        backup_data = {
-            "backup_id": str(uuid.uuid4()),
+        backup_id = str(uuid.uuid4())
+        manifest = {
+            "backup_id": backup_id,
             "backup_name": backup_name,
-            "created_at": datetime.now(timezone.utc).isoformat(),
+            "type": backup_type,
+            "kind": "incremental" if parent else "full",
+            "created_at": created_at.isoformat(),
             "created_by": user_id,
-            "data": {
-                "products": list(products_col.find({}, {"_id": 0})),
-                "sales": list(sales_col.find({}, {"_id": 0}).limit(1000)),  # Last 1000 sales
-                "customers": list(customers_col.find({}, {"_id": 0})),
-                "suppliers": list(suppliers_col.find({}, {"_id": 0})),
-                "discount_rules": list(discount_rules_col.find({}, {"_id": 0})),
-                "users": list(users_col.find({}, {"_id": 0, "password": 0}))  # Exclude passwords
-            }
+            "status": "in_progress",
+            "format": "ndjson.gz",
+            "cloud_storage": self.target.name,
+            # Stored timestamps are naive UTC ISO strings, so the mark is too
+            "high_water_mark": created_at.replace(tzinfo=None).isoformat(),
+            "since": since,
+            "parent_backup_id": parent["backup_id"] if parent else None,
+            "base_backup_id": (parent.get("base_backup_id") or parent["backup_id"]) if parent else None,
+            "collections": {}
         }
+        backups_col.insert_one(manifest.copy())
         
-        # Save to MongoDB
-        backups_col.insert_one(backup_data.copy())
+        try:
+            for name, projection in BACKUP_COLLECTIONS.items():
+                query = {}
+                if since and name in INCREMENTAL_COLLECTIONS:
+                    query = {"$or": [{field: {"$gte": since}} for field in INCREMENTAL_COLLECTIONS[name][1]]}
+                manifest["collections"][name] = self._backup_collection(backup_id, name, projection, query)
+        except Exception as e:
+            print(f"❌ Backup {backup_name} failed: {str(e)}")
+            # Chunks this backup stored may already be reused by a concurrent
+            # one; collect_garbage removes them once nothing references them
+            backups_col.update_one(
+                {"backup_id": backup_id},
+                {"$set": {"status": "failed", "error": str(e), "collections": manifest["collections"]}}
+            )
+            raise
         
-        # Upload to GCS if configured
-        if self.gcs_bucket:
-            try:
-                blob = self.gcs_bucket.blob(f"backups/{backup_name}.json")
-                blob.upload_from_string(
-                    json.dumps(backup_data, indent=2),
-                    content_type='application/json'
-                )
-                backup_data['cloud_storage'] = 'gcs'
-                backup_data['cloud_path'] = f"gs://{self.gcs_bucket_name}/backups/{backup_name}.json"
-                print(f"✅ Backup uploaded to GCS: {backup_name}")
-            except Exception as e:
-                print(f"❌ GCS upload failed: {str(e)}")
-                backup_data['cloud_storage'] = 'failed'
-                backup_data['cloud_error'] = str(e)
-        else:
-            backup_data['cloud_storage'] = 'local_only'
+        total_bytes = sum(c["bytes"] for c in manifest["collections"].values())
+        uploaded_bytes = sum(c["uploaded_bytes"] for c in manifest["collections"].values())
+        completion = {
+            "status": "completed",
+            "collections": manifest["collections"],
+            "counts": {name: c["count"] for name, c in manifest["collections"].items()},
+            "total_bytes": total_bytes,
+            "size_mb": total_bytes / (1024 * 1024),
+            "uploaded_bytes": uploaded_bytes,
+            "uploaded_mb": uploaded_bytes / (1024 * 1024),
+            "location": self.target.location(CHUNK_PREFIX),
+            "completed_at": datetime.now(timezone.utc).isoformat(),
+            "duration_seconds": round(time.monotonic() - started, 3)
+        }
+        backups_col.update_one({"backup_id": backup_id}, {"$set": completion})
+        print(f"✅ Backup {backup_name} written to {completion['location']} "
+              f"({completion['size_mb']:.2f} MB, {completion['uploaded_mb']:.2f} MB new)")
         
         return {
-            "backup_id": backup_data['backup_id'],
+            "backup_id": backup_id,
             "backup_name": backup_name,
-            "created_at": backup_data['created_at'],
-            "cloud_storage": backup_data.get('cloud_storage', 'local_only'),
-            "size_mb": len(json.dumps(backup_data)) / (1024 * 1024)
+            "kind": manifest["kind"],
+            "parent_backup_id": manifest["parent_backup_id"],
+            "created_at": manifest["created_at"],
+            "cloud_storage": self.target.name,
+            "location": completion["location"],
+            "counts": completion["counts"],
+            "size_mb": completion["size_mb"],
+            "uploaded_mb": completion["uploaded_mb"],
+            "duration_seconds": completion["duration_seconds"]
+        }
+    
+    def _latest_backup(self) -> Optional[Dict]:
+        """Most recent completed backup that a delta can chain to"""
+        return backups_col.find_one(
+            {"status": "completed", "high_water_mark": {"$exists": True}},
+            {"_id": 0, "backup_id": 1, "base_backup_id": 1, "high_water_mark": 1},
+            sort=[("created_at", -1)]
+        )
+    
+    def _backup_chain(self, manifest: Dict) -> List[Dict]:
+        """The full backup a manifest builds on, followed by each delta up to the manifest itself"""
+        chain = [manifest]
+        while chain[0].get("kind") == "incremental":
+            parent = backups_col.find_one({"backup_id": chain[0]["parent_backup_id"]}, {"_id": 0})
+            if not parent or parent.get("status") != "completed":
+                raise Exception(f"Backup chain is broken at {chain[0]['parent_backup_id']}")
+            chain.insert(0, parent)
+        return chain
+    
+    def _backup_collection(self, backup_id: str, name: str, projection: Dict,
+                           query: Optional[Dict] = None) -> Dict:
+        """
+        Stream one collection into content-addressed chunks, storing only
+        chunks that are not already on the target. Documents are read in _id
+        order so unchanged stretches of a collection produce the same chunks.
+        
+        A reused chunk's used_at is bumped, which keeps collect_garbage off
+        it until this backup's manifest references it.
+        """
+        cursor = (source_db[name].find(query or {}, {"_id": 0, **projection}, batch_size=BACKUP_BATCH_SIZE)
+                  .sort("_id", ASCENDING))
+        segments = []
+        uploaded = 0
+        uploaded_bytes = 0
+        for lines in iter_chunks(cursor, BACKUP_CHUNK_DOCS):
+            digest, data = encode_chunk(lines)
+            now = datetime.now(timezone.utc)
+            chunk = backup_chunks_col.find_one_and_update({"_id": digest}, {"$set": {"used_at": now}})
+            if not chunk or not self.target.exists(chunk["path"]):
+                # New, or registered but missing from the target (deleted or lost): store it
+                path = chunk_path(digest)
+                chunk = {
+                    "path": path,
+                    "bytes": len(data),
+                    "sha256": write_chunk(self.target, path, data),
+                    "created_at": now,
+                    "used_at": now
+                }
+                backup_chunks_col.update_one({"_id": digest}, {"$set": chunk}, upsert=True)
+                uploaded += 1
+                uploaded_bytes += len(data)
+            segments.append({
+                "path": chunk["path"],
+                "count": len(lines),
+                "bytes": chunk["bytes"],
+                "sha256": chunk["sha256"]
+            })
+        return {
+            "mode": "delta" if query else "full",
+            "count": sum(segment["count"] for segment in segments),
+            "bytes": sum(segment["bytes"] for segment in segments),
+            "chunks": len(segments),
+            "chunks_uploaded": uploaded,
+            "uploaded_bytes": uploaded_bytes,
+            "segments": segments
         }
     
     def list_backups(self, include_cloud: bool = True) -> list:
         """List all available backups"""
         backups = []
         
-        # Local backups from MongoDB
-        local_backups = list(backups_col.find({}, {"_id": 0, "data": 0}).sort("created_at", -1))
+        # Backup manifests (and legacy inline backups) from MongoDB
+        local_backups = list(backups_col.find({}, {"_id": 0, "data": 0, "collections": 0}).sort("created_at", -1))
         backups.extend(local_backups)
         
-        # Cloud backups from GCS
+        # Legacy single-file JSON backups in GCS
         if include_cloud and self.gcs_bucket:
             try:
                 blobs = self.gcs_bucket.list_blobs(prefix="backups/")
@@ -118,10 +309,9 @@ class BackupService:
         
         return backups
     
-    def restore_backup(self, backup_id: str) -> Dict:
-        """Restore from a backup"""
-        # Try to find backup in MongoDB first
-        backup = backups_col.find_one({"backup_id": backup_id}, {"_id": 0})
+    def _load_legacy_backup(self, backup_id: str) -> Optional[Dict]:
+        """Backups made before segments: the whole dataset inline in MongoDB or one GCS JSON file"""
+        backup = backups_col.find_one({"backup_id": backup_id, "data": {"$exists": True}}, {"_id": 0})
         
         # If not found locally, try to download from GCS
         if not backup and self.gcs_bucket:
@@ -134,41 +324,261 @@ class BackupService:
         
         if not backup or 'data' not in backup:
             raise Exception("Invalid backup data")
+        return backup['data']
+    
+    def _load_staging(self, name: str, staging: str, documents: Iterable[Dict],
+                      replay: Optional[Iterable[Dict]] = None) -> int:
+        """
+        Load documents into a fresh staging collection, upsert any replayed
+        delta documents over them by key, then build the live collection's
+        indexes on it.
+        """
+        col = restore_db[staging]
+        col.drop()
+        for batch in _batches(documents, BACKUP_BATCH_SIZE):
+            col.insert_many(batch, ordered=False)
+        
+        if replay is not None:
+            key = INCREMENTAL_COLLECTIONS[name][0]
+            col.create_index([(key, ASCENDING)])
+            for batch in _batches(replay, BACKUP_BATCH_SIZE):
+                # Ordered, so a document changed twice in one delta keeps its latest version
+                col.bulk_write([ReplaceOne({key: doc[key]}, doc, upsert=True) for doc in batch], ordered=True)
         
-        data = backup['data']
-        restored_counts = {}
+        # Indexes are built once over the loaded data rather than maintained per insert
+        indexes = [
+            IndexModel(spec["key"], name=index_name,
+                       **{k: v for k, v in spec.items() if k not in ("key", "v", "ns")})
+            for index_name, spec in restore_db[name].index_information().items()
+            if index_name != "_id_"
+        ]
+        if indexes:
+            col.create_indexes(indexes)
+        return col.count_documents({})
+    
+    def restore_collections(self, sources: Dict[str, Callable[[], Iterable[Dict]]], tag: str = "",
+                            replays: Optional[Dict[str, Callable[[], Iterable[Dict]]]] = None) -> Dict:
+        """
+        Restore collections from document sources without a partial-state window.
         
-        # Restore data (preserving existing structure)
-        if "products" in data and data["products"]:
-            products_col.delete_many({})
-            products_col.insert_many(data["products"])
-            restored_counts["products"] = len(data["products"])
+        Every collection is loaded concurrently into its own staging collection.
+        Only when all of them have loaded and indexed is each one swapped in
+        with renameCollection(dropTarget=True), which replaces the live
+        collection atomically. On any failure the staging collections are
+        dropped and live data is untouched.
+        """
+        tag = tag or uuid.uuid4().hex[:8]
+        replays = replays or {}
+        staging = {name: f"{name}__restore_{tag}" for name in sources}
         
-        if "customers" in data and data["customers"]:
-            customers_col.delete_many({})
-            customers_col.insert_many(data["customers"])
-            restored_counts["customers"] = len(data["customers"])
+        try:
+            with ThreadPoolExecutor(max_workers=BACKUP_RESTORE_WORKERS) as executor:
+                futures = {
+                    name: executor.submit(self._load_staging, name, staging[name], source(),
+                                          replays[name]() if name in replays else None)
+                    for name, source in sources.items()
+                }
+                restored_counts = {name: future.result() for name, future in futures.items()}
+        except Exception:
+            for staging_name in staging.values():
+                restore_db[staging_name].drop()
+            raise
         
-        if "suppliers" in data and data["suppliers"]:
-            suppliers_col.delete_many({})
-            suppliers_col.insert_many(data["suppliers"])
-            restored_counts["suppliers"] = len(data["suppliers"])
+        pending = dict(staging)
+        try:
+            for name, staging_name in staging.items():
+                restore_db.client.admin.command(
+                    "renameCollection", f"{restore_db.name}.{staging_name}",
+                    to=f"{restore_db.name}.{name}", dropTarget=True
+                )
+                del pending[name]
+        finally:
+            for staging_name in pending.values():
+                restore_db[staging_name].drop()
         
-        if "discount_rules" in data and data["discount_rules"]:
-            discount_rules_col.delete_many({})
-            discount_rules_col.insert_many(data["discount_rules"])
-            restored_counts["discount_rules"] = len(data["discount_rules"])
+        if "discount_rules" in restored_counts:
+            discount_engine.invalidate()
+        if "products" in restored_counts:
+            product_cache.reload()
+        if RESTORED_CATALOG & restored_counts.keys():
+            change_log.reset("backup restore")
+        for collection in set(CONFIG_COLLECTIONS) & restored_counts.keys():
+            config.changed(collection)
+        if "sales" in restored_counts:
+            # The rollups still hold the totals of the sales that were replaced
+            rebuilt = sales_rollups.backfill(include_open=True)
+            print(f"✅ Sales rollups rebuilt after restore: {rebuilt}")
+        return restored_counts
+    
+    def _read_chunk(self, segment: Dict) -> List[Dict]:
+        return list(read_segment(self.target, segment["path"], segment["sha256"]))
+    
+    def _segment_documents(self, segments: List[Dict]) -> Iterator[Dict]:
+        """Documents of each segment in order, with the next few chunks downloading in parallel"""
+        remaining = iter(segments)
+        with ThreadPoolExecutor(max_workers=BACKUP_CHUNK_FETCH_WORKERS) as pool:
+            pending = deque(pool.submit(self._read_chunk, segment)
+                            for segment in itertools.islice(remaining, BACKUP_CHUNK_FETCH_WORKERS))
+            while pending:
+                documents = pending.popleft().result()
+                segment = next(remaining, None)
+                if segment is not None:
+                    pending.append(pool.submit(self._read_chunk, segment))
+                yield from documents
+    
+    def restore_backup(self, backup_id: str) -> Dict:
+        """Restore from a backup (for an incremental backup, its full backup plus the delta chain)"""
+        started = time.monotonic()
+        manifest = backups_col.find_one(
+            {"backup_id": backup_id, "data": {"$exists": False}, "collections": {"$exists": True}},
+            {"_id": 0}
+        )
+        
+        if manifest:
+            if manifest.get("status") != "completed":
+                raise Exception(f"Backup is {manifest.get('status')}, not restorable")
+            chain = self._backup_chain(manifest)
+            base, deltas = chain[0], chain[1:]
+            
+            # Segment checksums are verified as they are read; a mismatch aborts before the swap
+            sources = {}
+            replays = {}
+            for name in RESTORE_COLLECTIONS:
+                base_copy = base["collections"].get(name)
+                if name in INCREMENTAL_COLLECTIONS and (base_copy is None or base_copy.get("mode", "full") != "full"):
+                    # The restore replaces the whole live collection, so history
+                    # needs a full copy underneath; without one it is left alone
+                    continue
+                if name in INCREMENTAL_COLLECTIONS and deltas:
+                    # The full backup's copy, then every delta in order on top of it
+                    base_segments = base_copy["segments"]
+                    delta_segments = [
+                        segment
+                        for delta in deltas
+                        for segment in delta["collections"].get(name, {}).get("segments", [])
+                    ]
+                    if base_segments or delta_segments:
+                        sources[name] = functools.partial(self._segment_documents, base_segments)
+                        replays[name] = functools.partial(self._segment_documents, delta_segments)
+                else:
+                    # Copied in full by every backup, so the requested one has the right version
+                    collection = manifest["collections"].get(name)
+                    if collection and collection["count"]:
+                        sources[name] = functools.partial(self._segment_documents, collection["segments"])
+            restored_counts = self.restore_collections(sources, tag=backup_id[:8], replays=replays)
+        else:
+            restored_counts = self.restore_data(self._load_legacy_backup(backup_id))
+        print(f"✅ Restored backup {backup_id} in {time.monotonic() - started:.1f}s: {restored_counts}")
         
         return restored_counts
     
-    def schedule_automatic_backup(self, frequency: str = "daily"):
+    def restore_data(self, data: Dict) -> Dict:
         """
-        Schedule automatic backups
-        Note: This would typically use a task scheduler like Celery or cron
-        For now, this is a placeholder for the scheduling logic
+        Restore from an inline backup: {"products": [...], ..., "settings": {...}}.
+        Sales, stock movements and inventory logs in it are ignored.
         """
-        # TODO: Implement with APScheduler or similar
-        pass
+        sources = {}
+        for name in INLINE_COLLECTIONS:
+            documents = data.get(name)
+            if documents:
+                # Settings are a single document in inline backups
+                documents = [documents] if isinstance(documents, dict) else documents
+                sources[name] = functools.partial(iter, documents)
+        return self.restore_collections(sources)
+    
+    def export_json(self, backup_id: str) -> Iterator[bytes]:
+        """
+        A stored backup as the inline JSON that /api/backups/restore accepts,
+        streamed collection by collection. Raises before streaming if the
+        backup cannot be read.
+        """
+        manifest = backups_col.find_one(
+            {"backup_id": backup_id, "data": {"$exists": False}, "collections": {"$exists": True}},
+            {"_id": 0}
+        )
+        if manifest:
+            if manifest.get("status") != "completed":
+                raise Exception(f"Backup is {manifest.get('status')}, not downloadable")
+            # Every backup holds a full copy of these, incremental ones included
+            sources = {
+                name: functools.partial(self._segment_documents, manifest["collections"][name]["segments"])
+                for name in INLINE_COLLECTIONS if name in manifest["collections"]
+            }
+            created_at = manifest["created_at"]
+        else:
+            data = self._load_legacy_backup(backup_id)
+            sources = {}
+            for name in INLINE_COLLECTIONS:
+                documents = data.get(name) or []
+                documents = [documents] if isinstance(documents, dict) else documents
+                sources[name] = functools.partial(iter, documents)
+            created_at = ""
+
+        def chunks() -> Iterator[bytes]:
+            header = {"backup_id": backup_id, "created_at": created_at, "type": "download"}
+            yield json.dumps(header)[:-1].encode() + b', "data": {'
+            for position, (name, source) in enumerate(sources.items()):
+                yield (", " if position else "").encode() + json.dumps(name).encode() + b": ["
+                for index, batch in enumerate(_batches(source(), BACKUP_BATCH_SIZE)):
+                    body = ", ".join(json.dumps(document, default=str) for document in batch)
+                    yield (", " if index else "").encode() + body.encode()
+                yield b"]"
+            yield b"}}"
+
+        return chunks()
+
+    def delete_backups(self, backup_ids: List[str]) -> int:
+        """Delete backup manifests, then any stored segments no remaining backup uses"""
+        manifests = list(backups_col.find({"backup_id": {"$in": backup_ids}}, {"_id": 0, "collections": 1}))
+        backups_col.delete_many({"backup_id": {"$in": backup_ids}})
+        
+        # Per-backup segments from before chunking are never shared
+        self.target.delete(
+            segment["path"]
+            for manifest in manifests
+            for collection in (manifest.get("collections") or {}).values()
+            for segment in collection["segments"]
+            if not segment["path"].startswith(f"{CHUNK_PREFIX}/")
+        )
+        self.collect_garbage()
+        return len(manifests)
+    
+    def collect_garbage(self) -> int:
+        """Delete stored chunks that no backup manifest references any more"""
+        referenced = set()
+        # A failed backup's manifest lists what it got through, but it is never restored
+        for manifest in backups_col.find({"collections": {"$exists": True}, "status": {"$ne": "failed"}},
+                                         {"_id": 0, "collections": 1}):
+            for collection in manifest["collections"].values():
+                referenced.update(segment["path"] for segment in collection["segments"])
+        
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=BACKUP_CHUNK_GC_GRACE_HOURS)
+        # Chunks registered before used_at existed fall back to created_at
+        idle = {"$or": [{"used_at": {"$lt": cutoff}},
+                        {"used_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]}
+        orphans = []
+        for chunk in backup_chunks_col.find(idle, {"path": 1}):
+            if chunk["path"] in referenced:
+                continue
+            # Unregister first, and only if no backup has picked the chunk up since the scan
+            if backup_chunks_col.delete_one({"_id": chunk["_id"], **idle}).deleted_count:
+                orphans.append(chunk["path"])
+        self.target.delete(orphans)
+        return len(orphans)
+    
+    def schedule_automatic_backup(self, frequency_hours: int, enabled: bool = True) -> Dict:
+        """
+        Turn automatic backups on or off. The settings live with the other
+        system settings; services.backup_scheduler picks them up on its next poll.
+        """
+        update = {
+            "auto_backup_enabled": enabled,
+            "backup_frequency_hours": frequency_hours,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        system_settings_col.update_one({}, {"$set": update}, upsert=True)
+        config.changed("system_settings")
+        return update
 
 
 # Singleton instance
@@ -0,0 +1,196 @@
+"""
+Backup storage targets
+
+Backups are written as gzip-compressed NDJSON segments to a target: a local
+directory, or a Google Cloud Storage bucket. Segment paths are relative, so
+the same manifest layout works on either target and a local directory can
+stand in for the bucket.
+
+Segments are content-addressed chunks ("chunks/ab/<sha256>.ndjson.gz"): the
+name is the hash of the chunk's canonical NDJSON, so a chunk that is already
+stored is never written again. Older backups used per-backup segment paths
+("<backup_id>/<collection>-0000.ndjson.gz"), which remain readable.
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import gzip
+import hashlib
+import os
+
+from bson import json_util
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', str(Path(__file__).resolve().parent.parent / 'backups'))
+
+
+class HashingReader:
+    """Pass-through reader that checksums the bytes it returns"""
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class BackupTarget:
+    """Where backup segments are stored"""
+    name = "base"
+
+    @contextmanager
+    def open_write(self, path: str) -> Iterator[BinaryIO]:
+        raise NotImplementedError
+
+    @contextmanager
+    def open_read(self, path: str) -> Iterator[BinaryIO]:
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+    def delete(self, paths: Iterable[str]):
+        raise NotImplementedError
+
+    def location(self, path: str) -> str:
+        raise NotImplementedError
+
+
+class LocalBackupTarget(BackupTarget):
+    """Segments stored under a local directory (also the stand-in for GCS)"""
+    name = "local"
+
+    def __init__(self, root: str = BACKUP_DIR):
+        self.root = Path(root)
+
+    def _path(self, path: str) -> Path:
+        return self.root / path
+
+    @contextmanager
+    def open_write(self, path: str) -> Iterator[BinaryIO]:
+        final = self._path(path)
+        final.parent.mkdir(parents=True, exist_ok=True)
+        partial = final.with_name(final.name + '.part')
+        try:
+            with open(partial, 'wb') as f:
+                yield f
+            # A segment only appears under its real name once fully written
+            os.replace(partial, final)
+        finally:
+            if partial.exists():
+                partial.unlink()
+
+    @contextmanager
+    def open_read(self, path: str) -> Iterator[BinaryIO]:
+        with open(self._path(path), 'rb') as f:
+            yield f
+
+    def exists(self, path: str) -> bool:
+        return self._path(path).exists()
+
+    def delete(self, paths: Iterable[str]):
+        for path in paths:
+            full_path = self._path(path)
+            if full_path.exists():
+                full_path.unlink()
+            # Drop the backup's directory once it is empty
+            try:
+                full_path.parent.rmdir()
+            except OSError:
+                pass
+
+    def location(self, path: str) -> str:
+        return str(self._path(path))
+
+
+class GCSBackupTarget(BackupTarget):
+    """Segments stored as objects in a Google Cloud Storage bucket"""
+    name = "gcs"
+
+    def __init__(self, bucket, prefix: str = "backups"):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _blob(self, path: str):
+        return self.bucket.blob(f"{self.prefix}/{path}")
+
+    @contextmanager
+    def open_write(self, path: str) -> Iterator[BinaryIO]:
+        # Resumable upload in chunks; the object is only created when closed
+        with self._blob(path).open('wb', content_type='application/gzip') as f:
+            yield f
+
+    @contextmanager
+    def open_read(self, path: str) -> Iterator[BinaryIO]:
+        with self._blob(path).open('rb') as f:
+            yield f
+
+    def exists(self, path: str) -> bool:
+        return self._blob(path).exists()
+
+    def delete(self, paths: Iterable[str]):
+        for path in paths:
+            blob = self._blob(path)
+            if blob.exists():
+                blob.delete()
+
+    def location(self, path: str) -> str:
+        return f"gs://{self.bucket.name}/{self.prefix}/{path}"
+
+
+CHUNK_PREFIX = "chunks"
+
+
+def chunk_path(digest: str) -> str:
+    return f"{CHUNK_PREFIX}/{digest[:2]}/{digest}.ndjson.gz"
+
+
+def iter_chunks(documents: Iterable[Dict], target_docs: int) -> Iterator[List[bytes]]:
+    """
+    Group documents into chunks of canonical NDJSON lines. Boundaries are
+    content-defined (a line whose hash is 0 mod target_docs ends a chunk), so
+    inserting or changing one document only changes the chunk it lands in
+    and its neighbours keep their hashes. Chunks are capped at 4x the target.
+    """
+    max_docs = target_docs * 4
+    chunk = []
+    for doc in documents:
+        line = json_util.dumps(doc, sort_keys=True).encode('utf-8') + b'\n'
+        chunk.append(line)
+        boundary = int.from_bytes(hashlib.blake2b(line, digest_size=4).digest(), 'big') % target_docs == 0
+        if boundary or len(chunk) >= max_docs:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode_chunk(lines: List[bytes]) -> Tuple[str, bytes]:
+    """Content hash and deterministic gzip bytes (mtime=0) for a chunk"""
+    content = b''.join(lines)
+    return hashlib.sha256(content).hexdigest(), gzip.compress(content, mtime=0)
+
+
+def write_chunk(target: BackupTarget, path: str, data: bytes) -> str:
+    """Store an encoded chunk; returns the sha256 of the stored bytes"""
+    with target.open_write(path) as raw:
+        raw.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_segment(target: BackupTarget, path: str, sha256: Optional[str] = None) -> Iterator[Dict]:
+    """Stream the documents of one segment, raising at the end if sha256 does not match"""
+    with target.open_read(path) as raw:
+        hashing = HashingReader(raw)
+        with gzip.GzipFile(fileobj=hashing, mode='rb') as lines:
+            for line in lines:
+                if line.strip():
+                    yield json_util.loads(line)
+        # Drain anything after the gzip stream so the whole object is hashed
+        while hashing.read(1024 * 1024):
+            pass
+    if sha256 and hashing.sha256.hexdigest() != sha256:
+        raise ValueError(f"Checksum mismatch for backup segment {path}")
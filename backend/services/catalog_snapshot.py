@@ -0,0 +1,184 @@
+"""
+Catalog snapshot
+
+The whole active catalog (products and discount rules) pre-built as one
+gzip-compressed, columnar JSON document, so a new or reset terminal
+bootstraps with a single download instead of paging through
+/api/products. Columnar means each table is a list of column names plus
+rows of values, which avoids repeating every key for every product.
+
+The snapshot is stamped with the change log sequence it was read at. A
+terminal loads it, then follows /api/sync/changes from that sequence; any
+change made while the snapshot was being read is simply applied again.
+
+A background thread rebuilds the snapshot, at most every
+SNAPSHOT_MIN_INTERVAL_SECONDS, when a product or discount rule has
+changed. Stock-only changes (every sale) do not count: terminals replay
+them from the change log. After SNAPSHOT_MAX_AGE_SECONDS any change
+triggers a rebuild, which keeps that replay short and the snapshot's
+sequence within the log's retention.
+
+Each worker builds its own snapshot at whatever sequence it happens to read,
+so the ETag leaves that out: it is the sequence of the last catalog change
+(stock-only entries skipped) plus a hash of the catalog without its stock
+fields. Workers holding the same catalog hand out the same ETag, and a
+terminal answered 304 keeps following the change log from its own sequence.
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from services.change_log import change_log
+from utils.database import products_col, discount_rules_col
+
+POLL_SECONDS = float(os.environ.get('SNAPSHOT_POLL_SECONDS', '15'))
+MIN_INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_MIN_INTERVAL_SECONDS', '60'))
+MAX_AGE_SECONDS = float(os.environ.get('SNAPSHOT_MAX_AGE_SECONDS', '3600'))
+# Change log entities the snapshot carries ("*" is a reset)
+SNAPSHOT_ENTITIES = ("product", "discount_rule", "*")
+# Purchase batches are back-office data terminals do not need; pending_sales
+# only marks a sale's stock update while it is being applied
+PRODUCT_EXCLUDED_FIELDS = {"_id": 0, "batches": 0, "pending_sales": 0}
+# Fields stock-only writes touch, left out of the ETag hash
+STOCK_FIELDS = ("stock", "updated_at")
+
+
+def columnar(documents: Iterable[Dict]) -> Dict:
+    """{"columns": [...], "rows": [[...], ...]} with the union of all keys as columns"""
+    documents = list(documents)
+    columns = sorted({key for document in documents for key in document})
+    return {
+        "columns": columns,
+        "rows": [[document.get(column) for column in columns] for document in documents]
+    }
+
+
+class Snapshot:
+    __slots__ = ('seq', 'body', 'etag', 'generated_at', 'counts')
+
+    def __init__(self, seq: int, body: bytes, etag: str, counts: Dict[str, int]):
+        self.seq = seq
+        self.body = body
+        self.etag = etag
+        self.generated_at = datetime.utcnow().isoformat()
+        self.counts = counts
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """If-None-Match check: "*" or any tag in the list, compared weakly (a W/ prefix is ignored)"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return any(tag.strip().removeprefix("W/") == self.etag for tag in if_none_match.split(","))
+
+
+class CatalogSnapshotService:
+    def __init__(self):
+        self.enabled = os.environ.get('SNAPSHOT_ENABLED', 'true').lower() != 'false'
+        self._snapshot: Optional[Snapshot] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def build(self) -> Snapshot:
+        started = time.monotonic()
+        # Read the sequence first so the snapshot holds at least everything up to it
+        seq = change_log.latest_seq()
+        products = list(products_col.find({"active": True}, PRODUCT_EXCLUDED_FIELDS).sort("sku", 1))
+        rules = list(discount_rules_col.find({"active": True}, {"_id": 0}).sort("id", 1))
+        payload = {
+            "format": "columnar-json/1",
+            "seq": seq,
+            "products": columnar(products),
+            "discount_rules": columnar(rules),
+        }
+        body = gzip.compress(
+            json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+            .encode('utf-8'),
+            # Level 6 is within a few percent of 9 on JSON at a fraction of the CPU
+            compresslevel=6, mtime=0
+        )
+        snapshot = Snapshot(seq, body, self._etag(seq, products, rules),
+                            {"products": len(products), "discount_rules": len(rules)})
+        self._snapshot = snapshot
+        self._built_at = time.monotonic()
+        print(f"📦 Catalog snapshot at seq {seq}: {len(products)} products, "
+              f"{len(body) / 1024:.0f} KB in {time.monotonic() - started:.2f}s")
+        return snapshot
+
+    @staticmethod
+    def _etag(seq: int, products: List[Dict], rules: List[Dict]) -> str:
+        """Same on every worker holding the same catalog, whatever sequence each read"""
+        catalog_seq = change_log.last_seq(SNAPSHOT_ENTITIES, seq, include_stock=False)
+        content = {
+            "products": [{key: value for key, value in product.items() if key not in STOCK_FIELDS}
+                         for product in products],
+            "discount_rules": rules,
+        }
+        digest = hashlib.sha256(
+            json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+            .encode('utf-8')
+        ).hexdigest()
+        return f'"{catalog_seq}-{digest[:16]}"'
+
+    def current(self) -> Snapshot:
+        """The latest snapshot, building the first one on demand"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot or self.build()
+        return snapshot
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="catalog-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(POLL_SECONDS):
+            try:
+                snapshot = self._snapshot
+                if snapshot is not None and not self._stale(snapshot):
+                    continue
+                if time.monotonic() - self._built_at < MIN_INTERVAL_SECONDS:
+                    continue
+                with self._lock:
+                    self.build()
+            except Exception as e:
+                print(f"❌ Catalog snapshot error: {str(e)}")
+
+    def _stale(self, snapshot: Snapshot) -> bool:
+        if snapshot.seq == change_log.latest_seq():
+            return False
+        if time.monotonic() - self._built_at >= MAX_AGE_SECONDS:
+            return True
+        return change_log.changed_since(snapshot.seq, SNAPSHOT_ENTITIES, include_stock=False)
+
+    def status(self) -> Dict:
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"built": False}
+        return {
+            "built": True,
+            "seq": snapshot.seq,
+            "etag": snapshot.etag,
+            "size_bytes": len(snapshot.body),
+            "generated_at": snapshot.generated_at,
+            "counts": snapshot.counts
+        }
+
+
+# Singleton instance
+catalog_snapshot = CatalogSnapshotService()
@@ -0,0 +1,186 @@
+"""
+Catalog change log
+
+Every write to products, customers and discount rules appends an entry
+with a global, monotonically increasing sequence number. Terminals sync by
+asking for everything after the last sequence they applied and get back
+the current version of each changed document, or a tombstone if it was
+deleted or deactivated. Settings writes are logged too, under the
+"settings" entity with the collection name as id; those come back as an
+"invalidate" op telling the terminal to fetch that settings document again.
+
+Sequence numbers are allocated from a counter before the entry is
+inserted, so a reader can briefly see seq N+1 before seq N lands. A page
+therefore stops at the first missing number and the terminal picks it up
+on its next pull. A number whose writer died before inserting is skipped
+once a later entry is older than CHANGE_LOG_GAP_GRACE_SECONDS.
+
+Writes that only move stock (sales, adjustments) are flagged stock_only,
+so consumers that do not carry stock, such as the catalog snapshot, can
+ignore them.
+
+Entries expire after CHANGE_LOG_RETENTION_DAYS. A terminal that is further
+behind than that, or whose range contains a reset (seed data, restore),
+is told to reload the full catalog.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List
+import os
+
+from pymongo import ASCENDING, ReturnDocument
+
+from utils.database import db, products_col, customers_col, discount_rules_col
+
+change_log_col = db['change_log']
+change_counters_col = db['change_counters']
+
+RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', '30'))
+GAP_GRACE_SECONDS = int(os.environ.get('CHANGE_LOG_GAP_GRACE_SECONDS', '30'))
+
+change_log_col.create_index([('seq', ASCENDING)], unique=True)
+change_log_col.create_index([('at', ASCENDING)], expireAfterSeconds=RETENTION_DAYS * 86400)
+
+ENTITIES = {
+    "product": products_col,
+    "customer": customers_col,
+    "discount_rule": discount_rules_col,
+}
+
+
+class ChangeLog:
+    counter_id = "catalog"
+
+    def __init__(self):
+        self._listeners: List[Callable[[], None]] = []
+
+    def on_record(self, listener: Callable[[], None]):
+        """Call listener after every entry this process writes"""
+        self._listeners.append(listener)
+
+    def _notify(self):
+        for listener in self._listeners:
+            listener()
+
+    def _allocate(self, count: int) -> int:
+        """Reserve count consecutive sequence numbers; returns the first"""
+        counter = change_counters_col.find_one_and_update(
+            {"_id": self.counter_id},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    def record(self, entity: str, entity_ids: Iterable[str], op: str = "upsert", stock_only: bool = False):
+        """Log a write to one or more documents of an entity (op: upsert or delete, ignored for settings)"""
+        entity_ids = list(dict.fromkeys(entity_id for entity_id in entity_ids if entity_id))
+        if not entity_ids:
+            return
+        first = self._allocate(len(entity_ids))
+        now = datetime.now(timezone.utc)
+        entries = [
+            {"seq": first + offset, "entity": entity, "entity_id": entity_id, "op": op, "at": now}
+            for offset, entity_id in enumerate(entity_ids)
+        ]
+        if stock_only:
+            for entry in entries:
+                entry["stock_only"] = True
+        change_log_col.insert_many(entries)
+        self._notify()
+
+    def reset(self, reason: str):
+        """Log a bulk replacement that terminals can only follow with a full reload"""
+        seq = self._allocate(1)
+        change_log_col.insert_one({"seq": seq, "entity": "*", "op": "reset", "reason": reason,
+                                   "at": datetime.now(timezone.utc)})
+        self._notify()
+
+    def changed_since(self, seq: int, entities: Iterable[str], include_stock: bool = True) -> bool:
+        """Whether any entry after seq concerns one of entities ("*" for resets)"""
+        query = {"seq": {"$gt": seq}, "entity": {"$in": list(entities)}}
+        if not include_stock:
+            query["stock_only"] = {"$ne": True}
+        return change_log_col.find_one(query, {"_id": 1}) is not None
+
+    def last_seq(self, entities: Iterable[str], up_to: int, include_stock: bool = True) -> int:
+        """Sequence of the latest entry up to and including up_to that concerns one of entities, 0 if none"""
+        query = {"seq": {"$lte": up_to}, "entity": {"$in": list(entities)}}
+        if not include_stock:
+            query["stock_only"] = {"$ne": True}
+        entry = change_log_col.find_one(query, {"_id": 0, "seq": 1}, sort=[("seq", -1)])
+        return entry["seq"] if entry else 0
+
+    def latest_seq(self) -> int:
+        counter = change_counters_col.find_one({"_id": self.counter_id})
+        return counter["seq"] if counter else 0
+
+    def _contiguous(self, since_seq: int, entries: List[Dict]) -> List[Dict]:
+        """Entries up to the first gap that a writer may still be filling"""
+        grace = datetime.now(timezone.utc) - timedelta(seconds=GAP_GRACE_SECONDS)
+        expected = since_seq + 1
+        for index, entry in enumerate(entries):
+            at = entry["at"] if entry["at"].tzinfo else entry["at"].replace(tzinfo=timezone.utc)
+            if entry["seq"] != expected and at > grace:
+                return entries[:index]
+            expected = entry["seq"] + 1
+        return entries
+
+    def changes(self, since_seq: int, limit: int = 500) -> Dict:
+        latest = self.latest_seq()
+        oldest = change_log_col.find_one({}, {"seq": 1}, sort=[("seq", ASCENDING)])
+        if since_seq <= 0 or (since_seq < latest and (not oldest or oldest["seq"] > since_seq + 1)):
+            # A new terminal, or one whose entries have expired: load everything,
+            # then follow the log from the current sequence
+            return {"changes": [], "next_seq": latest, "latest_seq": latest,
+                    "has_more": False, "reset_required": True}
+
+        page = list(
+            change_log_col.find({"seq": {"$gt": since_seq}}, {"_id": 0}).sort("seq", ASCENDING).limit(limit)
+        )
+        entries = self._contiguous(since_seq, page)
+        for entry in entries:
+            if entry["op"] == "reset":
+                # Everything before the reset is moot; resume right after it
+                return {"changes": [], "next_seq": entry["seq"], "latest_seq": latest,
+                        "has_more": entry["seq"] < latest, "reset_required": True}
+
+        # Latest entry per document; its current state is what the terminal needs
+        latest_entry: Dict[tuple, Dict] = {}
+        for entry in entries:
+            latest_entry.pop((entry["entity"], entry["entity_id"]), None)
+            latest_entry[(entry["entity"], entry["entity_id"])] = entry
+
+        documents: Dict[tuple, Dict] = {}
+        for entity, collection in ENTITIES.items():
+            ids = [entity_id for (name, entity_id) in latest_entry if name == entity]
+            if ids:
+                for document in collection.find({"id": {"$in": ids}}, {"_id": 0}):
+                    documents[(entity, document["id"])] = document
+
+        changes = []
+        for key, entry in latest_entry.items():
+            document = documents.get(key)
+            change = {"seq": entry["seq"], "entity": entry["entity"], "id": entry["entity_id"]}
+            if entry["entity"] not in ENTITIES:
+                change["op"] = "invalidate"
+            elif document is None or document.get("active") is False:
+                change["op"] = "delete"
+            else:
+                change["op"] = "upsert"
+                change["data"] = document
+            changes.append(change)
+
+        next_seq = entries[-1]["seq"] if entries else since_seq
+        return {
+            "changes": changes,
+            "next_seq": next_seq,
+            "latest_seq": latest,
+            # Not after stopping at a gap, so terminals wait for their next pull
+            "has_more": len(page) == limit and len(entries) == len(page),
+            "reset_required": False
+        }
+
+
+# Singleton instance
+change_log = ChangeLog()
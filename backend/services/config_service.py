@@ -0,0 +1,161 @@
+"""
+Configuration cache
+
+The general, device, system, store and loyalty settings documents are read
+once and served from memory, so checkout and other hot paths make no
+settings queries. Each document carries a version that goes up every time
+it is reloaded.
+
+Whoever writes settings calls changed(collection). That reloads the
+affected documents in this worker right away and records the write in the
+change log, which also pushes an invalidation to terminals. Other workers
+see the write through a change stream on the settings collections or,
+where change streams are unsupported, by reading settings entries from the
+change log every CONFIG_POLL_SECONDS. Everything is also reloaded every
+CONFIG_RELOAD_SECONDS as a safety net.
+"""
+
+from typing import Any, Dict, Optional, Tuple
+import copy
+import os
+import threading
+import time
+
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from services.change_log import change_log, change_log_col
+from utils.database import db
+
+POLL_SECONDS = float(os.environ.get('CONFIG_POLL_SECONDS', '2'))
+RELOAD_SECONDS = float(os.environ.get('CONFIG_RELOAD_SECONDS', '300'))
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+# name -> (collection, filter). Device settings share the general settings collection.
+SOURCES = {
+    "settings": ("settings", {"type": {"$exists": False}}),
+    "device_settings": ("settings", {"type": "devices"}),
+    "system_settings": ("system_settings", {}),
+    "store_settings": ("store_settings", {}),
+    "loyalty_settings": ("loyalty_settings", {}),
+}
+COLLECTIONS = sorted({collection for collection, _ in SOURCES.values()})
+
+
+class ConfigCache:
+    def __init__(self):
+        self._documents: Dict[str, Tuple[int, Optional[Dict]]] = {}  # name -> (version, document)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reloaded = 0.0
+        self.mode = "starting"
+        self.reloads = 0
+
+    def _load(self, name: str):
+        collection, query = SOURCES[name]
+        document = db[collection].find_one(query, {"_id": 0})
+        with self._lock:
+            version = self._documents.get(name, (0, None))[0] + 1
+            self._documents[name] = (version, document)
+            self.reloads += 1
+
+    def reload(self, collection: Optional[str] = None):
+        """Reload every document kept from collection (all of them if None)"""
+        for name, (source, _) in SOURCES.items():
+            if collection is None or source == collection:
+                self._load(name)
+        if collection is None:
+            self._reloaded = time.monotonic()
+
+    def _entry(self, name: str) -> Tuple[int, Optional[Dict]]:
+        entry = self._documents.get(name)
+        if entry is None:
+            # Before start() has warmed up, or a name not loaded yet
+            self._load(name)
+            entry = self._documents[name]
+        return entry
+
+    def get(self, name: str) -> Optional[Dict]:
+        """A copy of the settings document, or None if there is none yet"""
+        document = self._entry(name)[1]
+        return copy.deepcopy(document) if document is not None else None
+
+    def value(self, name: str, key: str, default: Any = None) -> Any:
+        """One setting, without copying the document"""
+        document = self._entry(name)[1]
+        return document.get(key, default) if document else default
+
+    def version(self, name: str) -> int:
+        return self._entry(name)[0]
+
+    def changed(self, collection: str):
+        """Call after writing a settings collection"""
+        self.reload(collection)
+        change_log.record("settings", [collection])
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.reload()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="config-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._follow()
+            except Exception as e:
+                print(f"❌ Config cache sync error: {str(e)}")
+                if not self._stop.wait(POLL_SECONDS):
+                    try:
+                        self.reload()
+                    except Exception:
+                        pass
+
+    def _follow(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": COLLECTIONS}}}]
+        try:
+            with db.watch(pipeline, max_await_time_ms=1000) as stream:
+                self.mode = "change_stream"
+                while stream.alive and not self._stop.is_set():
+                    change = stream.try_next()
+                    if change:
+                        self.reload(change["ns"]["coll"])
+                    elif time.monotonic() - self._reloaded >= RELOAD_SECONDS:
+                        self.reload()
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAM_UNSUPPORTED:
+                raise
+            self.mode = "polling"
+            self._poll()
+
+    def _poll(self):
+        seq = change_log.latest_seq()
+        while not self._stop.wait(POLL_SECONDS):
+            if time.monotonic() - self._reloaded >= RELOAD_SECONDS:
+                self.reload()
+            entries = list(change_log_col.find(
+                {"seq": {"$gt": seq}, "entity": {"$in": ["settings", "*"]}}, {"_id": 0, "seq": 1, "entity_id": 1}
+            ).sort("seq", ASCENDING))
+            for collection in {entry.get("entity_id") for entry in entries}:
+                # A reset (seed data, restore) has no entity_id and reloads everything
+                self.reload(collection)
+            if entries:
+                seq = entries[-1]["seq"]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sync_mode": self.mode,
+                "reloads": self.reloads,
+                "versions": {name: entry[0] for name, entry in self._documents.items()}
+            }
+
+
+# Singleton instance
+config = ConfigCache()
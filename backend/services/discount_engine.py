@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional
+import os
+import threading
+import time
+
+from utils.database import discount_rules_col
+
+
+class CompiledRule:
+    """A discount rule reduced to the fields evaluation needs"""
+    __slots__ = ('order', 'name', 'min_quantity', 'max_quantity', 'percent', 'value', 'max_discount')
+
+    def __init__(self, order: int, rule: Dict):
+        self.order = order  # position in the rules collection, breaks ties like the old loop
+        self.name = rule.get('name', '')
+        self.min_quantity = rule.get('min_quantity') or 0
+        self.max_quantity = rule.get('max_quantity') or 0
+        self.percent = rule.get('discount_type') == 'percent'
+        self.value = rule.get('discount_value') or 0
+        self.max_discount = rule.get('max_discount') or 0
+
+    def discount_for(self, quantity: float, subtotal: float) -> Optional[float]:
+        """Discount this rule gives a line, or None if the quantity bounds exclude it"""
+        if self.min_quantity > 0 and quantity < self.min_quantity:
+            return None
+        if self.max_quantity > 0 and quantity > self.max_quantity:
+            return None
+
+        if self.percent:
+            discount = (subtotal * self.value) / 100
+        else:  # fixed
+            discount = self.value * quantity
+
+        # Apply max discount cap
+        if self.max_discount > 0:
+            discount = min(discount, self.max_discount)
+        return discount
+
+
+class DiscountIndex:
+    """Auto-apply rules bucketed by what they target"""
+
+    def __init__(self, rules: List[Dict]):
+        self.by_product: Dict[str, List[CompiledRule]] = {}  # product_id or SKU
+        self.by_category: Dict[str, List[CompiledRule]] = {}
+        self.line_item: List[CompiledRule] = []
+
+        for order, rule in enumerate(rules):
+            compiled = CompiledRule(order, rule)
+            rule_type = rule.get('rule_type')
+            target = rule.get('target_id') or ''
+            if rule_type == 'product':
+                self.by_product.setdefault(target, []).append(compiled)
+            elif rule_type == 'category':
+                if target:
+                    self.by_category.setdefault(target, []).append(compiled)
+            elif rule_type == 'line_item':
+                self.line_item.append(compiled)
+
+        self.rule_count = len(rules)
+
+    def candidates(self, item: Dict) -> List[CompiledRule]:
+        rules = list(self.line_item)
+        product_id = item.get('product_id')
+        sku = item.get('sku')
+        if product_id in self.by_product:
+            rules.extend(self.by_product[product_id])
+        if sku and sku != product_id and sku in self.by_product:
+            rules.extend(self.by_product[sku])
+        category = item.get('category')
+        if category and category in self.by_category:
+            rules.extend(self.by_category[category])
+        return rules
+
+
+class DiscountEngine:
+    """
+    Evaluates carts against an in-memory index of active auto-apply rules.
+
+    The index is compiled once and reused until a rule endpoint calls
+    invalidate(). It is also rebuilt after max_age seconds so workers that
+    did not see the write pick the change up.
+    """
+
+    def __init__(self):
+        self.max_age = float(os.environ.get('DISCOUNT_RULES_MAX_AGE_SECONDS', '60'))
+        self._index: Optional[DiscountIndex] = None
+        self._loaded_at = 0.0
+        # Bumped by invalidate(); a rebuild that started before the bump is not kept
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._index = None
+
+    def _fresh(self) -> Optional[DiscountIndex]:
+        index = self._index
+        if index is not None and time.monotonic() - self._loaded_at < self.max_age:
+            return index
+        return None
+
+    def index(self) -> DiscountIndex:
+        index = self._fresh()
+        if index is not None:
+            return index
+        with self._build_lock:
+            with self._lock:
+                index = self._fresh()
+                generation = self._generation
+            if index is not None:
+                return index
+            rules = list(discount_rules_col.find({"active": True, "auto_apply": True}, {"_id": 0}))
+            index = DiscountIndex(rules)
+            with self._lock:
+                if self._generation == generation:
+                    self._index = index
+                    self._loaded_at = time.monotonic()
+            return index
+
+    def apply(self, cart_items: List[Dict]) -> List[Dict]:
+        """Apply the best matching rule to each cart line in place"""
+        index = self.index()
+
+        for item in cart_items:
+            # Reset discount fields for each item
+            item['discount_amount'] = 0
+            item['discount_percent'] = 0
+            item['total'] = item['subtotal']
+            if 'applied_rule' in item:
+                del item['applied_rule']
+
+            best_discount = 0
+            best_rule = None
+            for rule in index.candidates(item):
+                discount = rule.discount_for(item['quantity'], item['subtotal'])
+                if discount is None:
+                    continue
+                if discount > best_discount or (
+                    best_rule is not None and discount == best_discount and rule.order < best_rule.order
+                ):
+                    best_discount = discount
+                    best_rule = rule
+
+            if best_rule:
+                item['discount_amount'] = best_discount
+                item['discount_percent'] = (best_discount / item['subtotal'] * 100) if item['subtotal'] > 0 else 0
+                item['total'] = item['subtotal'] - best_discount
+                item['applied_rule'] = best_rule.name
+
+        return cart_items
+
+
+# Singleton instance
+discount_engine = DiscountEngine()
@@ -1,7 +1,10 @@
 from datetime import datetime, timezone
-from typing import Dict
+from typing import Dict, List
 import uuid
-from utils.database import products_col, stock_movements_col
+from pymongo import UpdateOne
+from services.change_log import change_log
+from services.product_cache import product_cache
+from utils.database import products_col, stock_movements_col, inventory_logs_col
 
 
 def calculate_weighted_avg_cost(product_id: str, new_qty: float, new_cost: float) -> float:
@@ -22,11 +25,11 @@ def calculate_weighted_avg_cost(product_id: str, new_qty: float, new_cost: float
     return round(total_value / total_qty, 2) if total_qty > 0 else new_cost
 
 
-def log_stock_movement(product_id: str, movement_type: str, quantity: float, 
-                       reason: str, cost_price: float, user_id: str, 
-                       reference_id: str = "", notes: str = "") -> Dict:
-    """Log all stock movements for audit trail"""
-    movement = {
+def build_stock_movement(product_id: str, movement_type: str, quantity: float,
+                         reason: str, cost_price: float, user_id: str,
+                         reference_id: str = "", notes: str = "") -> Dict:
+    """Build a stock movement document without writing it"""
+    return {
         "id": str(uuid.uuid4()),
         "product_id": product_id,
         "type": movement_type,  # GRN, SALE, ADJUSTMENT, OPENING
@@ -38,5 +41,142 @@ def log_stock_movement(product_id: str, movement_type: str, quantity: float,
         "notes": notes,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
+
+
+def log_stock_movement(product_id: str, movement_type: str, quantity: float,
+                       reason: str, cost_price: float, user_id: str,
+                       reference_id: str = "", notes: str = "") -> Dict:
+    """Log all stock movements for audit trail"""
+    movement = build_stock_movement(
+        product_id, movement_type, quantity, reason, cost_price, user_id, reference_id, notes
+    )
     stock_movements_col.insert_one(movement)
     return movement
+
+
+def apply_sale_stock(items: List, reference: str, user_id: str, cashier_name: str,
+                     enforce_stock: bool = True) -> List[Dict]:
+    """
+    Deduct stock for every sale line in one bulk_write, then write the stock
+    movement and inventory log entries as two batched inserts.
+
+    With enforce_stock each product update is guarded by a
+    ``stock >= quantity`` filter. If any line cannot be covered no stock is
+    changed and the shortages are returned (empty list on success).
+    """
+    # Several cart lines can refer to the same product - guard on the total
+    required: Dict[str, float] = {}
+    for item in items:
+        required[item.product_id] = required.get(item.product_id, 0) + item.quantity
+
+    if not required:
+        return []
+
+    snapshot = {
+        p["id"]: p for p in products_col.find(
+            {"id": {"$in": list(required)}},
+            {"_id": 0, "id": 1, "name_en": 1, "stock": 1, "weighted_avg_cost": 1}
+        )
+    }
+    # Lines for unknown products are skipped, as before
+    required = {pid: qty for pid, qty in required.items() if pid in snapshot}
+
+    def shortage(product_id: str, current_stock: float) -> Dict:
+        return {
+            "product_id": product_id,
+            "name": snapshot[product_id].get('name_en', ''),
+            "current_stock": current_stock,
+            "required": required[product_id],
+            "shortage": abs(current_stock - required[product_id])
+        }
+
+    if enforce_stock:
+        shortages = [
+            shortage(pid, snapshot[pid].get("stock", 0))
+            for pid, qty in required.items()
+            if snapshot[pid].get("stock", 0) < qty
+        ]
+        if shortages:
+            return shortages
+
+    # Each updated product carries this sale's marker until the write is
+    # settled, so the lines it applied can be told apart from other
+    # terminals' writes to the same products
+    marker = f"{reference}:{uuid.uuid4().hex}"
+    now = datetime.now(timezone.utc).isoformat()
+    result = products_col.bulk_write([
+        UpdateOne(
+            {"id": product_id, "stock": {"$gte": quantity}} if enforce_stock else {"id": product_id},
+            {"$inc": {"stock": -quantity}, "$set": {"updated_at": now}, "$push": {"pending_sales": marker}}
+        )
+        for product_id, quantity in required.items()
+    ], ordered=False)
+
+    # Stock as left by this sale, and which lines it applied
+    after = {
+        p["id"]: p for p in products_col.find(
+            {"id": {"$in": list(required)}},
+            {"_id": 0, "id": 1, "stock": 1, "pending_sales": {"$elemMatch": {"$eq": marker}}}
+        )
+    }
+    applied = [pid for pid in required if after.get(pid, {}).get("pending_sales")]
+
+    if enforce_stock and result.matched_count < len(required):
+        # Another terminal sold the same stock since the snapshot: undo the
+        # lines that did apply and report the ones that lost
+        if applied:
+            products_col.bulk_write([
+                UpdateOne({"id": pid, "pending_sales": marker},
+                          {"$inc": {"stock": required[pid]}, "$pull": {"pending_sales": marker}})
+                for pid in applied
+            ], ordered=False)
+        return [shortage(pid, after.get(pid, {}).get("stock", 0)) for pid in required if pid not in applied]
+
+    products_col.update_many({"id": {"$in": applied}, "pending_sales": marker},
+                             {"$pull": {"pending_sales": marker}})
+
+    product_cache.apply_stock({pid: -qty for pid, qty in required.items()}, now)
+    change_log.record("product", list(required), stock_only=True)
+
+    # Ledger entries - one batched insert per collection
+    movements = []
+    inventory_logs = []
+    # Walk each product's lines back up from the stock this sale left
+    running_stock = {pid: after.get(pid, {}).get("stock", 0) + qty for pid, qty in required.items()}
+    for item in items:
+        if item.product_id not in required:
+            continue
+        previous_stock = running_stock[item.product_id]
+        new_stock = previous_stock - item.quantity
+        running_stock[item.product_id] = new_stock
+
+        movements.append(build_stock_movement(
+            product_id=item.product_id,
+            movement_type="SALE",
+            quantity=-item.quantity,
+            reason=f"Sale {reference}",
+            cost_price=snapshot[item.product_id].get('weighted_avg_cost', 0),
+            user_id=user_id,
+            reference_id=reference,
+            notes=f"Sold by {cashier_name}"
+        ))
+
+        # Also log in old system for backward compatibility
+        inventory_logs.append({
+            "id": str(uuid.uuid4()),
+            "product_id": item.product_id,
+            "log_type": "sale",
+            "quantity": -item.quantity,
+            "previous_stock": previous_stock,
+            "new_stock": new_stock,
+            "reference": reference,
+            "notes": f"Sale {reference}",
+            "created_at": datetime.utcnow().isoformat(),
+            "created_by": cashier_name
+        })
+
+    if movements:
+        stock_movements_col.insert_many(movements, ordered=False)
+        inventory_logs_col.insert_many(inventory_logs, ordered=False)
+
+    return []
@@ -0,0 +1,116 @@
+from datetime import datetime
+from typing import Dict, Optional
+import os
+import threading
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from utils.database import db, sales_col, terminals_col
+
+invoice_counters_col = db['invoice_counters']
+
+
+class InvoiceSequenceService:
+    """
+    Allocates INV-YYYYMMDD-NNNN invoice numbers from an atomic per-day counter.
+
+    Numbers are handed out in blocks: each terminal holds a lease on a range
+    of the day's sequence and numbers its sales from it without touching the
+    database until the block runs out. Unused numbers in a lease are simply
+    skipped, so the sequence is unique and increasing but may contain gaps.
+    """
+
+    def __init__(self):
+        self.block_size = int(os.environ.get('INVOICE_BLOCK_SIZE', '50'))
+        self._leases: Dict[str, Dict] = {}
+        self._seeded_days = set()
+        self._lock = threading.Lock()
+        self._refill_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def format_invoice_number(day: str, number: int) -> str:
+        return f"INV-{day}-{number:04d}"
+
+    def _seed_counter(self, day: str):
+        """Start a new day's counter above any invoices issued before counters existed"""
+        if day in self._seeded_days:
+            return
+        prefix = f"INV-{day}-"
+        highest = 0
+        # Numbers can have gaps and outgrow four digits, so neither a count nor a string sort gives the top
+        for sale in sales_col.find({"invoice_number": {"$regex": f"^{prefix}"}}, {"_id": 0, "invoice_number": 1}):
+            suffix = sale["invoice_number"][len(prefix):]
+            if suffix.isdigit():
+                highest = max(highest, int(suffix))
+        # $max keeps this safe against another worker seeding or leasing at the same time
+        self._upsert_counter(day, {"$max": {"seq": highest}})
+        self._seeded_days.add(day)
+
+    @staticmethod
+    def _upsert_counter(day: str, update: Dict) -> Dict:
+        try:
+            return invoice_counters_col.find_one_and_update(
+                {"_id": f"INV-{day}"}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two workers upserted the day's counter at once; it exists now
+            return invoice_counters_col.find_one_and_update(
+                {"_id": f"INV-{day}"}, update, return_document=ReturnDocument.AFTER
+            )
+
+    def lease_block(self, terminal: str, size: Optional[int] = None, day: Optional[str] = None) -> Dict:
+        """Reserve a contiguous block of invoice numbers for a terminal"""
+        size = size or self.block_size
+        day = day or datetime.utcnow().strftime("%Y%m%d")
+        self._seed_counter(day)
+
+        counter = self._upsert_counter(day, {"$inc": {"seq": size}})
+        end = counter["seq"]
+        return {
+            "terminal": terminal,
+            "day": day,
+            "prefix": f"INV-{day}-",
+            "start": end - size + 1,
+            "end": end,
+            "leased_at": datetime.utcnow().isoformat()
+        }
+
+    def lease_block_for_terminal(self, terminal_id: str, size: Optional[int] = None) -> Optional[Dict]:
+        """Lease a block to a registered terminal and record it on the terminal document"""
+        terminal = terminals_col.find_one({"id": terminal_id}, {"_id": 0, "id": 1, "name": 1})
+        if not terminal:
+            return None
+        lease = self.lease_block(terminal["name"], size)
+        terminals_col.update_one({"id": terminal_id}, {"$set": {"invoice_block": lease}})
+        return lease
+
+    def _current_lease(self, terminal: str, day: str) -> Optional[Dict]:
+        lease = self._leases.get(terminal)
+        if lease and lease["day"] == day and lease["next"] <= lease["end"]:
+            return lease
+        return None
+
+    def next_invoice_number(self, terminal: str = "server") -> str:
+        """Allocate the next invoice number from this process' lease for the terminal"""
+        day = datetime.utcnow().strftime("%Y%m%d")
+        while True:
+            with self._lock:
+                lease = self._current_lease(terminal, day)
+                if lease:
+                    number = lease["next"]
+                    lease["next"] += 1
+                    return self.format_invoice_number(day, number)
+                refill_lock = self._refill_locks.setdefault(terminal, threading.Lock())
+            # Lease outside the shared lock so other terminals keep numbering meanwhile
+            with refill_lock:
+                with self._lock:
+                    if self._current_lease(terminal, day):
+                        # Another thread refilled while this one waited
+                        continue
+                lease = self.lease_block(terminal, day=day)
+                lease["next"] = lease["start"]
+                with self._lock:
+                    self._leases[terminal] = lease
+
+# Singleton instance
+invoice_service = InvoiceSequenceService()
@@ -0,0 +1,203 @@
+"""
+Password hashing and login verification
+
+bcrypt is deliberately slow (100-300 ms per check), and a verify running
+on a request thread holds that thread the whole time. Logins are therefore
+verified in a small process pool: the event loop awaits the result, the
+request threadpool stays free for sales, and the hashing runs on other
+cores without the GIL. At most PASSWORD_QUEUE_LIMIT verifications may be
+queued; beyond that login answers 503 with Retry-After.
+
+Per username, only one verification runs at a time and repeated failures
+lock the name out for a growing period, so a burst or a password guessing
+run costs the pool a handful of checks rather than one per attempt.
+Counters are per worker process.
+
+The bcrypt cost comes from BCRYPT_ROUNDS. A password stored with another
+cost is re-hashed with the configured one on its next successful login.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Tuple
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', str(min(2, os.cpu_count() or 1))))
+QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', '64'))
+MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES', '5'))
+FAILURE_WINDOW_SECONDS = float(os.environ.get('LOGIN_FAILURE_WINDOW_SECONDS', '300'))
+LOCKOUT_SECONDS = float(os.environ.get('LOGIN_LOCKOUT_SECONDS', '30'))
+MAX_LOCKOUT_SECONDS = 900
+# Workers start from a clean interpreter rather than a fork of this process
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+def _verify(password: str, hashed: str) -> Tuple[float, bool, Optional[str]]:
+    """Runs in a pool process: (start time, valid, new hash if the cost changed)"""
+    started = time.time()
+    valid, new_hash = pwd_context.verify_and_update(password, hashed)
+    return started, valid, new_hash
+
+
+class LoginThrottle:
+    """Per-username failure counting with exponential lockout"""
+
+    def __init__(self):
+        self._failures: Dict[str, Tuple[int, float]] = {}  # username -> (count, last failure)
+        self._locked_until: Dict[str, float] = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def begin(self, username: str):
+        """Claim the username's verification slot or raise 429"""
+        now = time.monotonic()
+        with self._lock:
+            retry_after = self._locked_until.get(username, 0) - now
+            if retry_after <= 0 and username in self._in_flight:
+                retry_after = 1
+            if retry_after > 0:
+                self.rejected += 1
+                raise HTTPException(status_code=429, detail="Too many login attempts, try again later",
+                                    headers={"Retry-After": str(int(retry_after) + 1)})
+            self._in_flight.add(username)
+
+    def end(self, username: str, success: Optional[bool]):
+        """Release the slot and count the outcome (None: the password was never checked)"""
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight.discard(username)
+            if success is None:
+                return
+            if success:
+                self._failures.pop(username, None)
+                self._locked_until.pop(username, None)
+                return
+            count, last = self._failures.get(username, (0, now))
+            count = count + 1 if now - last < FAILURE_WINDOW_SECONDS else 1
+            self._failures[username] = (count, now)
+            if count >= MAX_FAILURES:
+                # 30s, 60s, 120s ... for each further failure
+                self._locked_until[username] = now + min(LOCKOUT_SECONDS * 2 ** (count - MAX_FAILURES),
+                                                         MAX_LOCKOUT_SECONDS)
+            if len(self._failures) > 10000:
+                # Guessing across many names; forget the stale ones
+                self._failures = {name: entry for name, entry in self._failures.items()
+                                  if now - entry[1] < FAILURE_WINDOW_SECONDS}
+                self._locked_until = {name: until for name, until in self._locked_until.items() if until > now}
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "locked_usernames": sum(1 for until in self._locked_until.values() if until > now),
+                "in_flight": len(self._in_flight),
+                "rejected": self.rejected
+            }
+
+
+class PasswordPool:
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.throttle = LoginThrottle()
+        self.pending = 0
+        self.verifications = 0
+        self.rehashes = 0
+        self.overloaded = 0
+        self.wait_time_total_ms = 0.0
+        self.wait_time_max_ms = 0.0
+        self.verify_time_total_ms = 0.0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Not fork: by now the Mongo clients' monitor threads are running, and a
+                # child forked while one holds a lock can deadlock. Workers only need bcrypt.
+                self._executor = ProcessPoolExecutor(max_workers=POOL_WORKERS,
+                                                     mp_context=multiprocessing.get_context(START_METHOD))
+            return self._executor
+
+    def start(self):
+        try:
+            self._pool().submit(time.time).result()
+        except Exception as e:
+            print(f"❌ Password pool failed to start: {str(e)}")
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def verify(self, username: str, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """
+        Check password against hashed off the event loop. Returns whether it
+        matched and, when the stored cost differs from BCRYPT_ROUNDS, a new
+        hash to save. Raises 429 while username is throttled and 503 when the
+        queue is full.
+        """
+        self.throttle.begin(username)
+        valid = None
+        try:
+            if self.pending >= QUEUE_LIMIT:
+                self.overloaded += 1
+                raise HTTPException(status_code=503, detail="Login service busy, try again shortly",
+                                    headers={"Retry-After": "2"})
+            self.pending += 1
+            submitted = time.time()
+            try:
+                try:
+                    future = self._pool().submit(_verify, password, hashed)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM killed); start a fresh pool
+                    self.stop()
+                    future = self._pool().submit(_verify, password, hashed)
+                started, valid, new_hash = await asyncio.wrap_future(future)
+            finally:
+                self.pending -= 1
+            finished = time.time()
+            self.verifications += 1
+            wait_ms = max(started - submitted, 0) * 1000
+            self.wait_time_total_ms += wait_ms
+            self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+            self.verify_time_total_ms += (finished - started) * 1000
+            if new_hash:
+                self.rehashes += 1
+            return valid, new_hash
+        finally:
+            self.throttle.end(username, valid)
+
+    def stats(self) -> Dict:
+        verifications = self.verifications or 1
+        return {
+            "workers": POOL_WORKERS,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "pending": self.pending,
+            "queue_limit": QUEUE_LIMIT,
+            "verifications": self.verifications,
+            "rehashes": self.rehashes,
+            "overloaded": self.overloaded,
+            "wait_time_avg_ms": round(self.wait_time_total_ms / verifications, 2),
+            "wait_time_max_ms": round(self.wait_time_max_ms, 2),
+            "verify_time_avg_ms": round(self.verify_time_total_ms / verifications, 2),
+            "throttle": self.throttle.stats()
+        }
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+# Singleton instance
+password_pool = PasswordPool()
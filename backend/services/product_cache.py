@@ -0,0 +1,340 @@
+"""
+Product catalog cache
+
+Every product is held in memory, indexed by id, SKU and barcode, so a scan
+at the till is a dictionary lookup instead of a MongoDB round trip. The
+cache is warmed at startup and kept current in two ways:
+
+- Write-through: the product write paths in this process call refresh(),
+  put() or apply_stock() right after writing.
+- Other workers' writes: a background thread follows a change stream on
+  products, or, where change streams are unavailable (standalone mongod),
+  polls for products whose updated_at moved and fully reloads every
+  PRODUCT_CACHE_RELOAD_SECONDS.
+
+A lookup that misses still falls back to the database, and the result is
+cached. Cached documents are shared: callers must not mutate them.
+
+Searches run on a SearchView that is never changed once published, without
+holding the cache lock: a write that changes what products match builds a
+new view and swaps it in. Ranking a short prefix over a large catalog takes
+a while, and the stock updates made at every checkout must not wait on it.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+import os
+import sys
+import threading
+import time
+
+from pymongo.errors import OperationFailure
+
+from services.product_search import SearchIndex, rank
+from utils.database import products_col
+
+POLL_SECONDS = float(os.environ.get('PRODUCT_CACHE_POLL_SECONDS', '5'))
+# Overlap between polls so writes that commit late are not skipped
+POLL_OVERLAP_SECONDS = float(os.environ.get('PRODUCT_CACHE_POLL_OVERLAP_SECONDS', '10'))
+RELOAD_SECONDS = float(os.environ.get('PRODUCT_CACHE_RELOAD_SECONDS', '3600'))
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+def _deep_size(obj) -> int:
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(key) + _deep_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_size(item) for item in obj)
+    return size
+
+
+class CatalogIndex:
+    """Products by id, and SKU and barcode maps pointing at their ids"""
+
+    def __init__(self):
+        self.by_id: Dict[str, Dict] = {}
+        self.by_sku: Dict[str, str] = {}
+        self.by_barcode: Dict[str, str] = {}
+
+    def _unindex(self, product: Dict):
+        product_id = product.get("id")
+        if self.by_sku.get(product.get("sku")) == product_id:
+            del self.by_sku[product["sku"]]
+        for barcode in product.get("barcodes") or []:
+            if self.by_barcode.get(barcode) == product_id:
+                del self.by_barcode[barcode]
+
+    def add(self, product: Dict):
+        product_id = product.get("id")
+        if not product_id:
+            return
+        previous = self.by_id.get(product_id)
+        if previous is not None:
+            self._unindex(previous)
+        self.by_id[product_id] = product
+        if product.get("sku"):
+            self.by_sku[product["sku"]] = product_id
+        # Only active products are scannable
+        if product.get("active", True):
+            for barcode in product.get("barcodes") or []:
+                self.by_barcode[barcode] = product_id
+
+    def memory_bytes(self) -> int:
+        return _deep_size(self.by_id) + _deep_size(self.by_sku) + _deep_size(self.by_barcode)
+
+
+class SearchView:
+    """The search index and the inactive product ids; never changed once published"""
+
+    def __init__(self, index: Optional[SearchIndex] = None, inactive: FrozenSet[str] = frozenset()):
+        self.index = index or SearchIndex()
+        self.inactive = inactive
+
+    def with_products(self, products: List[Dict]) -> "SearchView":
+        """A view with products added, or this one if none of them changes it"""
+        inactive = set(self.inactive)
+        for product in products:
+            if product.get("id"):
+                if product.get("active", True):
+                    inactive.discard(product["id"])
+                else:
+                    inactive.add(product["id"])
+        # Stock and price updates leave the tokens alone, so most writes copy nothing
+        changed = [product for product in products if self.index.changes(product)]
+        if not changed and inactive == self.inactive:
+            return self
+        index = self.index
+        if changed:
+            index = index.copy()
+            for product in changed:
+                index.add(product)
+        return SearchView(index, frozenset(inactive))
+
+
+class ProductCache:
+    def __init__(self):
+        self.enabled = os.environ.get('PRODUCT_CACHE_ENABLED', 'true').lower() != 'false'
+        self._catalog = CatalogIndex()
+        self._search = SearchView()
+        self._lock = threading.Lock()
+        # Serializes writers of the search view, which copy it outside _lock
+        self._search_lock = threading.Lock()
+        self._memory_bytes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.mode = "off"
+        self.loaded_at: Optional[str] = None
+        self._reloaded = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    # ---- Writes ----
+
+    def _add(self, products: Iterable[Dict]):
+        if not self.enabled:
+            return
+        products = list(products)
+        with self._lock:
+            for product in products:
+                self._catalog.add(product)
+        with self._search_lock:
+            self._search = self._search.with_products(products)
+
+    def put(self, product: Dict):
+        """Cache a product document as just written"""
+        self._add([{key: value for key, value in product.items() if key != "_id"}])
+
+    def refresh(self, query: Dict) -> List[Dict]:
+        """Re-read the products matching query from the database"""
+        products = list(products_col.find(query, {"_id": 0}))
+        self._add(products)
+        return products
+
+    def refresh_ids(self, product_ids: Iterable[str]) -> List[Dict]:
+        return self.refresh({"id": {"$in": list(product_ids)}})
+
+    def apply_stock(self, deltas: Dict[str, float], updated_at: str):
+        """Apply stock changes already written with $inc, without reading them back"""
+        with self._lock:
+            for product_id, delta in deltas.items():
+                product = self._catalog.by_id.get(product_id)
+                if product is not None:
+                    # Replace rather than mutate: readers may hold the old dict
+                    self._catalog.by_id[product_id] = {
+                        **product, "stock": product.get("stock", 0) + delta, "updated_at": updated_at
+                    }
+
+    def reload(self) -> int:
+        """Rebuild the whole cache from the database, swapping it in when complete"""
+        if not self.enabled:
+            return 0
+        started = time.monotonic()
+        catalog = CatalogIndex()
+        index = SearchIndex()
+        inactive = set()
+        for product in products_col.find({}, {"_id": 0}, batch_size=1000):
+            catalog.add(product)
+            index.add(product)
+            if not product.get("active", True):
+                inactive.add(product.get("id"))
+        memory_bytes = catalog.memory_bytes()
+        with self._search_lock, self._lock:
+            self._catalog = catalog
+            self._search = SearchView(index, frozenset(inactive))
+            self._memory_bytes = memory_bytes
+            self.loaded_at = datetime.utcnow().isoformat()
+            self._reloaded = time.monotonic()
+        print(f"✅ Product cache loaded {len(catalog.by_id)} products in {time.monotonic() - started:.2f}s")
+        return len(catalog.by_id)
+
+    # ---- Lookups ----
+
+    def _count(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def by_barcode(self, barcode: str) -> Optional[Dict]:
+        """Active product carrying this barcode"""
+        catalog = self._catalog
+        product_id = catalog.by_barcode.get(barcode)
+        product = catalog.by_id.get(product_id) if product_id else None
+        if product is not None and product.get("active", True) and barcode in (product.get("barcodes") or []):
+            self._count(True)
+            return product
+        self._count(False)
+        product = products_col.find_one({"barcodes": barcode, "active": True}, {"_id": 0})
+        if product:
+            self.put(product)
+        return product
+
+    def by_id(self, product_id: str) -> Optional[Dict]:
+        product = self._catalog.by_id.get(product_id)
+        self._count(product is not None)
+        if product is None:
+            product = products_col.find_one({"id": product_id}, {"_id": 0})
+            if product:
+                self.put(product)
+        return product
+
+    def by_sku(self, sku: str) -> Optional[Dict]:
+        catalog = self._catalog
+        product_id = catalog.by_sku.get(sku)
+        product = catalog.by_id.get(product_id) if product_id else None
+        self._count(product is not None)
+        if product is None:
+            product = products_col.find_one({"sku": sku}, {"_id": 0})
+            if product:
+                self.put(product)
+        return product
+
+    @property
+    def ready(self) -> bool:
+        """Whether the full catalog has been loaded (searches need all of it)"""
+        return self.loaded_at is not None
+
+    def search(self, query: str, active_only: bool = True, skip: int = 0,
+               limit: int = 100) -> Tuple[List[Dict], int]:
+        """Ranked products matching every word of query, with their search_score, and the match count"""
+        view = self._search
+        scores = view.index.search(query)
+        if active_only:
+            for pid in view.inactive & scores.keys():
+                del scores[pid]
+        ranked = rank(scores, skip + limit)[skip:]
+        by_id = self._catalog.by_id
+        products = []
+        for pid, score in ranked:
+            # A reload may have swapped the catalog since the view was taken
+            product = by_id.get(pid)
+            if product is not None:
+                products.append({**product, "search_score": score})
+        return products, len(scores)
+
+    # ---- Cross-worker sync ----
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="product-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        # Warm up off the startup path; lookups fall back to the database meanwhile
+        try:
+            self.reload()
+        except Exception as e:
+            print(f"❌ Product cache warm-up failed: {str(e)}")
+        while not self._stop.is_set():
+            try:
+                self._follow()
+            except Exception as e:
+                print(f"❌ Product cache sync error: {str(e)}")
+                # Changes may have been missed while disconnected
+                if not self._stop.wait(POLL_SECONDS):
+                    try:
+                        self.reload()
+                    except Exception:
+                        pass
+
+    def _follow(self):
+        try:
+            with products_col.watch(full_document='updateLookup', max_await_time_ms=1000) as stream:
+                self.mode = "change_stream"
+                # A dropped or renamed collection invalidates the stream; reopen it
+                while stream.alive and not self._stop.is_set():
+                    change = stream.try_next()
+                    if change:
+                        self._apply_change(change)
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAM_UNSUPPORTED:
+                raise
+            self.mode = "polling"
+            self._poll()
+
+    def _apply_change(self, change: Dict):
+        if change["operationType"] in ("insert", "update", "replace"):
+            if change.get("fullDocument"):
+                self.put(change["fullDocument"])
+        else:
+            # Deletes only carry the _id, and drops/renames replace everything
+            self.reload()
+
+    def _poll(self):
+        since = datetime.utcnow() - timedelta(seconds=POLL_OVERLAP_SECONDS)
+        while not self._stop.wait(POLL_SECONDS):
+            if time.monotonic() - self._reloaded >= RELOAD_SECONDS:
+                # Also picks up hard deletes, which polling cannot see
+                self.reload()
+                continue
+            started = datetime.utcnow()
+            self.refresh({"updated_at": {"$gte": since.isoformat()}})
+            since = started - timedelta(seconds=POLL_OVERLAP_SECONDS)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        catalog = self._catalog
+        return {
+            "enabled": self.enabled,
+            "ready": self.ready,
+            "sync_mode": self.mode,
+            "products": len(catalog.by_id),
+            "barcodes": len(catalog.by_barcode),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+            # Measured at the last full load: walking the catalog is too slow per request
+            "memory_mb": round(self._memory_bytes / (1024 * 1024), 2),
+            "loaded_at": self.loaded_at
+        }
+
+
+# Singleton instance
+product_cache = ProductCache()
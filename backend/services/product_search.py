@@ -0,0 +1,180 @@
+"""
+Product search index
+
+In-memory token index over SKU, barcodes and the English, Sinhala and Tamil
+product names. Text is NFC-normalised and case-folded, and zero-width
+joiners are dropped, so Sinhala conjuncts typed with or without ZWJ match
+the same way. Each query word matches index tokens by:
+
+- exact token (best),
+- token prefix, found by bisecting a sorted token list (type-ahead),
+- substring anywhere in a token, found through a trigram index.
+
+Every word must match somewhere. Matches are scored by field (codes above
+names) and match type, and the best-scoring products come first.
+"""
+
+from bisect import bisect_left, insort
+from operator import itemgetter
+from typing import Dict, List, Set, Tuple
+import heapq
+import re
+import unicodedata
+
+# Word characters plus the whole Sinhala and Tamil blocks (vowel signs and
+# virama are combining marks, which \w alone does not keep inside a word)
+TOKEN_PATTERN = re.compile(r"[\w\u0D80-\u0DFF\u0B80-\u0BFF]+")
+# Zero-width space, ZWNJ, ZWJ and BOM
+IGNORED_CHARS = dict.fromkeys(map(ord, "\u200b\u200c\u200d\ufeff"))
+
+FIELD_WEIGHTS = {"sku": 4, "barcodes": 4, "name_en": 2, "name_si": 2, "name_ta": 2}
+EXACT, PREFIX, INFIX = 3, 2, 1
+# Sorts after every character, so word + PREFIX_END bounds the tokens starting with word
+PREFIX_END = "\U0010ffff"
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFC", str(text)).translate(IGNORED_CHARS).casefold()
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(normalize(text))
+
+
+def _trigrams(token: str) -> Set[str]:
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def product_tokens(product: Dict) -> Dict[str, int]:
+    """Index tokens of a product with the weight of the best field each appears in"""
+    tokens: Dict[str, int] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        values = product.get(field) or []
+        for value in values if isinstance(values, list) else [values]:
+            words = tokenize(value)
+            if field in ("sku", "barcodes"):
+                # Codes also match as a whole, separators included
+                words.append(normalize(value).strip())
+            for word in words:
+                if word and tokens.get(word, 0) < weight:
+                    tokens[word] = weight
+    return tokens
+
+
+class SearchIndex:
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, Set[str]]] = {}  # token -> {field weight: product ids}
+        self.sorted_tokens: List[str] = []
+        self.trigrams: Dict[str, Set[str]] = {}  # trigram -> tokens containing it
+        self._product_tokens: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._product_tokens)
+
+    def copy(self) -> "SearchIndex":
+        """An independent copy; product token maps are replaced on change, never mutated, so they are shared"""
+        clone = SearchIndex()
+        clone.postings = {token: {weight: set(ids) for weight, ids in posting.items()}
+                          for token, posting in self.postings.items()}
+        clone.sorted_tokens = list(self.sorted_tokens)
+        clone.trigrams = {trigram: set(tokens) for trigram, tokens in self.trigrams.items()}
+        clone._product_tokens = dict(self._product_tokens)
+        return clone
+
+    def changes(self, product: Dict) -> bool:
+        """Whether adding product would change the index"""
+        return bool(product.get("id")) and self._product_tokens.get(product["id"]) != product_tokens(product)
+
+    def add(self, product: Dict):
+        product_id = product.get("id")
+        if not product_id:
+            return
+        tokens = product_tokens(product)
+        if self._product_tokens.get(product_id) == tokens:
+            return
+        self.remove(product_id)
+        self._product_tokens[product_id] = tokens
+        for token, weight in tokens.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                insort(self.sorted_tokens, token)
+                for trigram in _trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+            posting.setdefault(weight, set()).add(product_id)
+
+    def remove(self, product_id: str):
+        for token, weight in self._product_tokens.pop(product_id, {}).items():
+            posting = self.postings[token]
+            posting[weight].discard(product_id)
+            if not posting[weight]:
+                del posting[weight]
+            if posting:
+                continue
+            del self.postings[token]
+            del self.sorted_tokens[bisect_left(self.sorted_tokens, token)]
+            for trigram in _trigrams(token):
+                holders = self.trigrams[trigram]
+                holders.discard(token)
+                if not holders:
+                    del self.trigrams[trigram]
+
+    def _match_word(self, word: str) -> Dict[str, int]:
+        """product_id -> best score for one query word"""
+        by_score: Dict[int, Set[str]] = {}
+
+        def collect(token: str, kind: int):
+            for weight, product_ids in self.postings[token].items():
+                matched = by_score.get(weight * kind)
+                if matched is None:
+                    by_score[weight * kind] = set(product_ids)
+                else:
+                    matched |= product_ids
+
+        # Every token with the prefix: the match count is exact and callers limit the rows
+        start = bisect_left(self.sorted_tokens, word)
+        end = bisect_left(self.sorted_tokens, word + PREFIX_END, start)
+        for token in self.sorted_tokens[start:end]:
+            collect(token, EXACT if token == word else PREFIX)
+
+        if len(word) >= 3:
+            holders = sorted((self.trigrams.get(trigram, set()) for trigram in _trigrams(word)), key=len)
+            candidates = set.intersection(*holders) if holders and holders[0] else set()
+            for token in candidates:
+                if word in token and not token.startswith(word):
+                    collect(token, INFIX)
+
+        # Lowest scores first so each product ends up with its best one
+        scores: Dict[str, int] = {}
+        for score in sorted(by_score):
+            scores.update(dict.fromkeys(by_score[score], score))
+        return scores
+
+    def search(self, query: str) -> Dict[str, int]:
+        """product_id -> relevance score, for products matching every query word"""
+        words = tokenize(query)
+        if not words:
+            return {}
+        # Rarest-looking (longest) words first so the candidate set shrinks fast
+        results = None
+        for word in sorted(set(words), key=len, reverse=True):
+            scores = self._match_word(word)
+            if results is None:
+                results = scores
+            else:
+                results = {pid: results[pid] + scores[pid] for pid in results.keys() & scores.keys()}
+            if not results:
+                return {}
+        # A code typed in full with its separators ranks first
+        whole = normalize(query).strip()
+        if words == [whole]:
+            return results
+        code_weight = FIELD_WEIGHTS["sku"]
+        for product_id in self.postings.get(whole, {}).get(code_weight, set()) & results.keys():
+            results[product_id] += code_weight * EXACT
+        return results
+
+
+def rank(scores: Dict[str, int], count: int) -> List[Tuple[str, int]]:
+    """The count best (product_id, score) pairs, highest score first"""
+    return heapq.nlargest(count, scores.items(), key=itemgetter(1))
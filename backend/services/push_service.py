@@ -0,0 +1,189 @@
+"""
+Sync push channel
+
+Terminals subscribed over WebSocket or Server-Sent Events are told about
+product, discount rule and settings changes as they happen instead of
+polling /api/sync/changes. The change log stays the single source of
+truth: one background thread per worker wakes when the sequence moves and
+reads everything new with a single changes() call, so a burst of writes (a
+bulk price update, an import) reaches terminals as one batch with each
+document once, in its latest state.
+
+Writes made by this process wake the thread directly. Writes made by other
+workers are picked up by checking the shared sequence counter every
+PUSH_POLL_SECONDS, which only happens while someone is subscribed.
+
+Every message has the shape of a /api/sync/changes page plus from_seq, so
+a terminal applies it with the same code. A subscriber that falls too far
+behind is sent a "resync" message and catches up from the change log
+itself, as it does on connect.
+"""
+
+from typing import AsyncIterator, Dict, Optional, Set
+import asyncio
+import json
+import os
+import threading
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.change_log import change_log
+
+POLL_SECONDS = float(os.environ.get('PUSH_POLL_SECONDS', '0.5'))
+# Writes usually come in runs (one per cart line, one per imported row); wait briefly to batch them
+COALESCE_SECONDS = float(os.environ.get('PUSH_COALESCE_SECONDS', '0.05'))
+KEEPALIVE_SECONDS = float(os.environ.get('PUSH_KEEPALIVE_SECONDS', '15'))
+QUEUE_SIZE = int(os.environ.get('PUSH_QUEUE_SIZE', '100'))
+BATCH_LIMIT = 500
+
+
+class Subscriber:
+    __slots__ = ('queue', 'loop')
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.loop = loop
+
+    def deliver(self, message: Dict):
+        """Runs on the subscriber's event loop"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Too slow to keep up; drop the backlog and let it read the log itself
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class PushHub:
+    def __init__(self):
+        self.enabled = os.environ.get('PUSH_ENABLED', 'true').lower() != 'false'
+        self._subscribers: Set[Subscriber] = set()
+        self._seq: Optional[int] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        change_log.on_record(self._wake.set)
+
+    def subscribe(self) -> Subscriber:
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+        self._wake.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sync-push", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if not self._subscribers:
+                # Nobody to tell; new subscribers catch up on their own
+                self._seq = None
+                continue
+            if woken:
+                self._stop.wait(COALESCE_SECONDS)
+            try:
+                self._publish()
+            except Exception as e:
+                print(f"❌ Sync push error: {str(e)}")
+                self._stop.wait(POLL_SECONDS)
+
+    def _publish(self):
+        latest = change_log.latest_seq()
+        if self._seq is None:
+            self._seq = latest
+        while self._seq < latest:
+            page = change_log.changes(self._seq, BATCH_LIMIT)
+            if page["next_seq"] == self._seq and not page["reset_required"]:
+                # Stopped at a sequence a writer is still filling
+                return
+            self._broadcast({"type": "changes", "from_seq": self._seq, **page})
+            self._seq = page["next_seq"]
+            if not page["has_more"]:
+                return
+
+    def _broadcast(self, message: Dict):
+        self.batches += 1
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, message)
+            except RuntimeError:
+                # Its event loop has closed
+                self.unsubscribe(subscriber)
+
+    async def messages(self, since_seq: Optional[int] = None) -> AsyncIterator[Dict]:
+        """
+        Change batches for one subscriber, starting after since_seq (or from
+        now if not given), with a keepalive when nothing happens
+        """
+        subscriber = self.subscribe()
+        try:
+            if since_seq is None:
+                since_seq = await run_in_threadpool(change_log.latest_seq)
+            seq = since_seq
+            yield {"type": "hello", "seq": seq}
+
+            catch_up = True
+            while True:
+                while catch_up:
+                    page = await run_in_threadpool(change_log.changes, seq, BATCH_LIMIT)
+                    if page["changes"] or page["reset_required"]:
+                        yield {"type": "changes", "from_seq": seq, **page}
+                    seq = page["next_seq"]
+                    catch_up = page["has_more"]
+
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield {"type": "keepalive", "seq": seq}
+                    continue
+                if message["type"] == "resync" or message["from_seq"] > seq:
+                    # Missed a batch; read the gap from the log
+                    catch_up = True
+                elif message["next_seq"] > seq:
+                    # Overlapping a page we already sent is harmless: changes carry current state
+                    yield message
+                    seq = message["next_seq"]
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def sse(self, since_seq: Optional[int] = None) -> AsyncIterator[str]:
+        """messages() as Server-Sent Events; the event id is the sequence to resume from"""
+        async for message in self.messages(since_seq):
+            seq = message.get("next_seq", message.get("seq"))
+            data = json.dumps(message, separators=(',', ':'), ensure_ascii=False, default=str)
+            yield f"id: {seq}\nevent: {message['type']}\ndata: {data}\n\n"
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "running": bool(self._thread and self._thread.is_alive()),
+            "subscribers": len(self._subscribers),
+            "seq": self._seq,
+            "batches_sent": self.batches
+        }
+
+
+# Singleton instance
+push_hub = PushHub()
@@ -0,0 +1,174 @@
+"""
+Report aggregation pipelines
+
+Sales reports grouped server-side with $match/$unwind/$group/$lookup so the
+API process only ever holds the grouped rows, whatever the date range.
+"""
+
+from typing import Dict, List
+
+from utils.database import registry
+
+reporting_db = registry.database("reporting")
+sales_col = reporting_db['sales']
+
+
+def sales_match(start_date: str = "", end_date: str = "") -> Dict:
+    """$match stage for completed sales between two created_at strings"""
+    query = {"status": "completed"}
+    if start_date:
+        query["created_at"] = {"$gte": start_date}
+    if end_date:
+        query.setdefault("created_at", {})["$lte"] = end_date
+    return {"$match": query}
+
+
+def _run(pipeline: List[Dict]) -> List[Dict]:
+    return list(sales_col.aggregate(pipeline, allowDiskUse=True))
+
+
+def _items_stages(*fields: str) -> List[Dict]:
+    """Project only the needed line item fields, then one document per line"""
+    return [
+        {"$project": {"_id": 0, **{f"items.{field}": 1 for field in fields}}},
+        {"$unwind": "$items"},
+    ]
+
+
+def top_products(start_date: str = "", end_date: str = "", limit: int = 10) -> List[Dict]:
+    """Products ranked by revenue"""
+    return _run([
+        sales_match(start_date, end_date),
+        *_items_stages("product_id", "sku", "name", "quantity", "total"),
+        {"$group": {
+            "_id": {"$ifNull": ["$items.product_id", ""]},
+            "sku": {"$first": {"$ifNull": ["$items.sku", ""]}},
+            "name": {"$first": {"$ifNull": ["$items.name", ""]}},
+            "quantity_sold": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": "$items.total"},
+            "times_sold": {"$sum": 1}
+        }},
+        {"$sort": {"revenue": -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "product_id": "$_id", "sku": 1, "name": 1,
+                      "quantity_sold": 1, "revenue": 1, "times_sold": 1}},
+    ])
+
+
+def top_categories(start_date: str = "", end_date: str = "") -> List[Dict]:
+    """Categories ranked by revenue, using each product's current category"""
+    return _run([
+        sales_match(start_date, end_date),
+        *_items_stages("product_id", "quantity", "total"),
+        # Collapse to one row per product before joining the catalog
+        {"$group": {
+            "_id": "$items.product_id",
+            "quantity_sold": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": "$items.total"},
+            "items_count": {"$sum": 1}
+        }},
+        {"$lookup": {"from": "products", "localField": "_id", "foreignField": "id", "as": "product"}},
+        # Lines for products no longer in the catalog are left out
+        {"$unwind": "$product"},
+        {"$group": {
+            "_id": {"$ifNull": ["$product.category", "Uncategorized"]},
+            "quantity_sold": {"$sum": "$quantity_sold"},
+            "revenue": {"$sum": "$revenue"},
+            "items_count": {"$sum": "$items_count"}
+        }},
+        {"$sort": {"revenue": -1}},
+        {"$project": {"_id": 0, "category": "$_id", "quantity_sold": 1, "revenue": 1, "items_count": 1}},
+    ])
+
+
+def discount_usage(start_date: str = "", end_date: str = "") -> Dict:
+    """Invoice-level discount totals plus per-rule usage"""
+    result = _run([
+        sales_match(start_date, end_date),
+        {"$project": {"_id": 0, "total_discount": 1, "items.discount_amount": 1, "items.applied_rule": 1}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "total_discount": {"$sum": "$total_discount"},
+                    "invoices_with_discount": {"$sum": {"$cond": [{"$gt": ["$total_discount", 0]}, 1, 0]}},
+                    "total_invoices": {"$sum": 1}
+                }}
+            ],
+            "rule_usage": [
+                {"$unwind": "$items"},
+                {"$match": {"items.discount_amount": {"$gt": 0}}},
+                {"$group": {
+                    "_id": {"$ifNull": ["$items.applied_rule", "Manual Discount"]},
+                    "times_applied": {"$sum": 1},
+                    "total_discount": {"$sum": "$items.discount_amount"}
+                }},
+                {"$project": {"_id": 0, "rule_name": "$_id", "times_applied": 1, "total_discount": 1}}
+            ]
+        }},
+    ])[0]
+
+    totals = result["totals"][0] if result["totals"] else {
+        "total_discount": 0, "invoices_with_discount": 0, "total_invoices": 0
+    }
+    total_invoices = totals["total_invoices"]
+    return {
+        "total_discount": totals["total_discount"],
+        "invoices_with_discount": totals["invoices_with_discount"],
+        "total_invoices": total_invoices,
+        "discount_percentage": (totals["invoices_with_discount"] / total_invoices * 100) if total_invoices > 0 else 0,
+        "rule_usage": result["rule_usage"]
+    }
+
+
+def customer_stats(start_date: str = "", end_date: str = "") -> List[Dict]:
+    """Purchases per customer id (walk-in sales grouped together), by total spent"""
+    return _run([
+        sales_match(start_date, end_date),
+        {"$project": {"_id": 0, "customer_id": 1, "customer_name": 1, "total": 1}},
+        {"$group": {
+            "_id": {"$let": {
+                "vars": {"cid": {"$ifNull": ["$customer_id", ""]}},
+                "in": {"$cond": [{"$eq": ["$$cid", ""]}, "walk-in", "$$cid"]}
+            }},
+            "customer_name": {"$first": {"$ifNull": ["$customer_name", "Walk-in"]}},
+            "total_purchases": {"$sum": 1},
+            "total_spent": {"$sum": "$total"}
+        }},
+        {"$sort": {"total_spent": -1}},
+        {"$project": {
+            "_id": 0,
+            "customer_id": "$_id",
+            "customer_name": 1,
+            "total_purchases": 1,
+            "total_spent": 1,
+            "avg_purchase": {"$divide": ["$total_spent", "$total_purchases"]}
+        }},
+    ])
+
+
+def customer_insights(start_date: str = "", limit: int = 20) -> List[Dict]:
+    """Top customers by total spent; unnamed walk-ins are grouped by name"""
+    return _run([
+        sales_match(start_date),
+        {"$project": {"_id": 0, "customer_id": 1, "customer_name": 1, "total": 1}},
+        {"$group": {
+            "_id": {"$cond": [
+                {"$in": [{"$ifNull": ["$customer_id", ""]}, ["", None]]},
+                {"$ifNull": ["$customer_name", "Walk-in"]},
+                "$customer_id"
+            ]},
+            "customer_name": {"$first": {"$ifNull": ["$customer_name", "Walk-in"]}},
+            "purchase_count": {"$sum": 1},
+            "total_spent": {"$sum": "$total"}
+        }},
+        {"$sort": {"total_spent": -1}},
+        {"$limit": limit},
+        {"$project": {
+            "_id": 0,
+            "customer_name": 1,
+            "purchase_count": 1,
+            "total_spent": 1,
+            "avg_purchase": {"$divide": ["$total_spent", "$purchase_count"]}
+        }},
+    ])
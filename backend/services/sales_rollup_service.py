@@ -0,0 +1,243 @@
+"""
+Sales rollups
+
+Hourly and daily totals of completed sales, bucketed by store-local time,
+terminal, cashier and price tier. create_sale adds each completed sale with
+$inc, so reports read a handful of pre-aggregated buckets instead of every
+sale in the window. `python -m services.sales_rollup_service backfill`
+rebuilds the closed buckets from existing sales history.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+import argparse
+import os
+
+from pymongo import ASCENDING, UpdateOne
+
+from utils.database import db, registry, sales_col
+
+STORE_TIMEZONE = ZoneInfo(os.environ.get('STORE_TIMEZONE', 'UTC'))
+
+rollup_hourly_col = db['sales_rollup_hourly']
+rollup_daily_col = db['sales_rollup_daily']
+
+BUCKET_KEYS = ('bucket', 'terminal', 'cashier', 'price_tier')
+ROLLUP_FIELDS = ('revenue', 'invoices', 'line_count', 'quantity', 'subtotal', 'discount', 'tax')
+
+for _col in (rollup_hourly_col, rollup_daily_col):
+    _col.create_index([(key, ASCENDING) for key in BUCKET_KEYS], unique=True)
+
+
+def to_store_time(value: str) -> datetime:
+    """Parse a stored ISO timestamp (naive values are UTC) into store-local time"""
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(STORE_TIMEZONE)
+
+
+def hour_bucket(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H")
+
+
+def day_bucket(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d")
+
+
+def window_start(days: int) -> datetime:
+    """Store-local start of a rolling N-day window ending now"""
+    return datetime.now(timezone.utc).astimezone(STORE_TIMEZONE) - timedelta(days=days)
+
+
+def sale_totals(sale: Dict, sign: int = 1) -> Dict:
+    items = sale.get("items", [])
+    return {
+        "revenue": sign * sale.get("total", 0),
+        "invoices": sign,
+        "line_count": sign * len(items),
+        "quantity": sign * sum(item.get("quantity", 0) for item in items),
+        "subtotal": sign * sale.get("subtotal", 0),
+        "discount": sign * sale.get("total_discount", 0),
+        "tax": sign * sale.get("tax_amount", 0),
+    }
+
+
+def sale_dimensions(sale: Dict) -> Dict:
+    return {
+        "terminal": sale.get("terminal_name", ""),
+        "cashier": sale.get("cashier_name", "Unknown"),
+        "price_tier": sale.get("price_tier", "retail"),
+    }
+
+
+def record_sale(sale: Dict, sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) a completed sale from its hourly and daily buckets"""
+    moment = to_store_time(sale.get("created_at") or datetime.utcnow().isoformat())
+    dimensions = sale_dimensions(sale)
+    update = {"$inc": sale_totals(sale, sign)}
+
+    rollup_hourly_col.update_one({"bucket": hour_bucket(moment), **dimensions}, update, upsert=True)
+    rollup_daily_col.update_one({"bucket": day_bucket(moment), **dimensions}, update, upsert=True)
+
+
+def _utc_bound(day: str) -> str:
+    """created_at string for store-local midnight at the start of a day"""
+    local_midnight = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=STORE_TIMEZONE)
+    return local_midnight.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+def _closed_range(bucket_range: Dict, cutoff: Optional[str]) -> Dict:
+    """bucket_range narrowed to buckets before cutoff (None: no cutoff)"""
+    closed = dict(bucket_range)
+    if cutoff:
+        closed["$lt"] = min(closed.get("$lt", cutoff), cutoff)
+    return closed
+
+
+def _replace_buckets(col, buckets: Dict[tuple, Dict], bucket_range: Dict, batch_size: int):
+    """Set each computed bucket's totals and drop the buckets in range that no longer have sales"""
+    operations = [
+        UpdateOne(dict(zip(BUCKET_KEYS, key)), {"$set": totals}, upsert=True)
+        for key, totals in buckets.items()
+    ]
+    for i in range(0, len(operations), batch_size):
+        col.bulk_write(operations[i:i + batch_size], ordered=False)
+
+    stale = [
+        doc["_id"] for doc in col.find({"bucket": bucket_range} if bucket_range else {},
+                                       {key: 1 for key in BUCKET_KEYS})
+        if tuple(doc.get(key) for key in BUCKET_KEYS) not in buckets
+    ]
+    for i in range(0, len(stale), batch_size):
+        col.delete_many({"_id": {"$in": stale[i:i + batch_size]}})
+
+
+def backfill(start_day: str = "", end_day: str = "", batch_size: int = 1000, include_open: bool = False) -> Dict:
+    """
+    Rebuild rollups from completed sales, optionally for a range of whole
+    store days (YYYY-MM-DD, inclusive). Sales are streamed by cursor; memory
+    grows with the number of buckets, not the number of sales.
+
+    Only buckets that had closed when the run started are rebuilt: the
+    current hour and today are still taking $inc updates from new sales and
+    are left alone. Each closed bucket is overwritten with $set rather than
+    deleted and re-inserted, so report reads never see it missing. Edits to
+    old sales (status changes, late offline uploads) made while a run is in
+    progress can still be overwritten; run it while terminals are synced.
+
+    include_open rebuilds the current hour and today as well, for when the
+    sales collection has just been replaced wholesale (a backup restore).
+    """
+    query = {"status": "completed", "created_at": {}}
+    hour_cutoff = day_cutoff = None
+    if not include_open:
+        now = datetime.now(timezone.utc).astimezone(STORE_TIMEZONE)
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        hour_cutoff, day_cutoff = hour_bucket(current_hour), day_bucket(now)
+        query["created_at"]["$lt"] = current_hour.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+    bucket_range = {}
+    if start_day:
+        query["created_at"]["$gte"] = _utc_bound(start_day)
+        bucket_range["$gte"] = start_day
+    if end_day:
+        next_day = (datetime.strptime(end_day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        end_bound = _utc_bound(next_day)
+        query["created_at"]["$lt"] = min(query["created_at"].get("$lt", end_bound), end_bound)
+        bucket_range["$lt"] = next_day
+
+    if not query["created_at"]:
+        del query["created_at"]
+
+    projection = {"_id": 0, "created_at": 1, "total": 1, "subtotal": 1, "total_discount": 1,
+                  "tax_amount": 1, "items.quantity": 1, "terminal_name": 1, "cashier_name": 1,
+                  "price_tier": 1}
+
+    hourly: Dict[tuple, Dict] = {}
+    daily: Dict[tuple, Dict] = {}
+    sales_count = 0
+    for sale in sales_col.find(query, projection, batch_size=batch_size):
+        if not sale.get("created_at"):
+            continue
+        moment = to_store_time(sale["created_at"])
+        dimensions = sale_dimensions(sale)
+        totals = sale_totals(sale)
+        for buckets, bucket, cutoff in ((hourly, hour_bucket(moment), hour_cutoff),
+                                        (daily, day_bucket(moment), day_cutoff)):
+            if cutoff and bucket >= cutoff:
+                continue
+            key = (bucket, dimensions["terminal"], dimensions["cashier"], dimensions["price_tier"])
+            current = buckets.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+            for field in ROLLUP_FIELDS:
+                current[field] += totals[field]
+        sales_count += 1
+
+    _replace_buckets(rollup_hourly_col, hourly, _closed_range(bucket_range, hour_cutoff), batch_size)
+    _replace_buckets(rollup_daily_col, daily, _closed_range(bucket_range, day_cutoff), batch_size)
+
+    return {"sales": sales_count, "hourly_buckets": len(hourly), "daily_buckets": len(daily),
+            "rebuilt_before": hour_cutoff}
+
+
+def hour_bounds(start_date: str = "", end_date: str = "") -> tuple:
+    """
+    Map created_at bounds (UTC ISO dates or times, as the report endpoints
+    take them) onto store-local hourly bucket keys, rounded out to whole
+    hours. A bare end date stops at the start of that day, as the string
+    comparison against created_at did.
+    """
+    def bucket(value: str, before: bool) -> str:
+        try:
+            moment = to_store_time(value)
+        except ValueError:
+            return value[:13]
+        # The end bound is exclusive at the hour boundary: 10:00 ends with the 09 bucket, 10:30 with the 10 one
+        return hour_bucket(moment - timedelta(microseconds=1) if before else moment)
+
+    return (bucket(start_date, False) if start_date else "", bucket(end_date, True) if end_date else "")
+
+
+def _bucket_match(start: str = "", end: str = "") -> Dict:
+    match = {}
+    if start:
+        match["bucket"] = {"$gte": start}
+    if end:
+        match.setdefault("bucket", {})["$lte"] = end
+    return match
+
+
+def _sum_fields() -> Dict:
+    return {field: {"$sum": f"${field}"} for field in ROLLUP_FIELDS}
+
+
+def read_rollups(granularity: str, start: str = "", end: str = "",
+                 group_by: Optional[Iterable[str]] = None) -> List[Dict]:
+    """
+    Sum rollup buckets between two bucket keys, grouped by any of
+    bucket/terminal/cashier/price_tier (everything together when group_by is empty).
+    """
+    reporting_db = registry.database("reporting")
+    col = reporting_db[rollup_hourly_col.name if granularity == "hourly" else rollup_daily_col.name]
+    group_by = list(group_by or [])
+    pipeline = [
+        {"$match": _bucket_match(start, end)},
+        {"$group": {"_id": {key: f"${key}" for key in group_by} or None, **_sum_fields()}},
+    ]
+    rows = []
+    for row in col.aggregate(pipeline):
+        key = row.pop("_id") or {}
+        row.update(key)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sales rollup maintenance")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--start-day", default="", help="first store day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end-day", default="", help="last store day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--include-open", action="store_true",
+                        help="also rebuild the current hour and today (pause sales while it runs)")
+    args = parser.parse_args()
+    print(backfill(args.start_day, args.end_day, include_open=args.include_open))
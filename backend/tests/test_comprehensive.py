@@ -565,6 +565,67 @@ def test_advanced_features(results):
         print_error(f"Backup Creation failed: {str(e)}")
         results.add_result("Backup Creation", False, str(e))
 
+def test_incremental_backup_late_sale(results):
+    """A sale uploaded late with an old created_at must land in the next incremental backup"""
+    print_test_header("Incremental Backup - Late Sale")
+    
+    headers = {"Authorization": f"Bearer {results.auth_token}"} if results.auth_token else {}
+    
+    try:
+        response = requests.post(f"{BASE_URL}/backups/create?incremental=true", headers=headers, timeout=60)
+        if response.status_code != 200:
+            print_error(f"Incremental Backup: first backup failed: HTTP {response.status_code}")
+            results.add_result("Incremental Backup Late Sale", False, f"HTTP {response.status_code}")
+            return
+        
+        # As a terminal uploading a sale it rang up offline a week ago
+        late_sale = {
+            "invoice_number": f"LATE-{uuid.uuid4().hex[:8].upper()}",
+            "customer_name": "Test Customer",
+            "items": [
+                {
+                    "product_id": results.test_data.get('product_id', 'test-product-id'),
+                    "sku": "TEST-SKU-001",
+                    "name": "Test Product",
+                    "quantity": 1,
+                    "unit_price": 100.00,
+                    "subtotal": 100.00,
+                    "total": 100.00
+                }
+            ],
+            "subtotal": 100.00,
+            "total_discount": 0.00,
+            "total": 100.00,
+            "payments": [{"method": "cash", "amount": 100.00, "reference": ""}],
+            "status": "completed",
+            "terminal_name": "Test Terminal",
+            "cashier_name": "Test Cashier",
+            "created_at": (datetime.utcnow() - timedelta(days=7)).isoformat(),
+            "notes": "Offline sale uploaded after a backup"
+        }
+        response = requests.post(f"{BASE_URL}/sales", json=late_sale, headers=headers, timeout=10)
+        if response.status_code != 200:
+            print_error(f"Incremental Backup: late sale failed: HTTP {response.status_code}")
+            results.add_result("Incremental Backup Late Sale", False, f"Sale HTTP {response.status_code}")
+            return
+        
+        response = requests.post(f"{BASE_URL}/backups/create?incremental=true", headers=headers, timeout=60)
+        if response.status_code == 200:
+            backup = response.json().get('backup', {})
+            sales = backup.get('counts', {}).get('sales', 0)
+            if backup.get('kind') == 'incremental' and sales >= 1:
+                print_success(f"Incremental Backup: late sale captured ({sales} sales in the delta)")
+                results.add_result("Incremental Backup Late Sale", True, f"{sales} sales in the delta")
+            else:
+                print_error(f"Incremental Backup: late sale missing ({backup.get('kind')}, {sales} sales)")
+                results.add_result("Incremental Backup Late Sale", False, f"{backup.get('kind')} backup, {sales} sales")
+        else:
+            print_error(f"Incremental Backup: second backup failed: HTTP {response.status_code}")
+            results.add_result("Incremental Backup Late Sale", False, f"HTTP {response.status_code}")
+    except Exception as e:
+        print_error(f"Incremental Backup Late Sale failed: {str(e)}")
+        results.add_result("Incremental Backup Late Sale", False, str(e))
+
 def test_reports_analytics(results):
     """Test Reports & Analytics endpoints"""
     print_test_header("Reports & Analytics")
@@ -741,6 +802,7 @@ def run_comprehensive_tests():
     test_sales_operations(results)
     test_user_management(results)
     test_advanced_features(results)
+    test_incremental_backup_late_sale(results)
     test_reports_analytics(results)
     test_edge_cases(results)
     check_mongodb_serialization(results)
@@ -0,0 +1,110 @@
+"""
+Unit tests for the in-memory product search index
+
+    cd backend
+    python -m pytest tests/test_product_search.py
+"""
+
+from services.product_search import EXACT, FIELD_WEIGHTS, INFIX, PREFIX, SearchIndex, normalize, rank, tokenize
+
+
+def build(*products):
+    index = SearchIndex()
+    for product in products:
+        index.add(product)
+    return index
+
+
+def test_normalize_folds_case_and_drops_zero_width_joiners():
+    assert normalize("RICE") == "rice"
+    # ක්‍රීම් typed with and without ZWJ
+    assert normalize("ක්‍රීම්") == normalize("ක්රීම්")
+
+
+def test_tokenize_keeps_sinhala_and_tamil_words_whole():
+    assert tokenize("Samba Rice සම්බා சம்பா") == ["samba", "rice", "සම්බා", "சம்பா"]
+
+
+def test_prefix_matches_are_not_truncated():
+    index = build(*({"id": f"p{i}", "sku": f"SKU{i:05d}", "barcodes": [f"479{i:07d}"]} for i in range(5000)))
+
+    assert len(index.search("sku0")) == 5000
+    assert len(index.search("479")) == 5000
+    assert len(index.search("sku01")) == 1000
+
+
+def test_prefix_range_stops_at_the_next_token():
+    index = build({"id": "a", "name_en": "rice"}, {"id": "b", "name_en": "ricotta"}, {"id": "c", "name_en": "rid"})
+
+    assert set(index.search("ric")) == {"a", "b"}
+
+
+def test_exact_beats_prefix_beats_infix():
+    index = build(
+        {"id": "exact", "name_en": "cream"},
+        {"id": "prefix", "name_en": "creamer"},
+        {"id": "infix", "name_en": "icecream"},
+    )
+    scores = index.search("cream")
+    weight = FIELD_WEIGHTS["name_en"]
+
+    assert scores == {"exact": weight * EXACT, "prefix": weight * PREFIX, "infix": weight * INFIX}
+    assert [pid for pid, _ in rank(scores, 3)] == ["exact", "prefix", "infix"]
+
+
+def test_codes_outrank_names():
+    index = build({"id": "named", "name_en": "tea"}, {"id": "coded", "sku": "TEA"})
+
+    assert rank(index.search("tea"), 1) == [("coded", FIELD_WEIGHTS["sku"] * EXACT)]
+
+
+def test_every_word_must_match():
+    index = build({"id": "a", "name_en": "coconut oil"}, {"id": "b", "name_en": "coconut milk"})
+
+    assert set(index.search("coconut oil")) == {"a"}
+    assert index.search("coconut butter") == {}
+
+
+def test_code_typed_in_full_with_separators_ranks_first():
+    index = build({"id": "a", "sku": "AB-100"}, {"id": "b", "sku": "AB-1000"})
+    scores = index.search("AB-100")
+
+    assert rank(scores, 1)[0][0] == "a"
+    assert "b" in scores
+
+
+def test_updating_and_removing_a_product_updates_its_tokens():
+    index = build({"id": "a", "name_en": "sugar"})
+    index.add({"id": "a", "name_en": "salt"})
+
+    assert index.search("sugar") == {}
+    assert set(index.search("salt")) == {"a"}
+
+    index.remove("a")
+    assert index.search("salt") == {}
+    assert len(index) == 0
+    assert index.sorted_tokens == []
+    assert index.trigrams == {}
+
+
+def test_rank_returns_the_best_first():
+    assert rank({"a": 1, "b": 3, "c": 2}, 2) == [("b", 3), ("c", 2)]
+
+
+def test_copy_is_independent_of_the_original():
+    index = build({"id": "a", "name_en": "sugar"})
+    clone = index.copy()
+    clone.add({"id": "a", "name_en": "salt"})
+    clone.add({"id": "b", "name_en": "sugar cane"})
+
+    assert set(index.search("sugar")) == {"a"}
+    assert index.search("salt") == {}
+    assert set(clone.search("sugar")) == {"b"}
+
+
+def test_changes_ignores_fields_that_are_not_indexed():
+    index = build({"id": "a", "name_en": "sugar", "stock": 5})
+
+    assert not index.changes({"id": "a", "name_en": "sugar", "stock": 4})
+    assert index.changes({"id": "a", "name_en": "brown sugar", "stock": 4})
+    assert index.changes({"id": "b", "name_en": "sugar"})
@@ -1,17 +1,26 @@
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+import hashlib
 import os
+import threading
+import time
+
+from services.password_service import pwd_context
 
 # Security configuration
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 43200  # 30 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated users are served from memory for this long after their last load
+USER_CACHE_SECONDS = float(os.environ.get('AUTH_USER_CACHE_SECONDS', '60'))
+# How often each worker reads revocations written by the others
+REVOCATION_SYNC_SECONDS = float(os.environ.get('AUTH_REVOCATION_SYNC_SECONDS', '2'))
+REVOCATION_OVERLAP_SECONDS = 5
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
 
@@ -32,15 +41,134 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class SessionCache:
+    """
+    Authenticated users by token subject, so authorizing a request is a
+    dictionary lookup rather than a users query. Entries live for
+    USER_CACHE_SECONDS.
+
+    Logging out revokes that one token; deactivating a user revokes every
+    token issued to them before that moment; updating a user drops the
+    cached copy. Revocations are stored in Mongo and every worker reads
+    new ones at most every AUTH_REVOCATION_SYNC_SECONDS, applying its own
+    immediately.
+    """
+
+    def __init__(self):
+        self._users: Dict[str, Tuple[float, Dict]] = {}
+        self._revoked_tokens: Dict[str, float] = {}  # token hash -> token expiry
+        self._revoked_before: Dict[str, int] = {}  # username -> tokens issued earlier are invalid
+        self._synced_at = 0.0
+        self._read_until: Optional[datetime] = None
+        self._lock = threading.Lock()
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from utils.database import db
+            collection = db['auth_revocations']
+            collection.create_index([('at', 1)])
+            collection.create_index([('expires_at', 1)], expireAfterSeconds=0)
+            self._collection = collection
+        return self._collection
+
+    def user(self, username: str) -> Optional[Dict]:
+        """The user without password, from memory when loaded recently"""
+        from utils.database import users_col
+
+        cached = self._users.get(username)
+        if cached and time.monotonic() - cached[0] < USER_CACHE_SECONDS:
+            return cached[1]
+        user = users_col.find_one({"username": username}, {"_id": 0, "password": 0})
+        if user is None:
+            self._users.pop(username, None)
+        else:
+            self._users[username] = (time.monotonic(), user)
+        return user
+
+    def is_revoked(self, token: str, payload: Dict) -> bool:
+        self._sync()
+        if self._revoked_before.get(payload.get("sub"), 0) > payload.get("iat", 0):
+            return True
+        return token_hash(token) in self._revoked_tokens
+
+    def revoke_token(self, token: str, payload: Dict):
+        """Invalidate one token, e.g. on logout"""
+        expires_at = datetime.fromtimestamp(payload.get("exp", time.time()), timezone.utc)
+        self._write({"kind": "token", "token_hash": token_hash(token), "username": payload.get("sub"),
+                     "expires_at": expires_at})
+
+    def revoke_user(self, username: str):
+        """Invalidate every token issued to username so far"""
+        self._write({"kind": "user", "username": username,
+                     "expires_at": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)})
+
+    def invalidate_user(self, username: str):
+        """Reload username on its next request, e.g. after a role change"""
+        self._write({"kind": "refresh", "username": username,
+                     "expires_at": datetime.now(timezone.utc) + timedelta(seconds=USER_CACHE_SECONDS * 2)})
+
+    def _write(self, revocation: Dict):
+        revocation["at"] = datetime.now(timezone.utc)
+        self.collection.insert_one(revocation)
+        self._apply(revocation)
+
+    def _apply(self, revocation: Dict):
+        username = revocation.get("username")
+        self._users.pop(username, None)
+        if revocation["kind"] == "token":
+            expires_at = revocation["expires_at"]
+            if not expires_at.tzinfo:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._revoked_tokens[revocation["token_hash"]] = expires_at.timestamp()
+        elif revocation["kind"] == "user":
+            at = revocation["at"] if revocation["at"].tzinfo else revocation["at"].replace(tzinfo=timezone.utc)
+            # Whole seconds like iat, so a login in the same second after re-activation is not refused
+            self._revoked_before[username] = max(self._revoked_before.get(username, 0), int(at.timestamp()))
+
+    def _sync(self):
+        if time.monotonic() - self._synced_at < REVOCATION_SYNC_SECONDS:
+            return
+        with self._lock:
+            if time.monotonic() - self._synced_at < REVOCATION_SYNC_SECONDS:
+                return
+            started = datetime.now(timezone.utc)
+            query = {}
+            if self._read_until is not None:
+                # Overlap so writes that committed out of order are not missed
+                query = {"at": {"$gte": self._read_until - timedelta(seconds=REVOCATION_OVERLAP_SECONDS)}}
+            for revocation in self.collection.find(query, {"_id": 0}):
+                self._apply(revocation)
+            now = time.time()
+            self._revoked_tokens = {digest: expiry for digest, expiry in self._revoked_tokens.items() if expiry > now}
+            self._read_until = started
+            self._synced_at = time.monotonic()
+
+
+# Shared by server.py and the routers
+sessions = SessionCache()
+
+
+def authenticate(token: str, payload: Dict) -> Optional[Dict]:
+    """The active user a decoded token belongs to, or None if revoked or unknown"""
+    username = payload.get("sub")
+    if username is None or sessions.is_revoked(token, payload):
+        return None
+    return sessions.user(username)
+
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
     """Dependency to get current authenticated user"""
-    from utils.database import users_col
-    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -48,13 +176,12 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     )
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    user = users_col.find_one({"username": username}, {"_id": 0})
+    user = authenticate(token, payload)
     if user is None:
         raise credentials_exception
+    if not user.get("active", True):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User account is inactive")
     return user
@@ -1,11 +1,230 @@
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING, monitoring, ReadPreference
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Dict
 import os
+import threading
+import time
+
+from utils.metrics import CommandMetrics, Gauge
+from utils.query_log import QueryAccounting
 
 # Database connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
 DATABASE_NAME = os.environ.get('DATABASE_NAME', 'pos_system')
-client = MongoClient(MONGO_URL, maxPoolSize=50, minPoolSize=10)
-db = client[DATABASE_NAME]
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+# Connection pool settings shared by every client in the process
+POOL_OPTIONS = {
+    "maxPoolSize": _env_int('MONGO_MAX_POOL_SIZE', 50),
+    "minPoolSize": _env_int('MONGO_MIN_POOL_SIZE', 10),
+    "maxIdleTimeMS": _env_int('MONGO_MAX_IDLE_TIME_MS', 30000),
+    "waitQueueTimeoutMS": _env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000),
+    "serverSelectionTimeoutMS": _env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+    "connectTimeoutMS": _env_int('MONGO_CONNECT_TIMEOUT_MS', 10000),
+    "socketTimeoutMS": _env_int('MONGO_SOCKET_TIMEOUT_MS', 30000),
+    "retryWrites": True,
+}
+
+# Workload classes. Each one gets database handles with its own read/write
+# concerns on the shared pool; setting MONGO_<CLASS>_MAX_POOL_SIZE gives a
+# class a dedicated pool instead (e.g. to keep reports from starving checkout).
+WORKLOADS = {
+    # Checkout, catalog and user writes
+    "default": {
+        "write_concern": WriteConcern(w=os.environ.get('MONGO_DEFAULT_W', 'majority')),
+        "read_preference": ReadPreference.PRIMARY,
+    },
+    # Reports and exports - tolerate slightly stale reads from secondaries
+    "reporting": {
+        "read_preference": ReadPreference.SECONDARY_PREFERRED,
+        "read_concern": ReadConcern("local"),
+    },
+    # Imports, ledgers and backups - large batches, acknowledged by the primary only
+    "bulk": {
+        "write_concern": WriteConcern(w=1),
+        "read_preference": ReadPreference.PRIMARY,
+    },
+}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Collects live connection pool statistics for one client"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        # Checkout started/finished events fire on the requesting thread
+        self._local = threading.local()
+        self.open_connections = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_timeouts = 0
+        self.wait_time_total_ms = 0.0
+        self.wait_time_max_ms = 0.0
+        self.pool_cleared_events = 0
+        self.last_pool_cleared_at = None
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_cleared_events += 1
+            self.last_pool_cleared_at = time.time()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _wait_ms(self) -> float:
+        started = getattr(self._local, 'started', None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started else 0.0
+
+    def connection_check_out_failed(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.checkout_failures += 1
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self.checkout_timeouts += 1
+            self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+
+    def connection_checked_out(self, event):
+        wait_ms = self._wait_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.wait_time_total_ms += wait_ms
+            self.wait_time_max_ms = max(self.wait_time_max_ms, wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_timeouts": self.checkout_timeouts,
+                "avg_wait_ms": round(self.wait_time_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.wait_time_max_ms, 3),
+                "pool_cleared_events": self.pool_cleared_events,
+                "last_pool_cleared_at": self.last_pool_cleared_at,
+            }
+
+
+class ConnectionRegistry:
+    """
+    Process-wide registry of MongoDB clients.
+
+    Every module gets its database handles from here, so the process runs a
+    single sync pool and a single async (Motor) pool unless a workload class
+    is explicitly given a dedicated pool.
+    """
+
+    def __init__(self, url: str, database_name: str):
+        self.url = url
+        self.database_name = database_name
+        self._clients: Dict[str, MongoClient] = {}
+        self._async_clients: Dict[str, AsyncIOMotorClient] = {}
+        self._listeners: Dict[str, PoolStatsListener] = {}
+        self._command_listeners = [CommandMetrics(), QueryAccounting()]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _pool_key(workload: str) -> str:
+        return workload if os.environ.get(f'MONGO_{workload.upper()}_MAX_POOL_SIZE') else "default"
+
+    @staticmethod
+    def _pool_options(pool_key: str) -> Dict:
+        options = dict(POOL_OPTIONS)
+        if pool_key != "default":
+            options["maxPoolSize"] = _env_int(f'MONGO_{pool_key.upper()}_MAX_POOL_SIZE', options["maxPoolSize"])
+            options["minPoolSize"] = min(options["minPoolSize"], options["maxPoolSize"])
+        return options
+
+    def _get_or_create(self, clients: Dict, factory, kind: str, workload: str):
+        pool_key = self._pool_key(workload)
+        with self._lock:
+            if pool_key not in clients:
+                listener = PoolStatsListener(f"{kind}:{pool_key}")
+                self._listeners[listener.name] = listener
+                clients[pool_key] = factory(
+                    self.url, event_listeners=[listener, *self._command_listeners], **self._pool_options(pool_key)
+                )
+            return clients[pool_key]
+
+    def client(self, workload: str = "default") -> MongoClient:
+        return self._get_or_create(self._clients, MongoClient, "sync", workload)
+
+    def async_client(self, workload: str = "default") -> AsyncIOMotorClient:
+        return self._get_or_create(self._async_clients, AsyncIOMotorClient, "async", workload)
+
+    def database(self, workload: str = "default"):
+        """Sync database handle with the workload's read/write concerns"""
+        return self.client(workload).get_database(self.database_name, **WORKLOADS[workload])
+
+    def async_database(self, workload: str = "default"):
+        """Motor database handle with the workload's read/write concerns"""
+        return self.async_client(workload).get_database(self.database_name, **WORKLOADS[workload])
+
+    def pool_stats(self) -> Dict:
+        with self._lock:
+            listeners = list(self._listeners.values())
+        return {
+            "max_pool_size": POOL_OPTIONS["maxPoolSize"],
+            "pools": {listener.name: listener.snapshot() for listener in listeners}
+        }
+
+
+registry = ConnectionRegistry(MONGO_URL, DATABASE_NAME)
+
+Gauge(
+    "pos_mongo_pool_connections", "MongoDB connections per client pool: open and checked out",
+    lambda: {
+        (name, state): pool[state]
+        for name, pool in registry.pool_stats()["pools"].items()
+        for state in ("open_connections", "checked_out")
+    },
+    ("pool", "state")
+)
+
+client = registry.client()
+db = registry.database()
+
+# Non-blocking handle for `async def` route handlers - calling the sync
+# client from a coroutine stalls the whole event loop
+async_client = registry.async_client()
+async_db = registry.async_database()
 
 print(f"✅ MongoDB connected successfully to {db.name}")
 
@@ -30,7 +249,20 @@ adjustment_requests_col = db['adjustment_requests']
 products_col.create_index([('sku', ASCENDING)], unique=True)
 products_col.create_index([('barcodes', ASCENDING)])
 sales_col.create_index([('invoice_number', ASCENDING)], unique=True)
+# Date-ranged report pipelines ($match on completed sales) and their product $lookup
+sales_col.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+products_col.create_index([('id', ASCENDING)])
+# Product cache polling for changes made by other workers
+products_col.create_index([('updated_at', ASCENDING)])
 customers_col.create_index([('phone', ASCENDING)])
+# Keyset pagination sort keys (see utils/pagination.py)
+products_col.create_index([('active', ASCENDING), ('sku', ASCENDING)])
+sales_col.create_index([('created_at', DESCENDING), ('id', DESCENDING)])
+sales_col.create_index([('status', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)])
+customers_col.create_index([('active', ASCENDING), ('name', ASCENDING), ('id', ASCENDING)])
+suppliers_col.create_index([('active', ASCENDING), ('name', ASCENDING), ('id', ASCENDING)])
+inventory_logs_col.create_index([('created_at', DESCENDING), ('id', DESCENDING)])
+inventory_logs_col.create_index([('product_id', ASCENDING), ('created_at', DESCENDING), ('id', DESCENDING)])
 users_col.create_index([('username', ASCENDING)], unique=True)
 
 
@@ -0,0 +1,268 @@
+"""
+Prometheus metrics
+
+A small in-process registry rendered in the Prometheus text format at
+/metrics: request latency histograms per route template, requests in
+flight, the sync-handler thread pool, MongoDB command latency (through a
+pymongo CommandListener registered on every client) and business counters.
+
+Each worker process keeps its own numbers; scrape every worker, or sum
+them in the query. The *_per_minute gauges are a convenience for
+dashboards without PromQL; alert on rate() of the *_total counters.
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import threading
+import time
+
+import anyio.to_thread
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_metrics: List["Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def samples(self) -> Iterable[str]:
+        return []
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in sorted(values):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """A value read when rendering, from a callback returning {label values: value}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], Dict[Tuple, float]],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self.read = read
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in sorted(self.read().items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        # label values -> per-bucket counts (last one is +Inf), then the sum
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(label_values, list(values)) for label_values, values in self._series.items()]
+        names = self.labels + ("le",)
+        for label_values, values in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket{_format_labels(names, label_values + (le,))} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(values[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class RateWindow:
+    """Events over the last minute, in one-second slots"""
+
+    def __init__(self, seconds: int = 60):
+        self.seconds = seconds
+        self._slots = [0] * seconds
+        self._stamps = [0] * seconds
+        self._lock = threading.Lock()
+
+    def add(self, count: int = 1):
+        now = int(time.monotonic())
+        slot = now % self.seconds
+        with self._lock:
+            if self._stamps[slot] != now:
+                self._stamps[slot] = now
+                self._slots[slot] = 0
+            self._slots[slot] += count
+
+    def total(self) -> int:
+        now = int(time.monotonic())
+        with self._lock:
+            return sum(count for count, stamp in zip(self._slots, self._stamps) if now - stamp < self.seconds)
+
+
+# ==================== HTTP ====================
+
+http_request_duration = Histogram(
+    "pos_http_request_duration_seconds", "HTTP request latency by route template",
+    ("method", "route", "status")
+)
+_in_flight = {"count": 0}
+http_requests_in_flight = Gauge(
+    "pos_http_requests_in_flight", "HTTP requests currently being handled",
+    lambda: {(): _in_flight["count"]}
+)
+
+
+class MetricsMiddleware:
+    """Times every HTTP request under its route template (/api/products/{product_id})"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        _in_flight["count"] += 1
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _in_flight["count"] -= 1
+            route = scope.get("route")
+            http_request_duration.observe(time.perf_counter() - started, scope["method"],
+                                          getattr(route, "path", "unmatched"), status["code"])
+
+
+# ==================== THREAD POOL ====================
+
+def _thread_pool() -> Dict[Tuple, float]:
+    """The limiter sync handlers run under; only readable from the event loop thread"""
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:
+        return {}
+    return {
+        ("capacity",): limiter.total_tokens,
+        ("busy",): limiter.borrowed_tokens,
+        ("queued",): limiter.statistics().tasks_waiting,
+    }
+
+
+threadpool_threads = Gauge(
+    "pos_threadpool_threads", "Sync handler thread pool: capacity, busy threads and queued calls",
+    _thread_pool, ("state",)
+)
+
+
+# ==================== MONGODB ====================
+
+mongo_command_duration = Histogram(
+    "pos_mongo_command_duration_seconds", "MongoDB command latency by command name",
+    ("command",), COMMAND_BUCKETS
+)
+mongo_command_failures = Counter(
+    "pos_mongo_command_failures_total", "MongoDB commands that failed, by command name", ("command",)
+)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Feeds command latency and failures into the metrics above"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        mongo_command_duration.observe(event.duration_micros / 1e6, event.command_name)
+        mongo_command_failures.inc(event.command_name)
+
+
+# ==================== BUSINESS ====================
+
+sales_total = Counter("pos_sales_total", "Sales created, by status", ("status",))
+_sales_window = RateWindow()
+sales_per_minute = Gauge("pos_sales_per_minute", "Sales created in the last 60 seconds",
+                         lambda: {(): _sales_window.total()})
+
+scan_lookups_total = Counter("pos_scan_lookups_total", "Barcode scan lookups, by result", ("result",))
+_scans_window = RateWindow()
+scan_lookups_per_minute = Gauge("pos_scan_lookups_per_minute", "Barcode scan lookups in the last 60 seconds",
+                                lambda: {(): _scans_window.total()})
+
+
+def record_sale(status: str):
+    sales_total.inc(status)
+    _sales_window.add()
+
+
+def record_scan(found: bool):
+    scan_lookups_total.inc("hit" if found else "miss")
+    _scans_window.add()
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in list(_metrics):
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            # One broken callback should not take the whole scrape down
+            lines.append(f"# {metric.name} unavailable: {str(e)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,106 @@
+"""
+Keyset (cursor) pagination
+
+List endpoints page on an indexed sort key instead of skip: the cursor
+carries the sort values of the last row returned, and the next page starts
+strictly after them, so every page costs one index seek however deep it
+is. Sort keys always end with a unique field (id or sku) so rows with equal
+leading values are neither repeated nor skipped.
+
+Totals are optional because counting a filtered collection is itself a
+scan. "cached" keeps an exact count per query for COUNT_CACHE_SECONDS,
+"estimated" reads the collection's metadata count (ignores filters),
+"exact" counts every time and "none" leaves the total out.
+"""
+
+from typing import Dict, List, Optional, Tuple
+import base64
+import os
+import threading
+import time
+
+from bson import json_util
+from fastapi import HTTPException
+
+COUNT_CACHE_SECONDS = float(os.environ.get('COUNT_CACHE_SECONDS', '30'))
+COUNT_MODES = ("cached", "estimated", "exact", "none")
+
+Sort = List[Tuple[str, int]]
+
+_count_cache: Dict[str, Tuple[float, int]] = {}
+_count_lock = threading.Lock()
+
+
+def encode_cursor(values: List) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, sort: Sort) -> List:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def after(sort: Sort, values: List) -> Dict:
+    """Filter for rows strictly after values in sort order"""
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        branch = {sort[j][0]: values[j] for j in range(i)}
+        branch[field] = {"$gt" if direction > 0 else "$lt": values[i]}
+        branches.append(branch)
+    return {"$or": branches}
+
+
+def count(collection, query: Dict, mode: str) -> Optional[int]:
+    if mode == "none":
+        return None
+    if mode == "estimated":
+        return collection.estimated_document_count()
+    if mode == "exact":
+        return collection.count_documents(query)
+
+    key = f"{collection.name}:{json_util.dumps(query, sort_keys=True)}"
+    cached = _count_cache.get(key)
+    if cached and time.monotonic() - cached[0] < COUNT_CACHE_SECONDS:
+        return cached[1]
+    total = collection.count_documents(query)
+    with _count_lock:
+        if len(_count_cache) >= 1000:
+            # Search filters make many one-off keys; start over rather than grow
+            _count_cache.clear()
+        _count_cache[key] = (time.monotonic(), total)
+    return total
+
+
+def keyset_page(collection, query: Dict, sort: Sort, limit: int, cursor: str = "", skip: int = 0,
+                projection: Optional[Dict] = None, total: str = "cached") -> Dict:
+    """
+    One page of collection matching query in sort order. Returns the rows,
+    next_cursor (None on the last page) and total per the count mode.
+    skip is still honoured for clients that have not moved to cursors.
+    """
+    if total not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail=f"total must be one of {', '.join(COUNT_MODES)}")
+
+    page_query = query
+    if cursor:
+        page_query = {"$and": [query, after(sort, decode_cursor(cursor, sort))]} if query else \
+            after(sort, decode_cursor(cursor, sort))
+
+    find = collection.find(page_query, projection or {"_id": 0}).sort(sort)
+    if skip and not cursor:
+        find = find.skip(skip)
+    # One extra row tells whether another page exists without counting
+    rows = list(find.limit(limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "items": rows,
+        "next_cursor": encode_cursor([rows[-1].get(field) for field, _ in sort]) if more and rows else None,
+        "total": count(collection, query, total)
+    }
@@ -0,0 +1,283 @@
+"""
+On-demand request profiling
+
+A manager adds ?profile=1 or an X-Profile: 1 header to any API request and
+the endpoint runs under a sampling profiler. The response carries an
+X-Profile-Id header; the result is kept in memory (the last PROFILE_KEEP
+runs) and served at /api/profiles/{id}.
+
+pyinstrument is used when installed and gives an HTML call tree. Without
+it, a built-in sampler reads the handler thread's stack every
+PROFILE_INTERVAL_SECONDS and produces a text call tree plus folded stacks
+for flamegraph.pl or speedscope.
+
+Profiling covers the endpoint function itself, not dependency resolution
+or response serialisation. For sync endpoints that is the thread pool
+thread it runs on. For async ones, pyinstrument follows the coroutine
+across awaits; the built-in sampler keeps only samples taken while the
+endpoint's frame is on the event loop thread's stack.
+
+instrument(app) wraps every endpoint once at startup. A request that is
+not being profiled pays for one context variable read.
+"""
+
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+import asyncio
+import functools
+import os
+import sys
+import threading
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+try:
+    from pyinstrument import Profiler
+    PYINSTRUMENT_AVAILABLE = True
+except ImportError:
+    PYINSTRUMENT_AVAILABLE = False
+
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_SECONDS', '0.001'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '20'))
+# Call tree branches below this share of samples are left out of the text view
+TREE_MIN_SHARE = 0.01
+
+
+class Session:
+    """One profiled request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route = ""
+        self.started_at = time.time()
+        self.duration_ms = 0.0
+        self.engine = "pyinstrument" if PYINSTRUMENT_AVAILABLE else "sampler"
+        self.html: Optional[str] = None
+        self.text: Optional[str] = None
+        self.stacks: Counter = Counter()
+
+    def summary(self) -> Dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 1),
+            "engine": self.engine,
+            "samples": sum(self.stacks.values()) if self.stacks else None
+        }
+
+    def folded(self) -> str:
+        """Folded stacks ("outer;inner count" per line) for flamegraph tools"""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def tree(self) -> str:
+        """Indented call tree with the share of samples under each call"""
+        total = sum(self.stacks.values())
+        if not total:
+            return "No samples (the endpoint finished within one sampling interval)\n"
+        root: Dict = {}
+        for stack, count in self.stacks.items():
+            node = root
+            for frame in stack:
+                entry = node.setdefault(frame, [0, {}])
+                entry[0] += count
+                node = entry[1]
+
+        lines = [f"{self.method} {self.path}: {self.duration_ms:.1f} ms, {total} samples"]
+
+        def walk(node: Dict, depth: int):
+            for frame, (count, children) in sorted(node.items(), key=lambda item: -item[1][0]):
+                if count / total < TREE_MIN_SHARE:
+                    continue
+                lines.append(f"{'  ' * depth}{count / total:6.1%}  {frame}")
+                walk(children, depth + 1)
+
+        walk(root, 0)
+        return "\n".join(lines) + "\n"
+
+
+class Sampler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id: int, focus):
+        self.thread_id = thread_id
+        # The endpoint's code object; samples start from its frame
+        self.focus = focus
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(PROFILE_INTERVAL_SECONDS):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                if code is self.focus:
+                    break
+                frame = frame.f_back
+            else:
+                # Not inside the endpoint: another task had the event loop, or it has returned
+                continue
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+_session: ContextVar[Optional[Session]] = ContextVar("profile_session", default=None)
+_profiles: "OrderedDict[str, Session]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+def _store(session: Session):
+    with _profiles_lock:
+        _profiles[session.id] = session
+        while len(_profiles) > PROFILE_KEEP:
+            _profiles.popitem(last=False)
+
+
+def profiles() -> List[Dict]:
+    with _profiles_lock:
+        return [session.summary() for session in reversed(_profiles.values())]
+
+
+def get(profile_id: str) -> Optional[Session]:
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def _profile_sync(session: Session, call: Callable, args, kwargs):
+    if PYINSTRUMENT_AVAILABLE:
+        profiler = Profiler(interval=PROFILE_INTERVAL_SECONDS)
+        profiler.start()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profiler.stop()
+            session.html = profiler.output_html()
+            session.text = profiler.output_text()
+    sampler = Sampler(threading.get_ident(), focus=call.__code__)
+    sampler.start()
+    try:
+        return call(*args, **kwargs)
+    finally:
+        session.stacks = sampler.stop()
+
+
+async def _profile_async(session: Session, call: Callable, args, kwargs):
+    if PYINSTRUMENT_AVAILABLE:
+        profiler = Profiler(interval=PROFILE_INTERVAL_SECONDS, async_mode="enabled")
+        profiler.start()
+        try:
+            return await call(*args, **kwargs)
+        finally:
+            profiler.stop()
+            session.html = profiler.output_html()
+            session.text = profiler.output_text()
+    sampler = Sampler(threading.get_ident(), focus=call.__code__)
+    sampler.start()
+    try:
+        return await call(*args, **kwargs)
+    finally:
+        session.stacks = sampler.stop()
+
+
+def _wrap(call: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def profiled(*args, **kwargs):
+            session = _session.get()
+            if session is None:
+                return await call(*args, **kwargs)
+            return await _profile_async(session, call, args, kwargs)
+    else:
+        @functools.wraps(call)
+        def profiled(*args, **kwargs):
+            session = _session.get()
+            if session is None:
+                return call(*args, **kwargs)
+            return _profile_sync(session, call, args, kwargs)
+    profiled.__profiled__ = True
+    return profiled
+
+
+def instrument(app):
+    """Make every endpoint of app profilable; call once all routers are included"""
+    for route in app.routes:
+        dependant = getattr(route, "dependant", None)
+        if dependant is None or getattr(dependant.call, "__profiled__", False):
+            continue
+        # Request handlers look the endpoint up on the dependant at call time
+        dependant.call = _wrap(dependant.call)
+
+
+def _requested(scope) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"x-profile" and value not in (b"", b"0", b"false"):
+            return True
+    query = scope.get("query_string", b"")
+    if b"profile=" not in query:
+        return False
+    return parse_qs(query.decode("latin-1")).get("profile", [""])[-1] in ("1", "true")
+
+
+class ProfilerMiddleware:
+    """
+    Starts a profiling session for requests asking for one. authorize
+    receives the bearer token and decides whether its user may profile
+    (managers only); other requests run as if no flag were given.
+    """
+
+    def __init__(self, app, authorize: Callable[[str], bool]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope) or not await self._allowed(scope):
+            await self.app(scope, receive, send)
+            return
+
+        session = Session(scope["method"], scope["path"])
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []),
+                                                   (b"x-profile-id", session.id.encode("ascii"))]}
+            await send(message)
+
+        token = _session.set(session)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _session.reset(token)
+            session.duration_ms = (time.perf_counter() - started) * 1000
+            session.route = getattr(scope.get("route"), "path", "")
+            _store(session)
+            print(f"🔬 Profiled {session.method} {session.path} in {session.duration_ms:.0f} ms "
+                  f"(/api/profiles/{session.id})")
+
+    async def _allowed(self, scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == b"authorization" and value[:7].lower() == b"bearer ":
+                try:
+                    return await run_in_threadpool(self.authorize, value[7:].decode("latin-1"))
+                except Exception:
+                    return False
+        return False
@@ -0,0 +1,227 @@
+"""
+Per-request database accounting and slow-query log
+
+A middleware opens an accounting record for every HTTP request in a
+context variable. A pymongo CommandListener adds each command to the
+record of the request that issued it: sync handlers run in the thread pool
+with a copy of the request's context, so the listener, which fires on the
+thread running the command, sees the same record.
+
+Commands are grouped by shape: command, collection and filter fields with
+the values left out, e.g. "find products {id: ?}". Counting shapes is what
+exposes N+1 loops: one shape repeated once per cart line or imported row.
+
+A request is logged as slow when it makes more than SLOW_REQUEST_DB_CALLS
+round trips, spends more than SLOW_REQUEST_DB_MS in the database, or takes
+longer than SLOW_REQUEST_MS overall. Any single command slower than
+SLOW_QUERY_MS is logged too, whether or not a request issued it. The most
+recent entries are kept for /api/health/slow-requests, and every request
+feeds the pos_http_request_db_calls histogram in /metrics.
+
+Server-Sent Events streams (/api/sync/stream) stay open for as long as a
+terminal is connected, so they are left out of both once their response
+starts, as are WebSockets.
+"""
+
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+import os
+import time
+
+from pymongo import monitoring
+
+from utils.metrics import Histogram
+
+SLOW_REQUEST_DB_CALLS = int(os.environ.get('SLOW_REQUEST_DB_CALLS', '25'))
+SLOW_REQUEST_DB_MS = float(os.environ.get('SLOW_REQUEST_DB_MS', '250'))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+SLOW_LOG_SIZE = int(os.environ.get('SLOW_LOG_SIZE', '100'))
+# Shapes listed per slow request; the rest are summed up as "other"
+MAX_SHAPES = 10
+# Long-lived responses that are not timed as requests
+STREAMING_CONTENT_TYPES = (b"text/event-stream",)
+
+# Where each command keeps the documents it filters on
+FILTER_FIELDS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "update": ("updates", 0, "q"),
+    "delete": ("deletes", 0, "q"),
+}
+
+db_calls_per_request = Histogram(
+    "pos_http_request_db_calls", "MongoDB commands issued per HTTP request, by route template",
+    ("method", "route"), (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+
+slow_requests: Deque[Dict] = deque(maxlen=SLOW_LOG_SIZE)
+slow_queries: Deque[Dict] = deque(maxlen=SLOW_LOG_SIZE)
+
+
+def _mask(value, depth: int = 0):
+    """The structure of a filter with its values replaced by ?"""
+    if isinstance(value, dict) and depth < 4:
+        return "{" + ", ".join(f"{key}: {_mask(item, depth + 1)}" for key, item in value.items()) + "}"
+    if isinstance(value, list) and value and isinstance(value[0], dict) and depth < 4:
+        # $or / $and branches
+        return "[" + ", ".join(_mask(item, depth + 1) for item in value) + "]"
+    return "?"
+
+
+def query_shape(command_name: str, command: Dict) -> str:
+    collection = command.get(command_name)
+    shape = f"{command_name} {collection}" if isinstance(collection, str) else command_name
+    if command_name == "aggregate":
+        stages = [next(iter(stage), "?") for stage in command.get("pipeline", [])]
+        match = next((stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), None)
+        shape += f" [{', '.join(stages)}]" + (f" {_mask(match)}" if match else "")
+    elif command_name in FILTER_FIELDS:
+        value = command
+        for step in FILTER_FIELDS[command_name]:
+            try:
+                value = value[step]
+            except (KeyError, IndexError, TypeError):
+                value = None
+                break
+        if value:
+            shape += f" {_mask(value)}"
+    return shape[:300]
+
+
+class RequestQueries:
+    __slots__ = ('calls', 'db_ms', 'shapes', 'pending')
+
+    def __init__(self):
+        self.calls = 0
+        self.db_ms = 0.0
+        self.shapes: Dict[str, List] = {}  # shape -> [calls, ms]
+        self.pending: Dict[int, str] = {}  # command request id -> shape
+
+    def top_shapes(self) -> List[Dict]:
+        ranked = sorted(self.shapes.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        shapes = [{"shape": shape, "calls": calls, "ms": round(ms, 1)} for shape, (calls, ms) in ranked[:MAX_SHAPES]]
+        if len(ranked) > MAX_SHAPES:
+            rest = ranked[MAX_SHAPES:]
+            shapes.append({"shape": "other", "calls": sum(entry[1][0] for entry in rest),
+                           "ms": round(sum(entry[1][1] for entry in rest), 1)})
+        return shapes
+
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+# Commands in progress by request id, so a slow one can be described once it finishes
+_commands: Dict[int, Dict] = {}
+
+
+def current() -> Optional[RequestQueries]:
+    return _current.get()
+
+
+class QueryAccounting(monitoring.CommandListener):
+    """Attributes commands to the current request and records slow ones"""
+
+    def started(self, event):
+        _commands[event.request_id] = event.command
+        queries = _current.get()
+        if queries is not None:
+            queries.pending[event.request_id] = query_shape(event.command_name, event.command)
+
+    def _finished(self, event, failed: bool = False):
+        command = _commands.pop(event.request_id, None)
+        ms = event.duration_micros / 1000
+        queries = _current.get()
+        shape = queries.pending.pop(event.request_id, None) if queries is not None else None
+        if queries is not None and shape is not None:
+            queries.calls += 1
+            queries.db_ms += ms
+            totals = queries.shapes.setdefault(shape, [0, 0.0])
+            totals[0] += 1
+            totals[1] += ms
+        if ms >= SLOW_QUERY_MS:
+            if shape is None and command is not None:
+                shape = query_shape(event.command_name, command)
+            entry = {"at": time.time(), "shape": shape or event.command_name, "ms": round(ms, 1),
+                     "failed": failed}
+            slow_queries.append(entry)
+            print(f"🐢 Slow query ({entry['ms']} ms): {entry['shape']}")
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+
+class QueryLogMiddleware:
+    """Opens the per-request accounting record and logs requests that cross the slow thresholds"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        queries = RequestQueries()
+        token = _current.set(queries)
+        started = time.perf_counter()
+        streaming = False
+
+        async def send_start(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                if content_type.startswith(STREAMING_CONTENT_TYPES):
+                    # Commands the stream runs from here on are not the request's
+                    streaming = True
+                    _current.set(None)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_start)
+        finally:
+            _current.reset(token)
+            if not streaming:
+                self._account(scope, queries, (time.perf_counter() - started) * 1000)
+
+    def _account(self, scope, queries: RequestQueries, elapsed_ms: float):
+        route = getattr(scope.get("route"), "path", "unmatched")
+        db_calls_per_request.observe(queries.calls, scope["method"], route)
+        if (queries.calls > SLOW_REQUEST_DB_CALLS or queries.db_ms > SLOW_REQUEST_DB_MS
+                or elapsed_ms > SLOW_REQUEST_MS):
+            self._log(scope, route, queries, elapsed_ms)
+
+    @staticmethod
+    def _log(scope, route: str, queries: RequestQueries, elapsed_ms: float):
+        entry = {
+            "at": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route,
+            "ms": round(elapsed_ms, 1),
+            "db_calls": queries.calls,
+            "db_ms": round(queries.db_ms, 1),
+            "shapes": queries.top_shapes()
+        }
+        slow_requests.append(entry)
+        print(f"🐢 Slow request {entry['method']} {entry['path']}: {entry['ms']} ms, "
+              f"{entry['db_calls']} DB calls ({entry['db_ms']} ms)")
+        for shape in entry["shapes"][:3]:
+            print(f"   {shape['calls']}x {shape['shape']} ({shape['ms']} ms)")
+
+
+def report() -> Dict:
+    return {
+        "thresholds": {
+            "db_calls": SLOW_REQUEST_DB_CALLS,
+            "db_ms": SLOW_REQUEST_DB_MS,
+            "request_ms": SLOW_REQUEST_MS,
+            "query_ms": SLOW_QUERY_MS
+        },
+        "slow_requests": list(reversed(slow_requests)),
+        "slow_queries": list(reversed(slow_queries))
+    }
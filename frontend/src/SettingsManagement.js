@@ -65,10 +65,15 @@ function SettingsManagement({ language, getText }) {
     setLoading(true);
     try {
       const response = await axios.post(`${API_URL}/api/backups/create`);
-      setBackupData(response.data.backup);
+      // The response carries only metadata; the data stays on the backup target
+      const backup = response.data.backup || response.data.metadata;
+      setBackupData(backup);
       
       // Download backup as JSON file
-      const blob = new Blob([JSON.stringify(response.data.backup, null, 2)], { type: 'application/json' });
+      const download = await axios.get(`${API_URL}/api/backups/${backup.backup_id}/download`, {
+        responseType: 'blob'
+      });
+      const blob = new Blob([download.data], { type: 'application/json' });
       const url = window.URL.createObjectURL(blob);
       const link = document.createElement('a');
       link.href = url;